@@ -1,8 +1,18 @@
+import asyncio
+import json
 import logging
+import os
+import ssl
+import threading
 from typing import Any, TypedDict
+from urllib.parse import urlsplit
 
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config.tunnel import PendingTunnel, is_local_error, open_tunnel
 
 logger = logging.getLogger(__name__)
 
@@ -25,19 +35,126 @@ class InspectorCountryResponse(TypedDict):
     country: str
 
 
+class InspectorPoolStatsTypedDict(TypedDict):
+    hits: int
+    misses: int
+    proxies: int
+
+
+class AsyncInspectorStatsTypedDict(TypedDict):
+    opened: int
+    reused: int
+
+
+class InspectorAdapter(HTTPAdapter):
+    """HTTPAdapter keeping the connection pools of up to `max_proxies` proxies, the least recently used are closed.
+
+    requests keeps a connection pool for each proxy url the adapter was used with, which grows with every checked proxy
+    otherwise.
+    """
+
+    def __init__(self, max_proxies: int, **kwargs: Any) -> None:
+        self.max_proxies = max_proxies
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        super().__init__(**kwargs)
+
+    def proxy_manager_for(self, proxy: str, **proxy_kwargs: Any) -> Any:
+        with self.lock:
+            if proxy in self.proxy_manager:
+                self.hits += 1
+            else:
+                self.misses += 1
+            manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+            self.proxy_manager[proxy] = self.proxy_manager.pop(proxy)  # most recently used last
+            while len(self.proxy_manager) > self.max_proxies:
+                self.proxy_manager.pop(next(iter(self.proxy_manager))).clear()
+            return manager
+
+
 class Inspector:
-    """Inspector helper class for sending requests to INSPECTOR_URL."""
+    """Inspector helper class for sending requests to INSPECTOR_URL.
+
+    Requests are sent with a single keep-alive `requests.Session` per worker process, shared by all the proxies, whose
+    adapter keeps the connection pools of the `max_proxies` most recently used proxies.
+    """
 
-    def __init__(self, inspector_url: str = settings.INSPECTOR_URL, timeout: int = 10) -> None:
+    def __init__(
+        self,
+        inspector_url: str = settings.INSPECTOR_URL,
+        timeout: int = 10,
+        pool_size: int = settings.INSPECTOR_POOL_SIZE,
+        max_proxies: int = settings.INSPECTOR_MAX_PROXIES,
+        keep_alive: bool = settings.INSPECTOR_KEEP_ALIVE,
+        retries: int = settings.INSPECTOR_RETRIES,
+        retry_backoff: float = settings.INSPECTOR_RETRY_BACKOFF,
+    ) -> None:
         self.inspector_url = inspector_url
         self.timeout = timeout
+        self.pool_size = pool_size
+        self.max_proxies = max_proxies
+        self.keep_alive = keep_alive
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.session: requests.Session | None = None
 
     def get_url(self, endpoint: str) -> str:
         return f"{self.inspector_url}/{endpoint}"
 
+    def create_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=self.retry_backoff,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["GET"],
+            raise_on_status=False,
+        )
+        adapter = InspectorAdapter(self.max_proxies, pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def get_session(self) -> requests.Session:
+        """Returns the session of the worker process, creating it on first use."""
+        with self.lock:
+            if self.pid != os.getpid():  # forked into a new worker process, the sockets can not be shared
+                self.session = None
+                self.pid = os.getpid()
+            if self.session is None:
+                self.session = self.create_session()
+            return self.session
+
+    def get_pool_stats(self) -> InspectorPoolStatsTypedDict:
+        """Returns the number of requests sent through a pooled connection pool of their proxy (hits) or a new one
+        (misses), and the number of proxies with a pool, since the session was created."""
+        with self.lock:
+            adapter = self.session.get_adapter(self.inspector_url) if self.session is not None else None
+        if not isinstance(adapter, InspectorAdapter):
+            return InspectorPoolStatsTypedDict(hits=0, misses=0, proxies=0)
+        with adapter.lock:
+            return InspectorPoolStatsTypedDict(
+                hits=adapter.hits, misses=adapter.misses, proxies=len(adapter.proxy_manager)
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
     def make_request(self, endpoint: str, proxies: dict[str, str] | None = None, **kwargs: Any) -> dict[str, Any]:
+        kwargs.setdefault("timeout", self.timeout)
         try:
-            response = requests.get(self.get_url(endpoint), proxies=proxies, timeout=self.timeout, **kwargs)
+            session = self.get_session()
+            response = session.get(self.get_url(endpoint), proxies=proxies, **kwargs)
             response.raise_for_status()
         except Exception:
             return {}
@@ -56,4 +173,107 @@ class Inspector:
         return InspectorCountryResponse(**response_body)  # type: ignore
 
 
+class AsyncInspector:
+    """Asyncio counterpart of Inspector, sends requests to INSPECTOR_URL through a proxy without blocking.
+
+    Requests are sent over plain asyncio streams, tunnelled through the proxy with HTTP CONNECT, SOCKS4 or SOCKS5,
+    so that thousands of proxies can be checked concurrently from a single event loop.
+
+    Each request goes through another proxy, connections can not be shared between them: a single request is sent per
+    connection (HTTP/1.0, not kept alive). The connection a proxy answered the prefilter handshake on is reused for the
+    request instead of connecting to the proxy again, see PendingTunnel.
+    """
+
+    max_response_size = 65536  # inspector responses are small json bodies
+
+    def __init__(self, inspector_url: str = settings.INSPECTOR_URL, timeout: float = 10) -> None:
+        self.inspector_url = inspector_url
+        self.timeout = timeout
+
+        url = urlsplit(inspector_url)
+        self.is_secure = url.scheme == "https"
+        self.host = url.hostname or ""
+        self.port = url.port or (443 if self.is_secure else 80)
+        self.path = url.path.rstrip("/")
+        self.ssl_context = ssl.create_default_context() if self.is_secure else None
+        self.opened = 0
+        self.reused = 0
+
+    def get_url(self, endpoint: str) -> str:
+        return f"{self.inspector_url}/{endpoint}"
+
+    def get_stats(self) -> AsyncInspectorStatsTypedDict:
+        """Returns the number of connections opened to the proxies, and reused from a prefilter handshake, by all the
+        event loops of the process."""
+        return AsyncInspectorStatsTypedDict(opened=self.opened, reused=self.reused)
+
+    async def make_request(
+        self, endpoint: str, proxy: str, timeout: float | None = None, tunnel: PendingTunnel | None = None
+    ) -> dict[str, Any]:
+        try:
+            async with asyncio.timeout(timeout or self.timeout):
+                return await self.send_request(endpoint, proxy, tunnel)
+        except Exception as error:
+            if is_local_error(error):  # e.g. out of file descriptors, not a failure of the proxy
+                raise
+            return {}
+        finally:
+            if tunnel is not None:
+                tunnel.close()  # closed when the request is sent without it, or failed before opening it
+
+    async def send_request(self, endpoint: str, proxy: str, tunnel: PendingTunnel | None = None) -> dict[str, Any]:
+        """Sends a GET request to the endpoint through the proxy (protocol://ip:port) and returns the json body.
+
+        The pending `tunnel` of the proxy, if any, is completed and used instead of connecting to the proxy again.
+        """
+        url = urlsplit(proxy)
+        protocol, proxy_host, proxy_port = url.scheme, url.hostname or "", url.port or 0
+
+        if protocol in ["http", "https"] and not self.is_secure:
+            # plain http through a http proxy is forwarded by the proxy itself, no tunnel required
+            reader, writer = await asyncio.open_connection(proxy_host, proxy_port)
+            target = self.get_url(endpoint)
+            self.opened += 1
+        elif tunnel is not None and tunnel.protocol == protocol:
+            reader, writer = await tunnel.open()
+            target = f"{self.path}/{endpoint}"
+            self.reused += 1
+        else:
+            reader, writer = await open_tunnel(protocol, proxy_host, proxy_port, self.host, self.port)
+            target = f"{self.path}/{endpoint}"
+            self.opened += 1
+
+        try:
+            if self.ssl_context is not None:
+                await writer.start_tls(self.ssl_context, server_hostname=self.host)
+
+            # HTTP/1.0 so the response is neither chunked nor kept alive, the body is read until the connection closes
+            request = f"GET {target} HTTP/1.0\r\nHost: {self.host}\r\nAccept: application/json\r\n\r\n"
+            writer.write(request.encode())
+            await writer.drain()
+
+            response = b""
+            while chunk := await reader.read(self.max_response_size):
+                response += chunk
+                if len(response) > self.max_response_size:
+                    return {}
+        finally:
+            writer.close()
+
+        head, _, body = response.partition(b"\r\n\r\n")
+        status = head.split(b"\r\n", 1)[0].split()
+        if len(status) < 2 or not status[1].startswith(b"2"):
+            return {}
+
+        response_body = json.loads(body)
+        return response_body if isinstance(response_body, dict) else {}
+
+    async def get_headers(
+        self, proxy: str, timeout: float | None = None, tunnel: PendingTunnel | None = None
+    ) -> InspectorHeadersResponse:
+        response_body = await self.make_request("headers", proxy=proxy, timeout=timeout, tunnel=tunnel)
+        return InspectorHeadersResponse(**response_body)  # type: ignore
+
+
 inspector = Inspector()
+async_inspector = AsyncInspector()
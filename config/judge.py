@@ -0,0 +1,165 @@
+"""Proxy judge ASGI application, a lightweight drop-in for https://github.com/zubedev/inspector
+
+The judge echoes back the client ip, host, protocol, country and request headers, so the checks can run against a
+judge next to the workers instead of the external INSPECTOR_URL. It does not load the Django application.
+
+Run it where the proxies can reach it directly (not behind a reverse proxy, which adds its own headers):
+    uvicorn config.judge:application --host 0.0.0.0 --port 8001
+then set INSPECTOR_URL to its public url, e.g. INSPECTOR_URL=http://judge.example.com:8001
+
+The country of the client ip is looked up in the JUDGE_COUNTRY_DATABASE csv file of ip ranges, e.g. the free
+"IP to Country Lite" database of https://db-ip.com/db/download/ip-to-country-lite (unzipped), without a database the
+country is empty. Deployed behind an edge anyway, set JUDGE_COUNTRY_HEADER to the country header it sets (e.g.
+CF-IPCountry) for it to take precedence: the header is not trusted by default, the clients and proxies could set it.
+"""
+
+import os
+
+# set before importing config.inspector, which reads the settings
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+
+import bisect
+import csv
+import functools
+import ipaddress
+import json
+from array import array
+from collections.abc import Awaitable, Callable, MutableMapping, MutableSequence
+from typing import Any
+
+from django.conf import settings
+
+from config.inspector import InspectorCountryResponse, InspectorHeadersResponse, InspectorRootResponse
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+
+UNKNOWN_COUNTRIES = {"XX", "ZZ"}  # set by cloudflare and in the db-ip.com databases for unknown countries
+
+
+def get_headers(scope: Scope) -> dict[str, str]:
+    """Returns the request headers, with names in lowercase and `-` replaced by `_` as the inspector does."""
+    return {
+        name.decode("latin-1").lower().replace("-", "_"): value.decode("latin-1") for name, value in scope["headers"]
+    }
+
+
+def get_ip(scope: Scope) -> str:
+    client = scope.get("client")
+    return str(client[0]) if client else ""
+
+
+def get_country_code(country: str) -> str:
+    country = country.upper()
+    return country if len(country) == 2 and country.isalpha() and country not in UNKNOWN_COUNTRIES else ""
+
+
+class CountryDatabase:
+    """Country of ip addresses, from a csv file of `first_ip,last_ip,country_code` ranges, searched with bisect.
+
+    The ranges of the ipv4 addresses (most of them) are held in arrays of 32 bit integers.
+    """
+
+    def __init__(self, path: str) -> None:
+        ranges: dict[int, list[tuple[int, int, str]]] = {4: [], 6: []}
+        with open(path, newline="", encoding="utf-8") as file:
+            for row in csv.reader(file):
+                if len(row) < 3 or not (country := get_country_code(row[2].strip())):
+                    continue  # unknown country, e.g. ZZ or -
+                first_ip, last_ip = ipaddress.ip_address(row[0].strip()), ipaddress.ip_address(row[1].strip())
+                ranges[first_ip.version].append((int(first_ip), int(last_ip), country))
+
+        self.firsts: dict[int, MutableSequence[int]] = {4: array("I"), 6: []}
+        self.lasts: dict[int, MutableSequence[int]] = {4: array("I"), 6: []}
+        self.countries: dict[int, list[str]] = {4: [], 6: []}
+        for version, version_ranges in ranges.items():
+            for first, last, country in sorted(version_ranges):
+                self.firsts[version].append(first)
+                self.lasts[version].append(last)
+                self.countries[version].append(country)
+
+    def get_country(self, ip: str) -> str:
+        """Returns the country code of the ip address, empty string if it is not in any range or invalid."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return ""
+        if isinstance(address, ipaddress.IPv6Address) and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        value = int(address)
+        i = bisect.bisect_right(self.firsts[address.version], value) - 1
+        return self.countries[address.version][i] if i >= 0 and value <= self.lasts[address.version][i] else ""
+
+
+@functools.cache
+def get_country_database() -> CountryDatabase | None:
+    """Returns the JUDGE_COUNTRY_DATABASE, loaded once per process, None if it is not set."""
+    return CountryDatabase(settings.JUDGE_COUNTRY_DATABASE) if settings.JUDGE_COUNTRY_DATABASE else None
+
+
+def get_country(headers: dict[str, str], ip: str) -> str:
+    """Returns the country code set by the edge in front of the judge (e.g. cloudflare) if JUDGE_COUNTRY_HEADER is set,
+    else the country of the ip in the JUDGE_COUNTRY_DATABASE, empty string otherwise."""
+    header = settings.JUDGE_COUNTRY_HEADER.lower().replace("-", "_")
+    if header and (country := get_country_code(headers.get(header, ""))):
+        return country
+    database = get_country_database()
+    return database.get_country(ip) if database else ""
+
+
+def get_root(scope: Scope) -> InspectorRootResponse:
+    return InspectorRootResponse(
+        app_name="deputy judge",
+        app_description="Proxy judge echoing the client ip, headers and country",
+        app_version=str(settings.SPECTACULAR_SETTINGS["VERSION"]),
+    )
+
+
+def get_headers_response(scope: Scope) -> InspectorHeadersResponse:
+    headers, ip = get_headers(scope), get_ip(scope)
+    response = InspectorHeadersResponse(
+        ip=ip,
+        host=headers.get("host", ""),
+        protocol=scope.get("scheme", "http"),
+        country=get_country(headers, ip),
+    )
+    return {**headers, **response}  # type: ignore[typeddict-item]
+
+
+def get_country_response(scope: Scope) -> InspectorCountryResponse:
+    ip = get_ip(scope)
+    return InspectorCountryResponse(ip=ip, country=get_country(get_headers(scope), ip))
+
+
+ROUTES: dict[str, Callable[[Scope], InspectorRootResponse | InspectorHeadersResponse | InspectorCountryResponse]] = {
+    "/": get_root,
+    "/headers": get_headers_response,
+    "/country": get_country_response,
+}
+
+
+async def send_json(send: Send, status: int, body: Any) -> None:
+    content = json.dumps(body).encode()
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(content)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def application(scope: Scope, receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        while (message := await receive())["type"] != "lifespan.shutdown":
+            await send({"type": f"{message['type']}.complete"})
+        await send({"type": "lifespan.shutdown.complete"})
+        return
+
+    if scope["type"] != "http":
+        return
+
+    route = ROUTES.get(scope["path"].rstrip("/") or "/")
+    if route is None:
+        return await send_json(send, 404, {"detail": "Not Found"})
+    if scope["method"] not in ["GET", "HEAD"]:
+        return await send_json(send, 405, {"detail": "Method Not Allowed"})
+    return await send_json(send, 200, route(scope))
@@ -0,0 +1,57 @@
+from typing import Any
+
+from django.db.models import QuerySet
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+
+class IdCursorPagination(CursorPagination):
+    """Cursor pagination on the primary key, without a count query or an offset scan."""
+
+    ordering = "id"
+
+
+class PageNumberOrCursorPagination(PageNumberPagination):
+    """Page number pagination, or cursor pagination when the request asks for it with `?pagination=cursor`.
+
+    The next and previous links of a cursor page carry the `cursor`, which keeps the following requests on cursor
+    pagination without repeating `?pagination=cursor`.
+    """
+
+    cursor_pagination_class = IdCursorPagination
+
+    def __init__(self) -> None:
+        self.cursor_pagination: CursorPagination | None = None
+
+    def is_cursor(self, request: Request) -> bool:
+        cursor_query_param = self.cursor_pagination_class.cursor_query_param
+        return request.query_params.get("pagination") == "cursor" or cursor_query_param in request.query_params
+
+    def paginate_queryset(
+        self,
+        queryset: QuerySet[Any],
+        request: Request,
+        view: APIView | None = None,
+    ) -> list[Any] | None:
+        if self.is_cursor(request):
+            self.cursor_pagination = self.cursor_pagination_class()
+            return self.cursor_pagination.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data: Any) -> Response:
+        if self.cursor_pagination is not None:
+            return self.cursor_pagination.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_schema_operation_parameters(self, view: APIView) -> list[dict[str, Any]]:
+        parameters = super().get_schema_operation_parameters(view)
+        pagination = {
+            "name": "pagination",
+            "required": False,
+            "in": "query",
+            "description": "Pagination to use, `cursor` for cursor pagination instead of page numbers.",
+            "schema": {"type": "string", "enum": ["page", "cursor"]},
+        }
+        return [*parameters, pagination, *self.cursor_pagination_class().get_schema_operation_parameters(view)]
@@ -3,9 +3,19 @@ from typing import Any
 
 import django_stubs_ext
 from decouple import Csv, config
+from django.core.exceptions import ImproperlyConfigured
 
 django_stubs_ext.monkeypatch()
 
+
+def parse_country_alias(alias: str) -> tuple[str, str]:
+    """Returns the (name, code) of a `name:CODE` country alias, see COUNTRY_ALIASES."""
+    name, _, code = alias.partition(":")
+    if not name.strip() or len(code.strip()) != 2 or not code.strip().isalpha():
+        raise ImproperlyConfigured(f"Invalid country alias {alias!r} in COUNTRY_ALIASES, expected name:CODE")
+    return name.strip().lower(), code.strip().upper()
+
+
 # https://docs.djangoproject.com/en/dev/ref/settings/
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -113,6 +123,15 @@ DATABASES = {
 # https://docs.djangoproject.com/en/stable/ref/settings/#std:setting-DEFAULT_AUTO_FIELD
 DEFAULT_AUTO_FIELD: str = "django.db.models.BigAutoField"
 
+# https://docs.djangoproject.com/en/dev/ref/settings/#caches
+# set a shared backend (e.g. django.core.cache.backends.redis.RedisCache) to share the cache between the workers
+CACHES = {
+    "default": {
+        "BACKEND": config("CACHE_BACKEND", cast=str, default="django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": config("CACHE_LOCATION", cast=str, default=""),
+    }
+}
+
 # Authentication # --------------------------------------------------------------------------------------------------- #
 
 # https://docs.djangoproject.com/en/dev/ref/settings/#password-hashers
@@ -162,6 +181,17 @@ USE_I18N: bool = config("USE_I18N", cast=bool, default=True)
 USE_TZ: bool = config("USE_TZ", cast=bool, default=True)
 # https://docs.djangoproject.com/en/dev/ref/settings/#site-id
 SITE_ID = 1
+# country names, lowercase, resolved to country codes (ISO 3166-1 alpha-2) on top of the names known to
+# django-countries, extended with COUNTRY_ALIASES="holland:NL,burma:MM" in the environment
+COUNTRY_ALIASES: dict[str, str] = {
+    "america": "US",
+    "united states": "US",
+    "usa": "US",
+    "uk": "GB",
+    "great britain": "GB",
+    "england": "GB",
+    **dict(config("COUNTRY_ALIASES", cast=Csv(cast=parse_country_alias), default="")),
+}
 
 # Static # ----------------------------------------------------------------------------------------------------------- #
 
@@ -312,6 +342,70 @@ CELERY_TIMEZONE: str = config("CELERY_TIMEZONE", cast=str, default=TIME_ZONE)
 
 # https://github.com/zubedev/inspector
 INSPECTOR_URL: str = config("INSPECTOR_URL", cast=str, default="https://inspector.zube.dev")
+# connection pooling of the inspector session, one keep-alive session per worker with the connection pools of up to
+# max proxies, the least recently used proxies are closed
+INSPECTOR_POOL_SIZE: int = config("INSPECTOR_POOL_SIZE", cast=int, default=10)
+INSPECTOR_MAX_PROXIES: int = config("INSPECTOR_MAX_PROXIES", cast=int, default=256)
+INSPECTOR_KEEP_ALIVE: bool = config("INSPECTOR_KEEP_ALIVE", cast=bool, default=True)
+# retries are disabled by default, a dead proxy would otherwise be retried until each attempt times out
+INSPECTOR_RETRIES: int = config("INSPECTOR_RETRIES", cast=int, default=0)
+INSPECTOR_RETRY_BACKOFF: float = config("INSPECTOR_RETRY_BACKOFF", cast=float, default=0.5)
+# built-in proxy judge (config.judge), the country is read from this header only when set (e.g. CF-IPCountry), for a
+# judge behind an edge that sets it: the clients and the proxies could set it otherwise
+JUDGE_COUNTRY_HEADER: str = config("JUDGE_COUNTRY_HEADER", cast=str, default="")
+# csv file of `first_ip,last_ip,country_code` ranges the judge looks the client ip up in, e.g. db-ip.com country lite
+JUDGE_COUNTRY_DATABASE: str = config("JUDGE_COUNTRY_DATABASE", cast=str, default="")
+
+# Checker # ---------------------------------------------------------------------------------------------------------- #
+
+# maximum number of proxies checked at the same time by the asyncio checking engine, per worker process: shared by
+# the tasks of its threads, each check holds up to a socket per protocol
+CHECKER_CONCURRENCY: int = config("CHECKER_CONCURRENCY", cast=int, default=500)
+# number of proxies checked together by a single check_proxies_batch_task
+CHECKER_BATCH_SIZE: int = config("CHECKER_BATCH_SIZE", cast=int, default=500)
+# probe http, socks4 and socks5 at the same time and keep the first working response, instead of one after another
+CHECKER_RACE_PROTOCOLS: bool = config("CHECKER_RACE_PROTOCOLS", cast=bool, default=False)
+# reject proxies not answering a SOCKS4/SOCKS5 greeting or HTTP CONNECT within the (seconds) timeout before checking
+CHECKER_PREFILTER: bool = config("CHECKER_PREFILTER", cast=bool, default=True)
+CHECKER_HANDSHAKE_TIMEOUT: float = config("CHECKER_HANDSHAKE_TIMEOUT", cast=float, default=3.0)
+# per-proxy check timeouts (seconds): percentile of the observed latencies plus margin, within floor and ceiling
+CHECKER_ADAPTIVE_TIMEOUT: bool = config("CHECKER_ADAPTIVE_TIMEOUT", cast=bool, default=True)
+CHECKER_TIMEOUT: float = config("CHECKER_TIMEOUT", cast=float, default=10.0)  # proxies without observed latency
+CHECKER_TIMEOUT_UNSEEN: float = config("CHECKER_TIMEOUT_UNSEEN", cast=float, default=5.0)  # proxies never working
+CHECKER_TIMEOUT_PERCENTILE: float = config("CHECKER_TIMEOUT_PERCENTILE", cast=float, default=95)
+CHECKER_TIMEOUT_MARGIN: float = config("CHECKER_TIMEOUT_MARGIN", cast=float, default=1.0)
+CHECKER_TIMEOUT_FLOOR: float = config("CHECKER_TIMEOUT_FLOOR", cast=float, default=2.0)
+CHECKER_TIMEOUT_CEILING: float = config("CHECKER_TIMEOUT_CEILING", cast=float, default=10.0)
+# crawled proxies checked within this ttl (seconds) are not checked again, 0 to check all of them
+CHECKER_RESULT_TTL: int = config("CHECKER_RESULT_TTL", cast=int, default=3600)
+# pass proxy batches between tasks as keys of compressed payloads staged in the database, instead of the lists
+# themselves through the broker and result backend, staged payloads left over are deleted after the ttl (seconds)
+CHECKER_CLAIM_CHECK: bool = config("CHECKER_CLAIM_CHECK", cast=bool, default=False)
+CHECKER_PAYLOAD_TTL: int = config("CHECKER_PAYLOAD_TTL", cast=int, default=86400)
+# batches of at least this many proxies are saved with COPY and a single upsert on PostgreSQL, 0 to always use
+# bulk_create(), see ProxyQuerySet.upsert()
+PROXY_COPY_UPSERT_THRESHOLD: int = config("PROXY_COPY_UPSERT_THRESHOLD", cast=int, default=100)
+# buffer the check results and save them together once the buffer holds this many results or results older than
+# the age (seconds), 0 to save the results of each batch as they come, see flush_proxies()
+PROXY_WRITE_BUFFER_SIZE: int = config("PROXY_WRITE_BUFFER_SIZE", cast=int, default=0)
+PROXY_WRITE_BUFFER_AGE: float = config("PROXY_WRITE_BUFFER_AGE", cast=float, default=60.0)
+# serve random proxies from an in-process pool of the active proxies, refreshed at most every interval (seconds) and
+# reloaded fully every reload interval (seconds), see proxy.pool
+PROXY_POOL_ENABLED: bool = config("PROXY_POOL_ENABLED", cast=bool, default=True)
+PROXY_POOL_REFRESH_INTERVAL: float = config("PROXY_POOL_REFRESH_INTERVAL", cast=float, default=1.0)
+PROXY_POOL_RELOAD_INTERVAL: float = config("PROXY_POOL_RELOAD_INTERVAL", cast=float, default=300.0)
+# maximum number of proxies returned (and excluded) by a single /proxies/random/?count= request
+PROXY_RANDOM_MAX_COUNT: int = config("PROXY_RANDOM_MAX_COUNT", cast=int, default=100)
+# weighted random proxies (/proxies/random/?weighted=true) are drawn in proportion to a score that halves at this
+# median latency (milliseconds) and every half life (seconds) since the proxy last worked, see get_score()
+PROXY_SCORE_LATENCY: float = config("PROXY_SCORE_LATENCY", cast=float, default=1000.0)
+PROXY_SCORE_HALF_LIFE: float = config("PROXY_SCORE_HALF_LIFE", cast=float, default=86400.0)
+# without the pool, weighted random proxies are drawn from a window of this many times as many random proxies
+PROXY_SCORE_WINDOW: int = config("PROXY_SCORE_WINDOW", cast=int, default=10)
+# proxies are exported (/proxies/export/) in batches read by id as the response is streamed, this many at a time
+PROXY_EXPORT_CHUNK_SIZE: int = config("PROXY_EXPORT_CHUNK_SIZE", cast=int, default=2000)
+# number of recent check latencies kept per proxy, a day of hourly rechecks by default
+PROXY_LATENCY_HISTORY_SIZE: int = config("PROXY_LATENCY_HISTORY_SIZE", cast=int, default=24)
 
 # Scrapy # ----------------------------------------------------------------------------------------------------------- #
 
@@ -320,3 +414,10 @@ SCRAPY_PROJECT: str = config("SCRAPY_PROJECT", cast=str, default="scraper")
 SCRAPYD_URL: str = config("SCRAPYD_URL", cast=str, default="http://localhost:6800")
 SCRAPYD_USERNAME: str = config("SCRAPYD_USERNAME", cast=str, default="")
 SCRAPYD_PASSWORD: str = config("SCRAPYD_PASSWORD", cast=str, default="")
+# the scrapyd jobs list is cached (seconds) and shared by the tasks waiting for the crawl jobs
+SCRAPYD_JOBS_CACHE_TTL: float = config("SCRAPYD_JOBS_CACHE_TTL", cast=float, default=5.0)
+# crawl jobs are polled with an exponential backoff (seconds) from the interval up to the max interval, and given up
+# on after the timeout (seconds)
+SCRAPYD_POLL_INTERVAL: float = config("SCRAPYD_POLL_INTERVAL", cast=float, default=5.0)
+SCRAPYD_POLL_MAX_INTERVAL: float = config("SCRAPYD_POLL_MAX_INTERVAL", cast=float, default=60.0)
+SCRAPYD_POLL_TIMEOUT: float = config("SCRAPYD_POLL_TIMEOUT", cast=float, default=3600.0)
@@ -1,13 +1,23 @@
+import asyncio
+import json
 import sys
+from collections.abc import Iterator
 from importlib import import_module, reload
+from pathlib import Path
 from types import ModuleType
+from typing import Any
 
 import pytest
 from django.conf import LazySettings
+from django.core.exceptions import ImproperlyConfigured
 from django.urls import clear_url_caches
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from config import judge
+from config import settings as settings_module
+from config.inspector import Inspector
+
 
 class TestUrls:
     def reload_urlconf(self, settings: LazySettings) -> ModuleType:
@@ -42,3 +52,125 @@ class TestUrls:
 
         res6 = api_client.get("/schema/redoc/")
         assert res6.status_code == status.HTTP_200_OK
+
+
+class TestSettings:
+    def test_country_aliases(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setenv("COUNTRY_ALIASES", "Holland:nl, burma:MM")
+        assert reload(settings_module).COUNTRY_ALIASES["holland"] == "NL"
+        assert settings_module.COUNTRY_ALIASES["burma"] == "MM"
+
+        monkeypatch.setenv("COUNTRY_ALIASES", "holland:NL,burma")
+        with pytest.raises(ImproperlyConfigured, match="'burma'"):
+            reload(settings_module)
+
+        monkeypatch.delenv("COUNTRY_ALIASES")
+        reload(settings_module)
+
+
+class TestInspector:
+    def test_session_pool(self) -> None:
+        inspector = Inspector("http://judge.test", max_proxies=2)
+        session = inspector.get_session()
+        assert inspector.get_session() is session  # shared by all the proxies
+
+        adapter = session.get_adapter("http://judge.test")
+        manager_1 = adapter.proxy_manager_for("http://10.0.0.1:80")  # type: ignore[attr-defined]
+        adapter.proxy_manager_for("http://10.0.0.2:80")  # type: ignore[attr-defined]
+        assert adapter.proxy_manager_for("http://10.0.0.1:80") is manager_1  # type: ignore[attr-defined]
+        adapter.proxy_manager_for("http://10.0.0.3:80")  # type: ignore[attr-defined]
+        assert list(adapter.proxy_manager) == ["http://10.0.0.1:80", "http://10.0.0.3:80"]  # type: ignore
+        assert inspector.get_pool_stats() == {"hits": 1, "misses": 3, "proxies": 2}
+
+        inspector.close()
+        assert inspector.get_pool_stats() == {"hits": 0, "misses": 0, "proxies": 0}
+        assert inspector.get_session() is not session
+
+    def test_session_options(self) -> None:
+        session = Inspector("http://judge.test", pool_size=4, keep_alive=False, retries=2).create_session()
+        adapter = session.get_adapter("https://judge.test")
+
+        assert session.headers["Connection"] == "close"
+        assert adapter._pool_maxsize == 4  # type: ignore[attr-defined]
+        assert adapter.max_retries.total == 2  # type: ignore[attr-defined]
+
+
+class TestJudge:
+    def request(
+        self, path: str, method: str = "GET", headers: list[tuple[bytes, bytes]] | None = None
+    ) -> tuple[int, Any]:
+        scope = {
+            "type": "http",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "headers": headers or [],
+            "client": ("10.0.0.1", 54321),
+        }
+        messages: list[dict[str, Any]] = []
+
+        async def receive() -> dict[str, Any]:
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message: dict[str, Any]) -> None:
+            messages.append(message)
+
+        asyncio.run(judge.application(scope, receive, send))  # type: ignore[arg-type]
+        return messages[0]["status"], json.loads(messages[1]["body"])
+
+    def test_headers(self, settings: LazySettings) -> None:
+        headers = [(b"Host", b"judge.test"), (b"X-Real-IP", b"10.0.0.2"), (b"CF-IPCountry", b"sg")]
+        assert self.request("/headers", headers=headers)[1]["country"] == ""  # the header is not trusted by default
+
+        settings.JUDGE_COUNTRY_HEADER = "CF-IPCountry"
+        status_code, body = self.request("/headers", headers=headers)
+
+        assert status_code == 200
+        assert body["ip"] == "10.0.0.1"
+        assert body["host"] == "judge.test"
+        assert body["protocol"] == "http"
+        assert body["country"] == "SG"
+        assert body["x_real_ip"] == "10.0.0.2"
+
+    def test_root_and_country(self) -> None:
+        status_code, body = self.request("/")
+        assert status_code == 200
+        assert body["app_name"] == "deputy judge"
+
+        status_code, body = self.request("/country/")
+        assert status_code == 200
+        assert body == {"ip": "10.0.0.1", "country": ""}
+
+    @pytest.fixture()
+    def _country_database(self, settings: LazySettings, tmp_path: Path) -> Iterator[None]:
+        path = tmp_path / "countries.csv"
+        path.write_text(
+            "1.0.0.0,1.0.0.255,AU\n10.0.0.0,10.0.0.255,SG\n10.0.1.0,10.0.1.255,ZZ\n2001:db8::,2001:db8::ffff,DE\n"
+        )
+        settings.JUDGE_COUNTRY_DATABASE = str(path)
+        judge.get_country_database.cache_clear()
+        yield
+        judge.get_country_database.cache_clear()
+
+    @pytest.mark.usefixtures("_country_database")
+    def test_country_database(self, settings: LazySettings) -> None:
+        status_code, body = self.request("/country")  # without an edge setting the header
+        assert status_code == 200
+        assert body == {"ip": "10.0.0.1", "country": "SG"}
+        assert self.request("/headers", headers=[(b"CF-IPCountry", b"us")])[1]["country"] == "SG"  # not trusted
+        settings.JUDGE_COUNTRY_HEADER = "CF-IPCountry"
+        assert self.request("/headers", headers=[(b"CF-IPCountry", b"us")])[1]["country"] == "US"  # edge first
+
+        database = judge.get_country_database()
+        assert database is not None
+        assert database.get_country("1.0.0.255") == "AU"
+        assert database.get_country("1.0.1.0") == ""  # between the ranges
+        assert database.get_country("10.0.1.1") == ""  # unknown country
+        assert database.get_country("2001:db8::1") == "DE"
+        assert database.get_country("::ffff:10.0.0.9") == "SG"  # ipv4 mapped
+        assert database.get_country("0.0.0.1") == ""
+        assert database.get_country("invalid") == ""
+
+    def test_not_found_and_not_allowed(self) -> None:
+        assert self.request("/unknown")[0] == 404
+        assert self.request("/headers", method="POST")[0] == 405
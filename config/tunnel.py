@@ -0,0 +1,220 @@
+import asyncio
+import errno
+import ipaddress
+import socket
+import struct
+from collections.abc import Awaitable, Callable
+
+SOCKS4_VERSION = 0x04
+SOCKS5_VERSION = 0x05
+SOCKS_CMD_CONNECT = 0x01
+SOCKS4_GRANTED = 0x5A
+SOCKS5_NO_AUTH = 0x00
+SOCKS5_SUCCEEDED = 0x00
+SOCKS5_ATYP_IPV4 = 0x01
+SOCKS5_ATYP_DOMAIN = 0x03
+SOCKS5_ATYP_IPV6 = 0x04
+# errors of the local host rather than of the proxy: out of file descriptors, buffers, memory or ephemeral ports
+LOCAL_ERRNOS = frozenset({errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.EADDRNOTAVAIL})
+
+
+resolved_hosts: dict[str, str] = {}
+
+
+class TunnelError(Exception):
+    """Raised when a connection can not be established through a proxy."""
+
+
+def is_local_error(error: BaseException) -> bool:
+    """Returns True if the error is an error of the local host, which says nothing about the proxy, e.g. resolving the
+    inspector host failed."""
+    return isinstance(error, socket.gaierror) or (isinstance(error, OSError) and error.errno in LOCAL_ERRNOS)
+
+
+async def resolve(host: str) -> str:
+    """Returns the IPv4 address for the given host, required by SOCKS4 which does not accept domain names."""
+    try:
+        return str(ipaddress.IPv4Address(host))
+    except ValueError:
+        pass
+
+    if host not in resolved_hosts:  # the destination is always the inspector, resolve it once per process
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+        if not infos:
+            raise socket.gaierror(socket.EAI_NONAME, f"Unable to resolve {host=}")
+        resolved_hosts[host] = str(infos[0][4][0])
+    return resolved_hosts[host]
+
+
+async def http_greet(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int) -> bytes | None:
+    """Sends a HTTP CONNECT request to the proxy, returns the start of its reply if it is a HTTP reply."""
+    writer.write(f"CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n".encode())
+    await writer.drain()
+    reply = await reader.readexactly(5)
+    return reply if reply == b"HTTP/" else None
+
+
+async def http_complete(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, reply: bytes, host: str, port: int
+) -> None:
+    """Reads the rest of the HTTP CONNECT reply and checks it is a 2xx reply."""
+    reply += await reader.readuntil(b"\r\n\r\n")
+    status = reply.split(b"\r\n", 1)[0].split()
+    if len(status) < 2 or not status[1].startswith(b"2"):
+        raise TunnelError(f"HTTP CONNECT to {host}:{port} was refused")
+
+
+async def socks4_greet(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int
+) -> bytes | None:
+    """Sends a SOCKS4 CONNECT request (with an empty user id) to the proxy, returns the start of its reply if it is a
+    SOCKS4 reply, granted or not."""
+    address = ipaddress.IPv4Address(await resolve(host)).packed
+    writer.write(struct.pack("!BBH", SOCKS4_VERSION, SOCKS_CMD_CONNECT, port) + address + b"\x00")
+    await writer.drain()
+    reply = await reader.readexactly(2)
+    return reply if reply[0] == 0x00 and SOCKS4_GRANTED <= reply[1] <= SOCKS4_GRANTED + 3 else None
+
+
+async def socks4_complete(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, reply: bytes, host: str, port: int
+) -> None:
+    """Checks the SOCKS4 CONNECT request was granted and reads the rest of the reply."""
+    if reply[1] != SOCKS4_GRANTED:
+        raise TunnelError(f"SOCKS4 CONNECT to {host}:{port} was refused")
+    await reader.readexactly(6)
+
+
+async def socks5_greet(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, host: str, port: int
+) -> bytes | None:
+    """Sends the SOCKS5 greeting without authentication to the proxy, returns its reply if it is a SOCKS5 reply."""
+    writer.write(bytes([SOCKS5_VERSION, 1, SOCKS5_NO_AUTH]))
+    await writer.drain()
+    reply = await reader.readexactly(2)
+    return reply if reply[0] == SOCKS5_VERSION else None
+
+
+async def socks5_complete(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, reply: bytes, host: str, port: int
+) -> None:
+    """Checks the SOCKS5 greeting was accepted, sends a CONNECT request and waits for it to succeed."""
+    if reply[1] != SOCKS5_NO_AUTH:
+        raise TunnelError("SOCKS5 greeting was refused")
+
+    try:
+        ip = ipaddress.ip_address(host)
+        atyp = SOCKS5_ATYP_IPV4 if ip.version == 4 else SOCKS5_ATYP_IPV6
+        address = ip.packed
+    except ValueError:  # host is a domain name, let the proxy resolve it
+        atyp = SOCKS5_ATYP_DOMAIN
+        address = bytes([len(host)]) + host.encode()
+
+    writer.write(bytes([SOCKS5_VERSION, SOCKS_CMD_CONNECT, 0x00, atyp]) + address + struct.pack("!H", port))
+    await writer.drain()
+
+    reply = await reader.readexactly(4)
+    if reply[0] != SOCKS5_VERSION or reply[1] != SOCKS5_SUCCEEDED:
+        raise TunnelError(f"SOCKS5 CONNECT to {host}:{port} was refused")
+
+    # consume the bound address and port, their values are not needed
+    if reply[3] == SOCKS5_ATYP_IPV4:
+        await reader.readexactly(4 + 2)
+    elif reply[3] == SOCKS5_ATYP_IPV6:
+        await reader.readexactly(16 + 2)
+    elif reply[3] == SOCKS5_ATYP_DOMAIN:
+        length = (await reader.readexactly(1))[0]
+        await reader.readexactly(length + 2)
+    else:
+        raise TunnelError("SOCKS5 reply has an unknown address type")
+
+
+Greet = Callable[[asyncio.StreamReader, asyncio.StreamWriter, str, int], Awaitable[bytes | None]]
+Complete = Callable[[asyncio.StreamReader, asyncio.StreamWriter, bytes, str, int], Awaitable[None]]
+
+# the handshake of each proxy protocol, in two steps: the first message, then the rest of the tunnel
+HANDSHAKES: dict[str, tuple[Greet, Complete]] = {
+    "http": (http_greet, http_complete),
+    "https": (http_greet, http_complete),
+    "socks4": (socks4_greet, socks4_complete),
+    "socks5": (socks5_greet, socks5_complete),
+}
+
+
+class PendingTunnel:
+    """Connection to a proxy that answered the first message of the handshake, see start_tunnel().
+
+    The tunnel is opened over the same connection by completing the handshake, instead of connecting again.
+    """
+
+    def __init__(
+        self,
+        protocol: str,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        reply: bytes,
+        host: str,
+        port: int,
+    ) -> None:
+        self.protocol = protocol
+        self.reader = reader
+        self.writer = writer
+        self.reply = reply
+        self.host = host
+        self.port = port
+
+    async def open(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Completes the handshake and returns the tunnel to host:port, the connection is closed on failure."""
+        _, complete = HANDSHAKES[self.protocol]
+        try:
+            await complete(self.reader, self.writer, self.reply, self.host, self.port)
+        except BaseException:
+            self.close()
+            raise
+        return self.reader, self.writer
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+async def start_tunnel(
+    protocol: str,
+    proxy_host: str,
+    proxy_port: int,
+    host: str,
+    port: int,
+) -> PendingTunnel | None:
+    """Connects to the proxy and sends the first message of the handshake of the given protocol.
+
+    Returns the pending tunnel to host:port if the proxy replied with the protocol, None otherwise. Only the reply is
+    validated, not whether the proxy grants the connection: a SOCKS4 rejection still shows the proxy speaks SOCKS4.
+    """
+    if protocol not in HANDSHAKES:
+        raise TunnelError(f"Unsupported proxy {protocol=}")
+    greet, _ = HANDSHAKES[protocol]
+
+    reader, writer = await asyncio.open_connection(proxy_host, proxy_port)
+    try:
+        reply = await greet(reader, writer, host, port)
+    except BaseException:
+        writer.close()
+        raise
+    if reply is None:
+        writer.close()
+        return None
+    return PendingTunnel(protocol, reader, writer, reply, host, port)
+
+
+async def open_tunnel(
+    protocol: str,
+    proxy_host: str,
+    proxy_port: int,
+    host: str,
+    port: int,
+) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Opens a TCP connection to host:port through the proxy, using the given proxy protocol."""
+    tunnel = await start_tunnel(protocol, proxy_host, proxy_port, host, port)
+    if tunnel is None:
+        raise TunnelError(f"The proxy did not reply to the {protocol} handshake")
+    return await tunnel.open()
@@ -14,6 +14,14 @@ register(factories.StaffuserFactory, "staffuser")
 register(factories.SuperuserFactory, "superuser")
 
 
+def pytest_runtest_setup(item: pytest.Item) -> None:
+    """Skip the tests marked `postgresql` when the tests do not run on PostgreSQL"""
+    from django.db import connection
+
+    if item.get_closest_marker("postgresql") and connection.vendor != "postgresql":
+        pytest.skip("requires PostgreSQL")
+
+
 @pytest.fixture()
 @pytest.mark.django_db()
 def admin_user(django_user_model: "User") -> "User":
@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import HttpRequest
 
-from proxy.models import Proxy
+from proxy.models import Proxy, ProxyVersion
 
 
 @admin.register(Proxy)
@@ -13,6 +16,7 @@ class ProxyAdmin(admin.ModelAdmin[Proxy]):
         "anonymity",
         "source",
         "is_active",
+        "latency",
         "check_fail_count",
         "last_checked_at",
         "last_worked_at",
@@ -26,9 +30,19 @@ class ProxyAdmin(admin.ModelAdmin[Proxy]):
         "url_format",
         "is_stale",
         "is_dead",
+        "latency",
+        "latency_p50",
+        "latency_p95",
+        "latency_history",
+        "random_key",
         "created_at",
         "updated_at",
         "check_fail_count",
         "last_checked_at",
         "last_worked_at",
     )
+
+    def delete_queryset(self, request: HttpRequest, queryset: QuerySet[Proxy]) -> None:
+        with transaction.atomic():  # deleted in bulk, without Proxy.delete()
+            ProxyVersion.objects.bump(deleted=True)
+            super().delete_queryset(request, queryset)
@@ -0,0 +1,174 @@
+import ipaddress
+import random
+from collections.abc import Iterator
+from datetime import timedelta
+from typing import Any
+
+from django.core.management import BaseCommand, CommandError, CommandParser
+from django.db import connection
+from django.db.models import Max, QuerySet
+from django.utils import timezone
+
+from config.enums import AnonymityEnums, ProtocolEnums
+from proxy.models import Proxy
+
+# a few countries hold most of the proxies, as with the crawled sources
+COUNTRIES = ["US", "CN", "BR", "ID", "RU", "DE", "IN", "SG", "FR", "GB", "JP", "KR", "VN", "TH", "NL", "IR", "CO", "MX"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed proxies into a temporary copy of the proxy table and report EXPLAIN ANALYZE timings of the hot proxy "
+        "queries, with and without the indexes"
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--rows", type=int, default=200_000, help="number of proxies to seed")
+        parser.add_argument("--repeat", type=int, default=3, help="runs per query, the fastest one is reported")
+        parser.add_argument("--seed", type=int, default=0, help="seed of the random proxies")
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        if connection.vendor != "postgresql":
+            raise CommandError("The benchmark runs on PostgreSQL only.")
+
+        table = connection.ops.quote_name(Proxy._meta.db_table)
+        with connection.cursor() as cursor:
+            # a temporary copy of the table, without its rows and indexes, shadows it for this session only: the
+            # proxies are seeded and the indexes dropped without locking the table of the api and the workers
+            cursor.execute(f"CREATE TEMPORARY TABLE {table} (LIKE {table} INCLUDING DEFAULTS INCLUDING IDENTITY)")
+            try:
+                cursor.execute(
+                    "SELECT relnamespace = pg_my_temp_schema() FROM pg_class WHERE oid = %s::regclass",
+                    [Proxy._meta.db_table],
+                )
+                if not cursor.fetchone()[0]:
+                    raise CommandError("The temporary table does not shadow the proxy table, check the search_path.")
+                pk = connection.ops.quote_name(Proxy._meta.pk.column)  # type: ignore[union-attr]
+                cursor.execute(f"ALTER TABLE pg_temp.{table} ADD PRIMARY KEY ({pk})")
+                with connection.schema_editor(atomic=False) as schema_editor:
+                    for constraint in Proxy._meta.constraints:  # the upsert conflicts on the unique constraint
+                        schema_editor.add_constraint(Proxy, constraint)
+
+                self.stdout.write(f"Seeding {options['rows']} proxies...")
+                rng = random.Random(options["seed"])
+                for batch in self.get_batches(options["rows"], rng):
+                    Proxy.objects.upsert(batch, update_fields=["source"], unique_fields=["ip", "port"])
+                before, after = self.benchmark(options["repeat"])
+            finally:
+                cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{table}")
+
+        self.stdout.write(f"{'query':<24} {'before (ms)':>12} {'after (ms)':>12}  plan (before -> after)")
+        for name, (before_ms, before_plan) in before.items():
+            after_ms, after_plan = after[name]
+            self.stdout.write(f"{name:<24} {before_ms:>12.3f} {after_ms:>12.3f}  {before_plan} -> {after_plan}")
+
+    def benchmark(self, repeat: int) -> tuple[dict[str, tuple[float, str]], dict[str, tuple[float, str]]]:
+        """Returns the fastest execution time (ms) and the scans of the plan of each hot query, by name, without and
+        with the indexes.
+
+        The queries run `repeat` times each way, in alternating order (without, with, with, without, ...) so that
+        neither way always runs on the cache warmed up by the other.
+        """
+        results: dict[bool, dict[str, tuple[float, str]]] = {False: {}, True: {}}
+        indexed = False
+        for run in range(2 * repeat):
+            if ((run + 1) // 2 % 2 == 1) != indexed:
+                indexed = not indexed
+                self.set_indexes(indexed)
+            for name, (elapsed, scans) in self.run_queries().items():
+                fastest = results[indexed].get(name)
+                results[indexed][name] = (min(elapsed, fastest[0]), scans) if fastest else (elapsed, scans)
+        return results[False], results[True]
+
+    @staticmethod
+    def set_indexes(indexed: bool) -> None:
+        """Creates or drops the indexes of the proxies on the temporary table."""
+        with connection.schema_editor(atomic=False) as schema_editor, connection.cursor() as cursor:
+            for index in Proxy._meta.indexes:
+                if indexed:
+                    schema_editor.add_index(Proxy, index)
+                else:  # qualified, never the index of the proxy table
+                    cursor.execute(f"DROP INDEX pg_temp.{connection.ops.quote_name(index.name)}")
+
+    @staticmethod
+    def get_batches(rows: int, rng: random.Random, batch_size: int = 10_000) -> Iterator[list[dict[str, Any]]]:
+        """Yields batches of random proxies, about a third active and a tenth dead or never checked."""
+        now = timezone.now()
+        first = int(ipaddress.IPv4Address("100.64.0.0"))  # shared address space, not crawled
+        batch = []
+        for i in range(rows):
+            checked_at = None if rng.random() < 0.1 else now - timedelta(seconds=rng.uniform(0, 86400))
+            is_active = checked_at is not None and rng.random() < 0.3
+            batch.append(
+                {
+                    "ip": str(ipaddress.IPv4Address(first + i)),
+                    "port": rng.choice([80, 3128, 8080, 1080, 9050]),
+                    "protocol": rng.choice(ProtocolEnums.values),
+                    "country": COUNTRIES[min(int(rng.expovariate(0.3)), len(COUNTRIES) - 1)],
+                    "anonymity": rng.choice(AnonymityEnums.values),
+                    "source": "benchmark",
+                    "is_active": is_active,
+                    "check_fail_count": 0 if is_active or checked_at is None else rng.randint(1, 5),
+                    "last_checked_at": checked_at,
+                    "last_worked_at": checked_at if is_active else None,
+                    "latency": rng.randint(50, 5000) if is_active else None,
+                    "random_key": rng.random(),
+                    "revision": i // batch_size + 1,  # a revision per saved batch
+                }
+            )
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def get_queries() -> dict[str, QuerySet[Proxy, Any]]:
+        """Returns the hot proxy queries, by name."""
+        now = timezone.now()
+        revision = Proxy.objects.aggregate(revision=Max("revision"))["revision"] or 0
+        fields = ["ip", "port", "protocol", "country", "anonymity"]
+        active = Proxy.objects.filter(is_active=True)
+        return {
+            "random": active.filter(random_key__gte=0.5).order_by("random_key").values(*fields)[:1],
+            "random country": active.filter(country="SG", random_key__gte=0.5)
+            .order_by("random_key")
+            .values(*fields)[:1],
+            "random protocol": active.filter(protocol="socks5", random_key__gte=0.5)
+            .order_by("random_key")
+            .values(*fields)[:1],
+            "random count": active.filter(country="FR", random_key__gte=0.5)
+            .order_by("random_key")
+            .values(*fields)[:100],
+            "list filtered": Proxy.objects.filter(country="JP", protocol="http", anonymity="elite")[:100],
+            "list filtered count": Proxy.objects.filter(country="JP", protocol="http", anonymity="elite")
+            .order_by()
+            .values("pk"),
+            "export": active.filter(country="DE").order_by("id").values(*fields),
+            "recheck never checked": Proxy.objects.filter(last_checked_at__isnull=True).order_by("id")[:1000],
+            "recheck checked": Proxy.objects.filter(last_checked_at__lte=now - timedelta(hours=23))
+            .order_by("last_checked_at", "id")
+            .values("id", "last_checked_at")[:1000],
+            "dead cleanup": Proxy.objects.filter(check_fail_count__gte=3).order_by().values("pk"),
+            "pool update": Proxy.objects.filter(revision__gt=revision - 1).values("id"),
+        }
+
+    def run_queries(self) -> dict[str, tuple[float, str]]:
+        """Returns the execution time (ms) and the scans of the plan of each hot query, by name."""
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE pg_temp.{connection.ops.quote_name(Proxy._meta.db_table)}")
+            results = {}
+            for name, qs in self.get_queries().items():
+                sql, params = qs.query.sql_with_params()
+                cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0][0]
+                results[name] = (plan["Execution Time"], ", ".join(self.get_scans(plan["Plan"])))
+        return results
+
+    @classmethod
+    def get_scans(cls, node: dict[str, Any]) -> Iterator[str]:
+        """Yields the scans of the plan node and its children, with the index scanned."""
+        if "Scan" in node["Node Type"]:
+            yield f"{node['Node Type']} on {node['Index Name']}" if "Index Name" in node else node["Node Type"]
+        for child in node.get("Plans", []):
+            yield from cls.get_scans(child)
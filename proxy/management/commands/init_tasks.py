@@ -33,6 +33,16 @@ class Command(BaseCommand):
             name="proxy.tasks.dead_proxies_cleanup_task",
             defaults={"task": "proxy.tasks.dead_proxies_cleanup_task", "crontab": crontab},
         )
+        PeriodicTask.objects.get_or_create(
+            name="proxy.tasks.staged_payloads_cleanup_task",
+            defaults={"task": "proxy.tasks.staged_payloads_cleanup_task", "crontab": crontab},
+        )
+        # write buffer flush task
+        crontab, _ = CrontabSchedule.objects.get_or_create(minute="*", **params)  # every minute
+        PeriodicTask.objects.get_or_create(
+            name="proxy.tasks.flush_proxies_task",
+            defaults={"task": "proxy.tasks.flush_proxies_task", "crontab": crontab},
+        )
         # recheck task
         crontab, _ = CrontabSchedule.objects.get_or_create(minute="30", **params)  # every hour on the 30th minute
         PeriodicTask.objects.get_or_create(
@@ -0,0 +1,418 @@
+import json
+import random
+import uuid
+import zlib
+from collections.abc import AsyncIterator, Iterable, Iterator, Mapping, Sequence
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, TypeVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
+from django.db.models import Min, Sum
+from django.utils import timezone
+
+from proxy.utils import get_score, weighted_sample
+
+if TYPE_CHECKING:
+    from proxy.models import Proxy, ProxyBuffer, ProxyClaim, ProxyPayload, ProxyVersion  # noqa: F401
+
+T = TypeVar("T", bound=Mapping[str, Any])
+
+
+def compress(items: Sequence[Any]) -> bytes:
+    """Returns the items as zlib compressed json, datetimes are serialized as iso formatted strings."""
+    return zlib.compress(json.dumps(items, cls=DjangoJSONEncoder).encode())
+
+
+def decompress(data: bytes | memoryview) -> list[Any]:
+    """Returns the items of the zlib compressed json, see compress()."""
+    return json.loads(zlib.decompress(data))  # type: ignore[no-any-return]
+
+
+class ProxyQuerySet(models.QuerySet["Proxy"]):
+    """QuerySet for Proxy model"""
+
+    def recheck_batches(
+        self,
+        checked_before: datetime,
+        fields: Sequence[str],
+        batch_size: int,
+    ) -> Iterator[list[dict[str, Any]]]:
+        """
+        Yield the values of the proxies to recheck, never checked or last checked before `checked_before`, in batches.
+
+        Batches are read with keyset pagination, on `id` for the never checked proxies and on `(last_checked_at, id)`
+        for the others, so each batch is a bounded index range scan instead of an `OFFSET` over the whole table.
+        Proxies that get checked while iterating move out of the range and are not yielded twice.
+
+        :param checked_before: proxies last checked after this datetime are not rechecked
+        :type checked_before: datetime
+        :param fields: fields of the proxy values to yield
+        :type fields: Sequence[str]
+        :param batch_size: number of proxies per batch
+        :type batch_size: int
+        :return: batches of proxy values
+        :rtype: Iterator[list[dict[str, Any]]]
+        """
+        keys = ["id", "last_checked_at"]
+
+        def strip(batch: list[dict[str, Any]]) -> list[dict[str, Any]]:
+            return [{field: values[field] for field in fields} for values in batch]
+
+        never_checked = self.filter(last_checked_at__isnull=True).order_by("id").values(*keys, *fields)
+        last_id = 0
+        while batch := list(never_checked.filter(id__gt=last_id)[:batch_size]):
+            last_id = batch[-1]["id"]
+            yield strip(batch)
+
+        checked = (
+            self.filter(last_checked_at__lte=checked_before).order_by("last_checked_at", "id").values(*keys, *fields)
+        )
+        keyset = models.Q()
+        while batch := list(checked.filter(keyset)[:batch_size]):
+            last = batch[-1]
+            keyset = models.Q(last_checked_at__gt=last["last_checked_at"])
+            keyset |= models.Q(last_checked_at=last["last_checked_at"], id__gt=last["id"])
+            yield strip(batch)
+
+    def get_batch(self, fields: Sequence[str], batch_size: int, after: int = 0) -> list[dict[str, Any]]:
+        """
+        Return the values of the next `batch_size` proxies by id, with an id greater than `after`.
+
+        :param fields: fields of the proxy values, `id` is always included
+        :type fields: Sequence[str]
+        :param batch_size: number of proxies per batch
+        :type batch_size: int
+        :param after: id of the last proxy of the previous batch
+        :type after: int
+        :return: batch of proxy values
+        :rtype: list[dict[str, Any]]
+        """
+        return list(self.filter(id__gt=after).order_by("id").values("id", *fields)[:batch_size])
+
+    def batches(self, fields: Sequence[str], batch_size: int) -> Iterator[list[dict[str, Any]]]:
+        """
+        Yield the values of the proxies in batches by id, read with keyset pagination one batch at a time.
+
+        :param fields: fields of the proxy values, `id` is always included
+        :type fields: Sequence[str]
+        :param batch_size: number of proxies per batch
+        :type batch_size: int
+        :return: batches of proxy values
+        :rtype: Iterator[list[dict[str, Any]]]
+        """
+        after = 0
+        while batch := self.get_batch(fields, batch_size, after):
+            after = batch[-1]["id"]
+            yield batch
+
+    async def abatches(self, fields: Sequence[str], batch_size: int) -> AsyncIterator[list[dict[str, Any]]]:
+        """
+        Asynchronous version of batches(), each batch is read in a thread with sync_to_async().
+
+        :param fields: fields of the proxy values, `id` is always included
+        :type fields: Sequence[str]
+        :param batch_size: number of proxies per batch
+        :type batch_size: int
+        :return: batches of proxy values
+        :rtype: AsyncIterator[list[dict[str, Any]]]
+        """
+        get_batch, after = sync_to_async(self.get_batch), 0
+        while batch := await get_batch(fields, batch_size, after):
+            after = batch[-1]["id"]
+            yield batch
+
+    def recently_checked(self, proxies: Iterable[Mapping[str, Any]], checked_after: datetime) -> set[tuple[str, int]]:
+        """
+        Return the (ip, port) of the given proxies that were already checked after `checked_after`.
+
+        :param proxies: proxy dicts with `ip` and `port` keys
+        :type proxies: Iterable[Mapping[str, Any]]
+        :param checked_after: proxies last checked before this datetime are not considered recent
+        :type checked_after: datetime
+        :return: set of (ip, port) of the recently checked proxies
+        :rtype: set[tuple[str, int]]
+        """
+        ips = {proxy["ip"] for proxy in proxies if proxy.get("ip")}
+        if not ips:
+            return set()
+        return set(self.filter(ip__in=ips, last_checked_at__gte=checked_after).values_list("ip", "port"))
+
+    def pick_random(self, *fields: str) -> dict[str, Any] | None:
+        """
+        Return the values of a random proxy, None if there is none.
+
+        The proxy with the lowest `random_key` from a random point is picked, wrapping around to the lowest `random_key`
+        when there is none after it, which is a bounded index range scan instead of loading all the primary keys.
+        The keys are drawn again whenever the proxies are saved, so the gaps between them do not favour the same
+        proxies over time.
+
+        :param fields: fields of the proxy values to return
+        :type fields: str
+        :return: values of a random proxy or None
+        :rtype: dict[str, Any] | None
+        """
+        proxies = self.sample_random(1, *fields)
+        return proxies[0] if proxies else None
+
+    def sample_random(
+        self,
+        count: int,
+        *fields: str,
+        exclude: Iterable[tuple[str, int]] = (),
+        weighted: bool = False,
+    ) -> list[dict[str, Any]]:
+        """
+        Return the values of up to `count` distinct random proxies, see pick_random().
+
+        The proxies following a random point in `random_key` order are returned, wrapping around to the lowest
+        `random_key` when there are not enough after it. If `weighted`, a window of PROXY_SCORE_WINDOW times as many
+        proxies is read instead, and `count` of them are drawn in proportion to their score, see get_score().
+
+        :param count: maximum number of proxies to return
+        :type count: int
+        :param fields: fields of the proxy values to return
+        :type fields: str
+        :param exclude: (ip, port) of the proxies not to return
+        :type exclude: Iterable[tuple[str, int]]
+        :param weighted: whether the proxies are drawn in proportion to their score
+        :type weighted: bool
+        :return: values of the random proxies
+        :rtype: list[dict[str, Any]]
+        """
+        size = count * settings.PROXY_SCORE_WINDOW if weighted else count
+        score_fields = ["latency", "latency_history", "last_worked_at"] if weighted else []
+        qs = self.order_by("random_key").values(*fields, *score_fields)
+        excluded = models.Q()
+        for ip, port in exclude:
+            excluded |= models.Q(ip=ip, port=port)
+        if excluded:
+            qs = qs.exclude(excluded)
+
+        key = random.random()
+        proxies = list(qs.filter(random_key__gte=key)[:size])
+        if len(proxies) < size:
+            proxies += qs.filter(random_key__lt=key)[: size - len(proxies)]
+
+        if weighted:
+            now = timezone.now()
+            proxies = weighted_sample(proxies, [get_score(proxy, now) for proxy in proxies], count)
+            proxies = [{field: proxy[field] for field in fields} for proxy in proxies]
+        return proxies
+
+    def upsert(
+        self,
+        proxies: Sequence[Mapping[str, Any]],
+        update_fields: Sequence[str],
+        unique_fields: Sequence[str],
+    ) -> None:
+        """
+        Insert the proxies, or update the `update_fields` of the existing ones conflicting on the `unique_fields`.
+
+        Batches of at least PROXY_COPY_UPSERT_THRESHOLD proxies are streamed with `COPY` into a temporary staging table
+        on PostgreSQL, then merged with a single `INSERT ... ON CONFLICT DO UPDATE`, without building model instances.
+        Otherwise, the proxies are saved with `bulk_create(update_conflicts=True)`. Missing fields get their default.
+        Duplicates within the proxies are only supported by the COPY path, which keeps the last of them.
+
+        :param proxies: proxy dicts keyed by field name, unknown keys are ignored by the COPY path
+        :type proxies: Sequence[Mapping[str, Any]]
+        :param update_fields: fields updated for the existing proxies
+        :type update_fields: Sequence[str]
+        :param unique_fields: fields of the unique constraint the proxies conflict on
+        :type unique_fields: Sequence[str]
+        """
+        if not proxies:
+            return
+
+        threshold = settings.PROXY_COPY_UPSERT_THRESHOLD
+        if connections[self.db].vendor != "postgresql" or not threshold or len(proxies) < threshold:
+            objs = [self.model(**proxy) for proxy in proxies]
+            self.bulk_create(objs, update_conflicts=True, update_fields=update_fields, unique_fields=unique_fields)
+            return
+
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        fields = [field for field in opts.fields if field.concrete and not field.primary_key]
+        column = {field.name: qn(field.column) for field in fields}
+        table, staging = qn(opts.db_table), qn(f"{opts.db_table}_staging")
+        columns = ", ".join(column.values())
+        unique = ", ".join(column[name] for name in unique_fields)
+        updates = ", ".join(f"{column[name]} = EXCLUDED.{column[name]}" for name in update_fields)
+
+        now = timezone.now()
+
+        def get_value(field: models.Field[Any, Any], proxy: Mapping[str, Any]) -> Any:
+            if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False):
+                value = now
+            elif field.name in proxy:
+                value = proxy[field.name]
+            else:
+                value = field.get_default()
+            return field.get_db_prep_save(value, connection)
+
+        with transaction.atomic(using=self.db), connection.cursor() as cursor:
+            # the staging table has the columns (and types) of the table, without constraints and dropped on commit
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA"
+            )
+            with cursor.cursor.copy(f"COPY {staging} ({columns}) FROM STDIN") as copy:
+                for proxy in proxies:
+                    copy.write_row([get_value(field, proxy) for field in fields])
+            # a row can only be upserted once per statement, the last of the duplicates is kept (the staging table is
+            # only appended to, so its physical order is the order of the proxies)
+            cursor.execute(
+                f"INSERT INTO {table} ({columns}) SELECT DISTINCT ON ({unique}) {columns} FROM {staging} "
+                f"ORDER BY {unique}, ctid DESC ON CONFLICT ({unique}) DO UPDATE SET {updates}"
+            )
+            # dropped now as well, an outer transaction may upsert again before committing
+            cursor.execute(f"DROP TABLE {staging}")
+
+
+class ProxyClaimQuerySet(models.QuerySet["ProxyClaim"]):
+    """QuerySet for ProxyClaim model"""
+
+    def claim(self, crawl_id: str, proxies: Sequence[T]) -> list[T]:
+        """
+        Claim the given proxies for the crawl and return the ones claimed by this call.
+
+        Every source that scraped a proxy in the crawl gets a claim, unique on `(crawl_id, ip, port, source)`, but only
+        one claim per `(crawl_id, ip, port)` is checked: the first one inserted, so each proxy is checked once per crawl
+        while the claims still record all of its sources.
+
+        :param crawl_id: id of the crawl, shared by all the spiders of a crawl_workflow() run
+        :type crawl_id: str
+        :param proxies: proxy dicts with `ip`, `port` and `source` keys, with a valid ip and port
+        :type proxies: Sequence[T]
+        :return: proxies claimed by this call, in the given order
+        :rtype: list[T]
+        """
+        if not proxies:
+            return []
+
+        token = uuid.uuid4().hex  # identifies the claims inserted by this call
+        sources = {(p["ip"], int(p["port"]), p.get("source") or ""): None for p in proxies}  # ordered set
+        checked = {(ip, port): source for ip, port, source in reversed(sources)}  # first source of each proxy
+        # the checked claims go first, ignored where another call checks the proxy, then the claims of every source,
+        # ignored where already inserted
+        self.bulk_create(
+            [
+                self.model(crawl_id=crawl_id, ip=ip, port=port, source=source, token=token, is_checked=True)
+                for (ip, port), source in checked.items()
+            ],
+            ignore_conflicts=True,
+        )
+        self.bulk_create(
+            [
+                self.model(crawl_id=crawl_id, ip=ip, port=port, source=source, token=token)
+                for ip, port, source in sources
+            ],
+            ignore_conflicts=True,
+        )
+
+        claimed = set(self.filter(crawl_id=crawl_id, token=token, is_checked=True).values_list("ip", "port"))
+        results = []
+        for proxy in proxies:
+            key = (proxy["ip"], int(proxy["port"]))
+            if key in claimed:
+                claimed.remove(key)  # duplicates within the given proxies are returned once
+                results.append(proxy)
+        return results
+
+
+class ProxyPayloadQuerySet(models.QuerySet["ProxyPayload"]):
+    """QuerySet for ProxyPayload model"""
+
+    def stage(self, items: Sequence[Any]) -> str:
+        """
+        Stage the given items as a compressed json payload and return its key.
+
+        :param items: json serializable items, datetimes are serialized as iso formatted strings
+        :type items: Sequence[Any]
+        :return: key of the staged payload
+        :rtype: str
+        """
+        return str(self.create(data=compress(items)).key)
+
+    def load(self, key: str) -> list[Any]:
+        """
+        Load the items of the staged payload.
+
+        :param key: key of the staged payload
+        :type key: str
+        :return: items of the staged payload
+        :rtype: list[Any]
+        :raises ProxyPayload.DoesNotExist: if the payload does not exist (e.g. deleted after the ttl)
+        """
+        return decompress(self.get(key=key).data)
+
+
+class ProxyBufferQuerySet(models.QuerySet["ProxyBuffer"]):
+    """QuerySet for ProxyBuffer model"""
+
+    def add(self, key: str, items: Sequence[Any], do_create: bool) -> None:
+        """
+        Buffer the given check results to be saved with the next flush.
+
+        Adding is idempotent on the key: a retried task adding the same results again is ignored.
+
+        :param key: key of the buffered results, e.g. the id of the task adding them
+        :type key: str
+        :param items: json serializable check results
+        :type items: Sequence[Any]
+        :param do_create: whether the results are saved as created (crawled) or rechecked proxies
+        :type do_create: bool
+        """
+        buffer = self.model(key=key, do_create=do_create, size=len(items), data=compress(items))
+        self.bulk_create([buffer], ignore_conflicts=True)
+
+    def is_due(self, size: int, age: float) -> bool:
+        """
+        Return True if the buffer is due to be flushed, holding at least `size` results or results older than `age`.
+
+        :param size: number of buffered results to flush at
+        :type size: int
+        :param age: age (seconds) of the oldest buffered results to flush at
+        :type age: float
+        :return: True if the buffer is due to be flushed, False otherwise
+        :rtype: bool
+        """
+        stats = self.aggregate(rows=Sum("size"), oldest=Min("created_at"))
+        if stats["oldest"] is None:
+            return False
+        return bool(stats["rows"] >= size or stats["oldest"] <= timezone.now() - timedelta(seconds=age))
+
+
+class ProxyVersionQuerySet(models.QuerySet["ProxyVersion"]):
+    """QuerySet for ProxyVersion model, a single row"""
+
+    def current(self) -> "ProxyVersion | None":
+        """
+        Return the current version of the proxies.
+
+        :return: the current version, None if it was never bumped
+        :rtype: ProxyVersion | None
+        """
+        return self.filter(pk=1).first()
+
+    def bump(self, deleted: bool = False) -> "ProxyVersion":
+        """
+        Increment the revision of the proxies, and change their version if proxies were `deleted`.
+
+        Bump first in the transaction of the change: the row stays locked until the change commits, so the revisions
+        are committed in order, along with their changes, and `updated_at` never goes back in time.
+
+        :param deleted: whether proxies are deleted by the change
+        :type deleted: bool
+        :return: the bumped version
+        :rtype: ProxyVersion
+        """
+        with transaction.atomic(using=self.db):
+            version, _ = self.select_for_update().get_or_create(pk=1)
+            version.revision += 1
+            if deleted:
+                version.version = uuid.uuid4()
+            version.save()
+        return version
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0002_proxy_check_fail_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="proxy",
+            name="latency",
+            field=models.PositiveIntegerField(
+                help_text="latency of the proxy in milliseconds, measured by the last working check.",
+                null=True,
+                verbose_name="latency",
+            ),
+        ),
+        migrations.AddField(
+            model_name="proxy",
+            name="latency_history",
+            field=models.JSONField(
+                default=list,
+                help_text="latencies of the recent checks in milliseconds (null when the check failed), oldest first.",
+                verbose_name="latency history",
+            ),
+        ),
+    ]
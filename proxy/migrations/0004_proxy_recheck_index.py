@@ -0,0 +1,16 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0003_proxy_latency"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(fields=["last_checked_at", "id"], name="index_proxy_recheck"),
+        ),
+    ]
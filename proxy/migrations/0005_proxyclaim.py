@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0004_proxy_recheck_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProxyClaim",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "crawl_id",
+                    models.CharField(
+                        help_text="id of the crawl the proxy was claimed in.", max_length=32, verbose_name="crawl id"
+                    ),
+                ),
+                (
+                    "ip",
+                    models.GenericIPAddressField(
+                        help_text="ip address of the proxy (255.255.255.255).", verbose_name="ip address"
+                    ),
+                ),
+                ("port", models.PositiveIntegerField(help_text="port of the proxy (1-65535).", verbose_name="port")),
+                (
+                    "source",
+                    models.SlugField(
+                        help_text="source of the proxy that claimed it first.", max_length=254, verbose_name="source"
+                    ),
+                ),
+                (
+                    "token",
+                    models.CharField(
+                        help_text="token of the claim call that inserted the claim.",
+                        max_length=32,
+                        verbose_name="token",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        help_text="Date time on which the object was created.",
+                        verbose_name="created at",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "proxy claim",
+                "verbose_name_plural": "proxy claims",
+                "indexes": [models.Index(fields=["created_at"], name="index_proxy_claim_created")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="proxyclaim",
+            constraint=models.UniqueConstraint(fields=("crawl_id", "ip", "port"), name="unique_proxy_claim"),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:01
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0005_proxyclaim"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProxyPayload",
+            fields=[
+                (
+                    "key",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        help_text="key of the payload passed between tasks.",
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="key",
+                    ),
+                ),
+                ("data", models.BinaryField(help_text="zlib compressed json list of proxies.", verbose_name="data")),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        db_index=True,
+                        help_text="Date time on which the object was created.",
+                        verbose_name="created at",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "proxy payload",
+                "verbose_name_plural": "proxy payloads",
+            },
+        ),
+    ]
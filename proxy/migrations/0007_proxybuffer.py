@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0006_proxypayload"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProxyBuffer",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "key",
+                    models.CharField(
+                        help_text="key of the buffered results, e.g. the id of the task that buffered them.",
+                        max_length=255,
+                        unique=True,
+                        verbose_name="key",
+                    ),
+                ),
+                (
+                    "do_create",
+                    models.BooleanField(
+                        help_text="whether the results are saved as created (crawled) or rechecked proxies.",
+                        verbose_name="do create",
+                    ),
+                ),
+                ("size", models.PositiveIntegerField(help_text="number of buffered results.", verbose_name="size")),
+                (
+                    "data",
+                    models.BinaryField(
+                        help_text="zlib compressed json list of the check results.", verbose_name="data"
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        auto_now_add=True,
+                        db_index=True,
+                        help_text="Date time on which the object was created.",
+                        verbose_name="created at",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "proxy buffer",
+                "verbose_name_plural": "proxy buffers",
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:28
+
+import random
+
+from django.db import migrations, models
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.migrations.state import StateApps
+
+import proxy.utils
+
+
+def draw_random_keys(apps: StateApps, schema_editor: BaseDatabaseSchemaEditor) -> None:
+    """Draws a random key for each existing proxy, the field default is evaluated once for all of them."""
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("UPDATE proxy_proxy SET random_key = random()")
+        return
+
+    Proxy = apps.get_model("proxy", "Proxy")
+    for pk in Proxy.objects.values_list("pk", flat=True).iterator():
+        Proxy.objects.filter(pk=pk).update(random_key=random.random())
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0007_proxybuffer"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="proxy",
+            name="random_key",
+            field=models.FloatField(
+                default=proxy.utils.get_random_key,
+                help_text="random number in [0, 1) to pick a random proxy with, drawn again whenever the proxy is saved.",
+                verbose_name="random key",
+            ),
+        ),
+        migrations.RunPython(draw_random_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(
+                condition=models.Q(("is_active", True)), fields=["random_key"], name="index_proxy_random"
+            ),
+        ),
+    ]
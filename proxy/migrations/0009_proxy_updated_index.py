@@ -0,0 +1,16 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0008_proxy_random_key"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(fields=["updated_at"], name="index_proxy_updated"),
+        ),
+    ]
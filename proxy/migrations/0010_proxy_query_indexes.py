@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0009_proxy_updated_index"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="proxy",
+            name="index_proxy",
+        ),
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["country", "random_key"],
+                name="index_proxy_random_country",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(
+                condition=models.Q(("is_active", True)),
+                fields=["protocol", "random_key"],
+                name="index_proxy_random_protocol",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(condition=models.Q(("is_active", True)), fields=["id"], name="index_proxy_active"),
+        ),
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(fields=["country", "protocol", "anonymity"], name="index_proxy_filters"),
+        ),
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(
+                condition=models.Q(("check_fail_count__gte", 3)), fields=["check_fail_count"], name="index_proxy_dead"
+            ),
+        ),
+    ]
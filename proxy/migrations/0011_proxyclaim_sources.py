@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:43
+
+from django.db import migrations, models
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.migrations.state import StateApps
+
+
+def check_claims(apps: StateApps, schema_editor: BaseDatabaseSchemaEditor) -> None:
+    """The existing claims are the ones their proxies are checked under"""
+    apps.get_model("proxy", "ProxyClaim").objects.update(is_checked=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0010_proxy_query_indexes"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="proxyclaim",
+            name="unique_proxy_claim",
+        ),
+        migrations.AddField(
+            model_name="proxyclaim",
+            name="is_checked",
+            field=models.BooleanField(
+                default=False,
+                help_text="whether the proxy is checked under this claim, a single claim per proxy and crawl is.",
+                verbose_name="is checked",
+            ),
+        ),
+        migrations.RunPython(check_claims, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="proxyclaim",
+            name="source",
+            field=models.SlugField(
+                help_text="source that scraped the proxy in the crawl.", max_length=254, verbose_name="source"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="proxyclaim",
+            constraint=models.UniqueConstraint(fields=("crawl_id", "ip", "port", "source"), name="unique_proxy_claim"),
+        ),
+        migrations.AddConstraint(
+            model_name="proxyclaim",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_checked", True)),
+                fields=("crawl_id", "ip", "port"),
+                name="unique_proxy_claim_checked",
+            ),
+        ),
+    ]
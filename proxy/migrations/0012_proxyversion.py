@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:55
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0011_proxyclaim_sources"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProxyVersion",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "version",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        help_text="version of the proxies, changed on each bump.",
+                        verbose_name="version",
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True,
+                        help_text="Date time on which the version was last bumped.",
+                        verbose_name="updated at",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "proxy version",
+                "verbose_name_plural": "proxy versions",
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:36
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0012_proxyversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="proxyversion",
+            name="revision",
+            field=models.PositiveBigIntegerField(
+                default=0,
+                help_text="revision of the proxies, incremented by every write of the proxies.",
+                verbose_name="revision",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="proxyversion",
+            name="version",
+            field=models.UUIDField(
+                default=uuid.uuid4,
+                help_text="version of the proxies, changed when proxies are deleted.",
+                verbose_name="version",
+            ),
+        ),
+    ]
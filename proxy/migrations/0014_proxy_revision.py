@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("proxy", "0013_proxyversion_revision"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="proxy",
+            name="index_proxy_updated",
+        ),
+        migrations.AddField(
+            model_name="proxy",
+            name="revision",
+            field=models.PositiveBigIntegerField(
+                default=0,
+                help_text="revision of the proxies in which the proxy was last saved, see ProxyVersion.",
+                verbose_name="revision",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="proxy",
+            index=models.Index(fields=["revision"], name="index_proxy_revision"),
+        ),
+    ]
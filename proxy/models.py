@@ -1,10 +1,21 @@
-from django.db import models
+import uuid
+from typing import Any
+
+from django.db import models, transaction
 from django.urls import reverse
 from django.utils import timezone
 from django_countries.fields import CountryField
 
 from config.enums import AnonymityEnums, ProtocolEnums
 from config.mixins import BaseModel
+from proxy.managers import (
+    ProxyBufferQuerySet,
+    ProxyClaimQuerySet,
+    ProxyPayloadQuerySet,
+    ProxyQuerySet,
+    ProxyVersionQuerySet,
+)
+from proxy.utils import get_random_key, percentile
 
 
 class Proxy(BaseModel):
@@ -53,13 +64,62 @@ class Proxy(BaseModel):
         null=True,
         help_text="last time the proxy was checked and working.",
     )
+    latency = models.PositiveIntegerField(
+        "latency",
+        null=True,
+        help_text="latency of the proxy in milliseconds, measured by the last working check.",
+    )
+    latency_history = models.JSONField(
+        "latency history",
+        default=list,
+        help_text="latencies of the recent checks in milliseconds (null when the check failed), oldest first.",
+    )
+
+    revision = models.PositiveBigIntegerField(
+        "revision",
+        default=0,
+        help_text="revision of the proxies in which the proxy was last saved, see ProxyVersion.",
+    )
+
+    random_key = models.FloatField(
+        "random key",
+        default=get_random_key,
+        help_text="random number in [0, 1) to pick a random proxy with, drawn again whenever the proxy is saved.",
+    )
+
+    objects = ProxyQuerySet.as_manager()
 
     class Meta:
         verbose_name = "proxy"
         verbose_name_plural = "proxies"
         ordering = ["-id"]
         constraints = [models.UniqueConstraint(fields=["ip", "port"], name="unique_proxy")]
-        indexes = [models.Index(fields=["ip", "port"], name="index_proxy")]
+        # the unique constraint indexes (ip, port), the indexes serve the hot queries, see benchmark_indexes
+        indexes = [
+            # keyset pagination of the proxies to recheck, see ProxyQuerySet.recheck_batches()
+            models.Index(fields=["last_checked_at", "id"], name="index_proxy_recheck"),
+            # proxies saved since the watermark of the pool, see ProxyPool.update()
+            models.Index(fields=["revision"], name="index_proxy_revision"),
+            # random active proxy, see ProxyQuerySet.pick_random()
+            models.Index(fields=["random_key"], condition=models.Q(is_active=True), name="index_proxy_random"),
+            # random active proxy of a country or protocol, the most selective filters of /proxies/random/
+            models.Index(
+                fields=["country", "random_key"], condition=models.Q(is_active=True), name="index_proxy_random_country"
+            ),
+            models.Index(
+                fields=["protocol", "random_key"],
+                condition=models.Q(is_active=True),
+                name="index_proxy_random_protocol",
+            ),
+            # active proxies in id order, see ProxyViewSet.export()
+            models.Index(fields=["id"], condition=models.Q(is_active=True), name="index_proxy_active"),
+            # filtered proxy list and its count, see ProxyViewSet.filterset_fields
+            models.Index(fields=["country", "protocol", "anonymity"], name="index_proxy_filters"),
+            # dead proxies, see dead_proxies_cleanup_task()
+            models.Index(
+                fields=["check_fail_count"], condition=models.Q(check_fail_count__gte=3), name="index_proxy_dead"
+            ),
+        ]
 
     def __str__(self) -> str:
         """Returns the proxy in the format of ip:port"""
@@ -74,6 +134,20 @@ class Proxy(BaseModel):
     def get_absolute_url(self) -> str:
         return reverse("proxy-detail", kwargs={"pk": self.pk})
 
+    def save(self, *args: Any, **kwargs: Any) -> None:
+        """Saves the proxy in a new revision of the proxies, bumped within the same transaction, see ProxyVersion."""
+        with transaction.atomic():
+            self.revision = ProxyVersion.objects.bump().revision
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "revision"}
+            super().save(*args, **kwargs)
+
+    def delete(self, *args: Any, **kwargs: Any) -> tuple[int, dict[str, int]]:
+        """Deletes the proxy and bumps the version of the proxies within the same transaction, see ProxyVersion."""
+        with transaction.atomic():
+            ProxyVersion.objects.bump(deleted=True)
+            return super().delete(*args, **kwargs)
+
     @property
     def url_format(self) -> str:
         """Returns the proxy in the format of protocol://ip:port"""
@@ -86,7 +160,177 @@ class Proxy(BaseModel):
             return True
         return (timezone.now() - self.last_checked_at).total_seconds() > 3600  # 3600 seconds = 1 hour
 
+    @property
+    def latency_p50(self) -> int | None:
+        """Returns the median latency of the recent working checks in milliseconds, None if there are none."""
+        latencies = [latency for latency in self.latency_history if latency]
+        return percentile(latencies, 50) if latencies else None
+
+    @property
+    def latency_p95(self) -> int | None:
+        """Returns the 95th percentile latency of the recent working checks in milliseconds, None if there are none."""
+        latencies = [latency for latency in self.latency_history if latency]
+        return percentile(latencies, 95) if latencies else None
+
     @property
     def is_dead(self) -> bool:
         """Returns True if the proxy is dead, False otherwise."""
         return self.check_fail_count >= 3
+
+
+class ProxyClaim(models.Model):
+    """Claim of a proxy by a source within a crawl, so a proxy scraped by several spiders is checked only once"""
+
+    crawl_id = models.CharField(
+        "crawl id",
+        max_length=32,
+        help_text="id of the crawl the proxy was claimed in.",
+    )
+    ip = models.GenericIPAddressField(
+        "ip address",
+        help_text="ip address of the proxy (255.255.255.255).",
+    )
+    port = models.PositiveIntegerField(
+        "port",
+        help_text="port of the proxy (1-65535).",
+    )
+    source = models.SlugField(
+        "source",
+        max_length=254,
+        help_text="source that scraped the proxy in the crawl.",
+    )
+    is_checked = models.BooleanField(
+        "is checked",
+        default=False,
+        help_text="whether the proxy is checked under this claim, a single claim per proxy and crawl is.",
+    )
+    token = models.CharField(
+        "token",
+        max_length=32,
+        help_text="token of the claim call that inserted the claim.",
+    )
+    created_at = models.DateTimeField(
+        "created at",
+        auto_now_add=True,
+        help_text="Date time on which the object was created.",
+    )
+
+    objects = ProxyClaimQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "proxy claim"
+        verbose_name_plural = "proxy claims"
+        constraints = [
+            models.UniqueConstraint(fields=["crawl_id", "ip", "port", "source"], name="unique_proxy_claim"),
+            models.UniqueConstraint(
+                fields=["crawl_id", "ip", "port"],
+                condition=models.Q(is_checked=True),
+                name="unique_proxy_claim_checked",
+            ),
+        ]
+        indexes = [models.Index(fields=["created_at"], name="index_proxy_claim_created")]
+
+    def __str__(self) -> str:
+        """Returns the claim in the format of crawl_id/ip:port"""
+        return f"{self.crawl_id}/{self.ip}:{self.port}"
+
+
+class ProxyPayload(models.Model):
+    """Staged batch of proxies passed between tasks by its key, see CHECKER_CLAIM_CHECK setting"""
+
+    key = models.UUIDField(
+        "key",
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        help_text="key of the payload passed between tasks.",
+    )
+    data = models.BinaryField(
+        "data",
+        help_text="zlib compressed json list of proxies.",
+    )
+    created_at = models.DateTimeField(
+        "created at",
+        auto_now_add=True,
+        db_index=True,
+        help_text="Date time on which the object was created.",
+    )
+
+    objects = ProxyPayloadQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "proxy payload"
+        verbose_name_plural = "proxy payloads"
+
+    def __str__(self) -> str:
+        """Returns the key of the payload"""
+        return str(self.key)
+
+
+class ProxyBuffer(models.Model):
+    """Check results buffered to be saved together with the next flush, see PROXY_WRITE_BUFFER_SIZE setting"""
+
+    key = models.CharField(
+        "key",
+        max_length=255,
+        unique=True,
+        help_text="key of the buffered results, e.g. the id of the task that buffered them.",
+    )
+    do_create = models.BooleanField(
+        "do create",
+        help_text="whether the results are saved as created (crawled) or rechecked proxies.",
+    )
+    size = models.PositiveIntegerField(
+        "size",
+        help_text="number of buffered results.",
+    )
+    data = models.BinaryField(
+        "data",
+        help_text="zlib compressed json list of the check results.",
+    )
+    created_at = models.DateTimeField(
+        "created at",
+        auto_now_add=True,
+        db_index=True,
+        help_text="Date time on which the object was created.",
+    )
+
+    objects = ProxyBufferQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "proxy buffer"
+        verbose_name_plural = "proxy buffers"
+
+    def __str__(self) -> str:
+        """Returns the key of the buffered results"""
+        return self.key
+
+
+class ProxyVersion(models.Model):
+    """Version of the proxies, bumped by every write of the proxies within its transaction"""
+
+    version = models.UUIDField(
+        "version",
+        default=uuid.uuid4,
+        help_text="version of the proxies, changed when proxies are deleted.",
+    )
+    revision = models.PositiveBigIntegerField(
+        "revision",
+        default=0,
+        help_text="revision of the proxies, incremented by every write of the proxies.",
+    )
+    updated_at = models.DateTimeField(
+        "updated at",
+        auto_now=True,
+        help_text="Date time on which the version was last bumped.",
+    )
+
+    objects = ProxyVersionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "proxy version"
+        verbose_name_plural = "proxy versions"
+
+    def __str__(self) -> str:
+        """Returns the version in the format of version/revision"""
+        return f"{self.version}/{self.revision}"
@@ -0,0 +1,251 @@
+"""In-process pool of the active proxies, serving random proxies without a database round trip.
+
+Each worker process holds the active proxies in memory, indexed by every combination of the protocol, country and
+anonymity filters. The pool is refreshed at most every PROXY_POOL_REFRESH_INTERVAL seconds when read, from the
+version of the proxies (see ProxyVersion): incrementally with the proxies saved in the revisions after the latest one
+it read (watermark, see ProxyPool.update()), fully when the version changes (proxies were deleted) and every
+PROXY_POOL_RELOAD_INTERVAL seconds, and not at all when the revision did not change. Both are read from the database, so the pools of all the processes see the same
+changes, and the database is read without holding the lock of the pool: requests are served meanwhile.
+
+Proxies are drawn uniformly, or weighted by their score (see get_score()) with an alias table per bucket, built on
+the first weighted draw after the bucket changed. Scores are computed when the proxies are (re)loaded, so their
+recency factor is up to PROXY_POOL_RELOAD_INTERVAL seconds old.
+"""
+
+import random
+import threading
+import time
+from collections.abc import Collection
+from datetime import datetime
+from typing import Any
+
+from django.conf import settings
+from django.utils import timezone
+
+from proxy.models import Proxy, ProxyVersion
+from proxy.utils import get_score, weighted_sample
+
+FIELDS = ("ip", "port", "protocol", "country", "anonymity")
+FILTERS = ("protocol", "country", "anonymity")
+SCORE_FIELDS = ("latency", "latency_history", "last_worked_at")
+
+ProxyValues = tuple[str, int, str, str, str]  # values of the FIELDS
+BucketKey = tuple[str | None, str | None, str | None]  # values of the FILTERS, None when not filtered on
+
+
+class AliasTable:
+    """Walker's alias table, draws an index in proportion to its weight in O(1) after an O(n) build (Vose)."""
+
+    __slots__ = ("probabilities", "aliases")
+
+    def __init__(self, weights: list[float]) -> None:
+        n = len(weights)
+        total = sum(weights)
+        scaled = [weight * n / total for weight in weights] if total > 0 else [1.0] * n
+        self.probabilities = [1.0] * n
+        self.aliases = list(range(n))
+
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less], self.aliases[less] = scaled[less], more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # the indexes left over are (up to rounding errors) full columns, probability 1 and their own alias
+
+    def draw(self) -> int:
+        i = random.randrange(len(self.probabilities))
+        return i if random.random() < self.probabilities[i] else self.aliases[i]
+
+
+class Bucket:
+    """Proxy ids with O(1) add and remove, sampled at random, uniformly or weighted by an alias table."""
+
+    __slots__ = ("ids", "positions", "table")
+
+    def __init__(self) -> None:
+        self.ids: list[int] = []
+        self.positions: dict[int, int] = {}
+        self.table: AliasTable | None = None  # built on the first weighted draw, reset on changes
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, pk: int) -> None:
+        if pk not in self.positions:
+            self.positions[pk] = len(self.ids)
+            self.ids.append(pk)
+            self.table = None
+
+    def remove(self, pk: int) -> None:
+        position = self.positions.pop(pk)
+        last = self.ids.pop()
+        if last != pk:  # move the last id into the freed position
+            self.ids[position] = last
+            self.positions[last] = position
+        self.table = None
+
+    def get_table(self, scores: dict[int, float]) -> AliasTable:
+        if self.table is None:
+            self.table = AliasTable([scores[pk] for pk in self.ids])
+        return self.table
+
+
+class ProxyPool:
+    """Pool of the active proxies, see the module docstring."""
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()  # held for the in-memory work only, never while reading the database
+        self.refresh_lock = threading.Lock()  # held by the thread refreshing the pool
+        self.proxies: dict[int, ProxyValues] = {}
+        self.scores: dict[int, float] = {}
+        self.buckets: dict[BucketKey, Bucket] = {}
+        self.version: str | None = None
+        self.watermark = 0
+        self.loaded_at: float | None = None
+        self.checked_at = 0.0
+
+    @staticmethod
+    def get_keys(values: ProxyValues) -> list[BucketKey]:
+        """Returns the keys of the buckets the proxy belongs to, one for each combination of the filters."""
+        protocol, country, anonymity = values[2:]
+        return [(p, c, a) for p in [protocol, None] for c in [country, None] for a in [anonymity, None]]
+
+    def add(self, pk: int, values: ProxyValues, score: float) -> None:
+        self.proxies[pk] = values
+        self.scores[pk] = score
+        for key in self.get_keys(values):
+            self.buckets.setdefault(key, Bucket()).add(pk)
+
+    def discard(self, pk: int) -> None:
+        values = self.proxies.pop(pk, None)
+        if values is None:
+            return
+        del self.scores[pk]
+        for key in self.get_keys(values):
+            bucket = self.buckets[key]
+            bucket.remove(pk)
+            if not bucket:
+                del self.buckets[key]
+
+    def load(self, version: str | None, revision: int, now: float) -> None:
+        """Loads all the active proxies, as of the `revision` or later, into new buckets, swapped in once built."""
+        scored_at = timezone.now()
+        pool = ProxyPool()
+        active = Proxy.objects.filter(is_active=True).values_list("id", *FIELDS, *SCORE_FIELDS)
+        for pk, *values in active.iterator(chunk_size=10000):
+            pool.add(pk, *self.get_values(values, scored_at))
+        with self.lock:
+            self.proxies, self.scores, self.buckets = pool.proxies, pool.scores, pool.buckets
+        self.version, self.watermark, self.loaded_at = version, revision, now
+
+    def update(self, revision: int = 0) -> None:
+        """Updates the proxies saved after the watermark, as of the `revision` or later, removing the ones no longer
+        active.
+
+        The revisions are committed in order (see ProxyVersion.bump()): once a revision is read, the proxies of the
+        revisions before it are committed, and each saved proxy is read once.
+        """
+        rows = Proxy.objects.filter(revision__gt=self.watermark).values_list(
+            "id", "is_active", "revision", *FIELDS, *SCORE_FIELDS
+        )
+        revision, scored_at, changes = max(revision, self.watermark), timezone.now(), []
+        for pk, is_active, saved_in, *values in rows.iterator(chunk_size=10000):
+            changes.append((pk, self.get_values(values, scored_at) if is_active else None))
+            revision = max(revision, saved_in)  # committed meanwhile
+        with self.lock:
+            for pk, proxy in changes:
+                self.discard(pk)
+                if proxy is not None:
+                    self.add(pk, *proxy)
+        self.watermark = revision
+
+    @staticmethod
+    def get_values(values: list[Any], now: datetime) -> tuple[ProxyValues, float]:
+        """Returns the values of the FIELDS and the score of the proxy, from the values of the FIELDS followed by the
+        SCORE_FIELDS."""
+        score = get_score(dict(zip(SCORE_FIELDS, values[len(FIELDS) :], strict=True)), now)
+        return tuple(values[: len(FIELDS)]), score
+
+    def refresh(self) -> None:
+        """Refreshes the pool if it was not refreshed within PROXY_POOL_REFRESH_INTERVAL seconds.
+
+        A single thread refreshes the pool, the others keep reading it meanwhile, unless it was never loaded.
+        """
+        now = time.monotonic()
+        if now - self.checked_at < settings.PROXY_POOL_REFRESH_INTERVAL:
+            return
+        if not self.refresh_lock.acquire(blocking=self.loaded_at is None):
+            return
+
+        try:
+            if now - self.checked_at < settings.PROXY_POOL_REFRESH_INTERVAL:
+                return  # refreshed by another thread meanwhile
+            self.checked_at = now
+
+            # read first, the proxies read next are committed as of this revision
+            current = ProxyVersion.objects.current()
+            version, revision = (current.version.hex, current.revision) if current else (None, 0)
+            if (
+                self.loaded_at is None
+                or version != self.version
+                or now - self.loaded_at >= settings.PROXY_POOL_RELOAD_INTERVAL
+            ):
+                self.load(version, revision, now)
+            elif revision > self.watermark:
+                self.update(revision)
+        finally:
+            self.refresh_lock.release()
+
+    def clear(self) -> None:
+        """Clears the pool, it is loaded again on the next read."""
+        with self.refresh_lock, self.lock:
+            self.proxies, self.scores, self.buckets = {}, {}, {}
+            self.loaded_at, self.checked_at = None, 0.0
+
+    def get_random(self, protocol: str | None = None, country: str | None = None, anonymity: str | None = None) -> Any:
+        """Returns the values of a random active proxy matching the filters, None if there is none."""
+        proxies = self.sample(1, protocol=protocol, country=country, anonymity=anonymity)
+        return proxies[0] if proxies else None
+
+    def sample(
+        self,
+        count: int,
+        exclude: Collection[tuple[str, int]] = (),
+        protocol: str | None = None,
+        country: str | None = None,
+        anonymity: str | None = None,
+        weighted: bool = False,
+    ) -> list[dict[str, Any]]:
+        """Returns the values of up to `count` distinct random active proxies matching the filters, except the
+        proxies with the (ip, port) in `exclude`, drawn uniformly or in proportion to their score if `weighted`."""
+        self.refresh()
+        with self.lock:
+            bucket = self.buckets.get((protocol or None, country or None, anonymity or None))
+            if not bucket:
+                return []
+            size = min(len(bucket), count + len(exclude))  # enough proxies for the excluded ones to be left out
+            ids = self.draw_weighted(bucket, size) if weighted else random.sample(bucket.ids, size)
+            proxies = [self.proxies[pk] for pk in ids]
+            if exclude:
+                proxies = [values for values in proxies if values[:2] not in exclude]
+            return [dict(zip(FIELDS, values, strict=True)) for values in proxies[:count]]
+
+    def draw_weighted(self, bucket: Bucket, size: int) -> list[int]:
+        """Returns `size` distinct proxy ids of the bucket, drawn in proportion to their score.
+
+        Draws from the alias table are repeated until `size` distinct ids were drawn, the proxies with the highest
+        scores are drawn again often when `size` is close to the size of the bucket: after a bounded number of draws,
+        the ids are drawn without replacement over the whole bucket instead.
+        """
+        table = bucket.get_table(self.scores)
+        drawn: dict[int, None] = {}  # ordered set
+        for _ in range(4 * size):
+            drawn[bucket.ids[table.draw()]] = None
+            if len(drawn) == size:
+                return list(drawn)
+        return weighted_sample(bucket.ids, [self.scores[pk] for pk in bucket.ids], size)
+
+
+proxy_pool = ProxyPool()
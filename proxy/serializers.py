@@ -1,3 +1,4 @@
+from django.conf import settings
 from django_countries.serializers import CountryFieldMixin
 from rest_framework import serializers
 
@@ -14,6 +15,9 @@ class ProxySerializer(CountryFieldMixin, serializers.HyperlinkedModelSerializer)
             "protocol",
             "country",
             "anonymity",
+            "latency",
+            "latency_p50",
+            "latency_p95",
             "check_fail_count",
             "last_checked_at",
             "last_worked_at",
@@ -24,6 +28,9 @@ class ProxySerializer(CountryFieldMixin, serializers.HyperlinkedModelSerializer)
         )
         read_only_fields = (
             "is_active",
+            "latency",
+            "latency_p50",
+            "latency_p95",
             "check_fail_count",
             "last_checked_at",
             "last_worked_at",
@@ -37,3 +44,38 @@ class ProxyRandomSerializer(CountryFieldMixin, serializers.HyperlinkedModelSeria
         model = Proxy
         fields = ("ip", "port", "protocol", "country", "anonymity")
         read_only_fields = ("ip", "port", "protocol", "country", "anonymity")
+
+
+class ProxyRandomQuerySerializer(serializers.Serializer):  # type: ignore[type-arg]
+    """Query parameters of /proxies/random/, besides the filters"""
+
+    count = serializers.IntegerField(min_value=1, required=False)
+    exclude = serializers.ListField(child=serializers.CharField(), required=False)
+    weighted = serializers.BooleanField(required=False, default=False)
+
+    def validate_count(self, value: int) -> int:
+        if value > settings.PROXY_RANDOM_MAX_COUNT:
+            raise serializers.ValidationError(
+                f"Ensure this value is less than or equal to {settings.PROXY_RANDOM_MAX_COUNT}."
+            )
+        return value
+
+    def validate_exclude(self, value: list[str]) -> set[tuple[str, int]]:
+        """Returns the (ip, port) of the excluded proxies, given as `ip:port`, repeated or comma separated."""
+        proxies = set()
+        for item in (item.strip() for items in value for item in items.split(",")):
+            ip, _, port = item.rpartition(":")
+            if not ip or not port.isdigit():
+                raise serializers.ValidationError(f"Invalid proxy {item!r}, expected ip:port.")
+            proxies.add((ip.strip("[]"), int(port)))
+        if len(proxies) > settings.PROXY_RANDOM_MAX_COUNT:
+            raise serializers.ValidationError(
+                f"Ensure this field has no more than {settings.PROXY_RANDOM_MAX_COUNT} proxies."
+            )
+        return proxies
+
+
+class ProxyExportQuerySerializer(serializers.Serializer):  # type: ignore[type-arg]
+    """Query parameters of /proxies/export/, besides the filters"""
+
+    output = serializers.ChoiceField(choices=["txt", "url", "csv", "ndjson"], default="txt")
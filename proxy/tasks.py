@@ -1,18 +1,56 @@
-import json
+import logging
+import time
+import uuid
+from collections.abc import Iterable
 from datetime import timedelta
+from itertools import batched
 from typing import Any
 
 import requests
-from celery import chain, chord, group, shared_task
+from celery import chain, shared_task
 from django.conf import settings
-from django.db.models import QuerySet
+from django.core.cache import cache
+from django.db import transaction
 from django.utils import timezone
 
 from config.enums import ScrapyJobStatusEnums
+from config.inspector import async_inspector
 from config.scrapyd import client
-from proxy.models import Proxy
-from proxy.types import CheckedProxyTypedDict, JobsTypedDict, JobTypedDict, ProxyTypedDict
-from proxy.utils import check_proxy, get_country_code, remove_duplicates
+from proxy.managers import decompress
+from proxy.models import Proxy, ProxyBuffer, ProxyClaim, ProxyPayload, ProxyVersion
+from proxy.types import (
+    CheckedProxyTypedDict,
+    CrawlJobsTypedDict,
+    FlushTypedDict,
+    JobsTypedDict,
+    JobTypedDict,
+    ProxyTypedDict,
+)
+from proxy.utils import (
+    check_proxies,
+    check_proxy,
+    get_checked_proxy,
+    get_country_code,
+    get_port,
+    get_proxy_timeout,
+    get_random_key,
+    is_valid_proxy,
+    read_proxies,
+    remove_duplicates,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_jobs(refresh: bool = False) -> JobsTypedDict:
+    """Returns the scrapyd jobs list of the project, cached for SCRAPYD_JOBS_CACHE_TTL seconds and shared by the tasks.
+    The jobs list is fetched from scrapyd if it is not cached or refresh is True."""
+    key = f"scrapyd:jobs:{settings.SCRAPY_PROJECT}"
+    jobs: JobsTypedDict | None = None if refresh else cache.get(key)
+    if jobs is None:
+        jobs = client.jobs(settings.SCRAPY_PROJECT)
+        cache.set(key, jobs, timeout=settings.SCRAPYD_JOBS_CACHE_TTL)
+    return jobs
 
 
 @shared_task
@@ -22,20 +60,28 @@ def crawl_task(spider: str, spider_args: dict[str, Any] | None = None) -> str:
 
 
 @shared_task(max_retries=60, time_limit=300)  # time limit is 5 minutes
-def get_crawl_result_task(job_id: str) -> list[ProxyTypedDict] | None:
+def get_crawl_result_task(
+    job_id: str,
+    crawl_id: str | None = None,
+    batch_size: int = settings.CHECKER_BATCH_SIZE,
+) -> int | None:
+    """Streams the crawl result of the job and dispatches the proxies for checking in batches as they are read.
+    Returns the number of proxies dispatched, None if the crawl result is not available.
+
+    Dispatched by poll_crawl_jobs_task() once the job is finished, the job is then found in the cached jobs list.
+    """
     result: JobTypedDict | None = None
 
-    # get the list of jobs and check the status
-    jobs: JobsTypedDict = client.jobs(settings.SCRAPY_PROJECT)
-    for status in ScrapyJobStatusEnums.values:
-        for job in jobs[status]:  # type: ignore[literal-required]
-            if job["id"] == job_id and status == ScrapyJobStatusEnums.FINISHED.value:
-                result = job
-                break
+    # get the (cached) list of jobs and check the status
+    jobs = get_jobs()
+    for job in jobs[ScrapyJobStatusEnums.FINISHED.value]:  # type: ignore[literal-required]
+        if job["id"] == job_id:
+            result = job
+            break
 
-    # keep retrying until the job is finished
+    # keep retrying until the job is finished, when not dispatched by the poller
     if result is None:
-        raise get_crawl_result_task.retry(countdown=5)  # retry after 5 seconds
+        raise get_crawl_result_task.retry(countdown=settings.SCRAPYD_POLL_INTERVAL)
 
     # check for "items_url" in the job result
     if "items_url" not in result:
@@ -49,13 +95,50 @@ def get_crawl_result_task(job_id: str) -> list[ProxyTypedDict] | None:
     if settings.SCRAPYD_USERNAME:
         auth = (settings.SCRAPYD_USERNAME, settings.SCRAPYD_PASSWORD)
 
-    # download the jsonlist and save it to the database
-    response = requests.get(url, auth=auth, allow_redirects=True)
-    if not response.ok:
-        return None
+    # stream the jsonlist line by line, the feed is never held in memory nor passed through the result backend
+    with requests.get(url, auth=auth, allow_redirects=True, stream=True) as response:
+        if not response.ok:
+            return None
 
-    # response is a jsonlist, each line is a json object
-    return [json.loads(line) for line in response.text.splitlines()]
+        # response is a jsonlist, each line is a json object
+        return dispatch_proxies(read_proxies(response.iter_lines()), batch_size=batch_size, crawl_id=crawl_id)
+
+
+@shared_task
+def poll_crawl_jobs_task(
+    job_ids: list[str],
+    crawl_id: str | None = None,
+    batch_size: int = settings.CHECKER_BATCH_SIZE,
+    attempt: int = 0,
+    started_at: float | None = None,
+) -> CrawlJobsTypedDict:
+    """Polls scrapyd for the jobs of a crawl and dispatches get_crawl_result_task() for each finished job.
+
+    A single jobs list is fetched per poll for all the jobs, and cached for get_crawl_result_task(). The jobs still
+    waiting are polled again with an exponential backoff, from SCRAPYD_POLL_INTERVAL up to SCRAPYD_POLL_MAX_INTERVAL,
+    and given up on as timed out after SCRAPYD_POLL_TIMEOUT seconds.
+    """
+    started_at = started_at or time.time()
+
+    finished = {job["id"] for job in get_jobs(refresh=True)[ScrapyJobStatusEnums.FINISHED.value]}  # type: ignore
+    done = [job_id for job_id in job_ids if job_id in finished]
+    waiting = [job_id for job_id in job_ids if job_id not in finished]
+
+    for job_id in done:
+        get_crawl_result_task.delay(job_id, crawl_id=crawl_id, batch_size=batch_size)
+
+    if waiting and time.time() - started_at >= settings.SCRAPYD_POLL_TIMEOUT:
+        logger.warning("Timed out waiting for scrapyd jobs %s", waiting)
+        return CrawlJobsTypedDict(finished=done, waiting=[], timed_out=waiting)
+
+    if waiting:
+        countdown = min(settings.SCRAPYD_POLL_INTERVAL * 2**attempt, settings.SCRAPYD_POLL_MAX_INTERVAL)
+        poll_crawl_jobs_task.apply_async(
+            (waiting,),
+            {"crawl_id": crawl_id, "batch_size": batch_size, "attempt": attempt + 1, "started_at": started_at},
+            countdown=countdown,
+        )
+    return CrawlJobsTypedDict(finished=done, waiting=waiting, timed_out=[])
 
 
 @shared_task
@@ -66,58 +149,63 @@ def check_proxies_task(proxy: ProxyTypedDict | CheckedProxyTypedDict | None) ->
     if not all([proxy.get("ip"), proxy.get("port")]):
         return None
 
-    if "check_fail_count" not in proxy:
-        proxy["check_fail_count"] = 0  # type: ignore[typeddict-unknown-key]
-    if "last_checked_at" not in proxy:
-        proxy["last_checked_at"] = None  # type: ignore[typeddict-unknown-key]
-    if "last_worked_at" not in proxy:
-        proxy["last_worked_at"] = None  # type: ignore[typeddict-unknown-key]
-    proxy["is_active"] = False  # type: ignore[typeddict-unknown-key]
+    timestamp = timezone.now()
 
-    result = CheckedProxyTypedDict(**proxy)  # type: ignore[typeddict-item]
+    checked_proxy = check_proxy(ip=proxy["ip"], port=proxy["port"], timeout=get_proxy_timeout(proxy))
+
+    return get_checked_proxy(proxy, checked_proxy, timestamp)
+
+
+def stage_proxies(proxies: list[Any]) -> list[Any] | str:
+    """Returns the key of the staged proxies in claim-check mode (CHECKER_CLAIM_CHECK), the proxies otherwise."""
+    return ProxyPayload.objects.stage(proxies) if settings.CHECKER_CLAIM_CHECK else proxies
 
-    timestamp = timezone.now()
 
-    checked_proxy = check_proxy(ip=proxy["ip"], port=proxy["port"])
+@shared_task
+def check_proxies_batch_task(
+    proxies: list[ProxyTypedDict | CheckedProxyTypedDict | None] | str | None,
+) -> list[CheckedProxyTypedDict] | str | None:
+    """Checks a batch of proxies concurrently within a single task, see check_proxies().
+    Given the key of a staged payload (claim-check mode), the results are staged and their key is returned."""
+    if proxies is None:
+        return None
 
-    if checked_proxy["is_working"]:
-        if not result.get("protocol"):
-            result["protocol"] = checked_proxy["protocol"]
-        elif "http" in result["protocol"] and "socks" in checked_proxy["protocol"]:
-            result["protocol"] = checked_proxy["protocol"]
-        elif "socks" in result["protocol"] and "http" in checked_proxy["protocol"]:
-            result["protocol"] = checked_proxy["protocol"]
+    key = None
+    if isinstance(proxies, str):  # claim-check mode
+        key, proxies = proxies, ProxyPayload.objects.load(proxies)
 
-        if not result.get("country") and checked_proxy["country"]:
-            result["country"] = checked_proxy["country"]
-        elif result["country"] != checked_proxy["country"] and checked_proxy["country"]:
-            result["country"] = checked_proxy["country"]
+    proxies = [proxy for proxy in proxies if proxy and all([proxy.get("ip"), proxy.get("port")])]
 
-        result["anonymity"] = checked_proxy["anonymity"]
-        result.update({"is_active": True, "last_worked_at": timestamp, "check_fail_count": 0})
+    timestamp = timezone.now()
 
-    else:  # increment the fail count
-        result["check_fail_count"] += 1
+    checked_proxies = check_proxies(proxies)  # type: ignore[arg-type]
+    # totals of the process, shared by the batches checked concurrently by its threads
+    logger.info(
+        "Checked %(proxies)s proxies, %(opened)s connections opened and %(reused)s reused by the process so far",
+        {"proxies": len(proxies), **async_inspector.get_stats()},
+    )
 
-    result["last_checked_at"] = timestamp
-    return result  # type: ignore[no-any-return]
+    results = [get_checked_proxy(p, c, timestamp) for p, c in zip(proxies, checked_proxies, strict=True)]  # type: ignore
+    if key is None:
+        return results
 
+    # the staged proxies are replaced by the staged results
+    staged = ProxyPayload.objects.stage(results)
+    ProxyPayload.objects.filter(key=key).delete()
+    return staged
 
-@shared_task
-def save_proxies_task(
-    results: list[CheckedProxyTypedDict] | None,
-    do_create: bool = True,
-) -> list[CheckedProxyTypedDict] | None:
-    # if the crawl task failed, result will be None
-    if results is None:
-        return None
 
+def save_proxies(results: list[CheckedProxyTypedDict], do_create: bool = True) -> list[CheckedProxyTypedDict]:
+    """Saves the checked proxies, as created (crawled) proxies or as rechecked proxies. Returns the saved results."""
     unique_fields = ["ip", "port"]
     update_fields = ["protocol", "check_fail_count", "last_checked_at", "last_worked_at", "is_active"]
+    update_fields.extend(["random_key", "revision", "updated_at"])  # revision is the watermark of ProxyPool
     if do_create:  # add more fields to update for new proxies
         update_fields.extend(["country", "anonymity", "source"])
         # remove duplicates based on ip and port during creation
         results = remove_duplicates(results, unique_keys=unique_fields)  # type: ignore[assignment]
+    else:  # crawled proxies do not carry the stored history, only rechecks can update it without losing it
+        update_fields.extend(["latency", "latency_history"])
 
     proxies = []
     for proxy in results:
@@ -128,71 +216,200 @@ def save_proxies_task(
         country = proxy.get("country", "")
         if do_create and country and len(country) > 2:
             proxy["country"] = get_country_code(country)
-        proxies.append(Proxy(**proxy))
+        proxy["random_key"] = get_random_key()  # drawn again on each save, see ProxyQuerySet.pick_random()
+        proxies.append(proxy)
+
+    with transaction.atomic():  # the revision of the proxies changes along with the committed proxies
+        revision = ProxyVersion.objects.bump().revision
+        for proxy in proxies:
+            proxy["revision"] = revision
+        if do_create:  # crawled proxies only carry a latency when the check worked, the stored one is kept otherwise
+            measured = [proxy for proxy in proxies if proxy.get("latency") is not None]
+            Proxy.objects.upsert(measured, update_fields=[*update_fields, "latency"], unique_fields=unique_fields)
+            proxies = [proxy for proxy in proxies if proxy.get("latency") is None]
+        Proxy.objects.upsert(proxies, update_fields=update_fields, unique_fields=unique_fields)
+    return results
+
+
+def flush_proxies() -> FlushTypedDict:
+    """Saves the buffered check results together, one upsert per mode (created or rechecked proxies).
+
+    The buffered results are locked (skipping the ones locked by a concurrent flush), saved and deleted within a
+    single transaction, so each of them is saved once. The newest result is kept for a proxy buffered more than once.
+    """
+    start = time.perf_counter()
+    with transaction.atomic():
+        buffers = list(ProxyBuffer.objects.select_for_update(skip_locked=True).order_by("-created_at", "-id"))
+        rows = 0
+        for do_create in [True, False]:
+            results = [r for b in buffers if b.do_create == do_create for r in decompress(b.data) if r]
+            results = remove_duplicates(results, unique_keys=["ip", "port"])  # type: ignore[assignment]
+            if results:
+                save_proxies(results, do_create=do_create)
+                rows += len(results)
+        ProxyBuffer.objects.filter(id__in=[b.id for b in buffers]).delete()
+
+    flushed = FlushTypedDict(batches=len(buffers), rows=rows, seconds=round(time.perf_counter() - start, 3))
+    if buffers:
+        logger.info("Flushed %(rows)s proxies from %(batches)s batches in %(seconds)ss", flushed)
+    return flushed
 
-    Proxy.objects.bulk_create(proxies, update_conflicts=True, update_fields=update_fields, unique_fields=unique_fields)
+
+@shared_task
+def save_proxies_task(
+    results: list[CheckedProxyTypedDict] | str | None,
+    do_create: bool = True,
+) -> list[CheckedProxyTypedDict] | None:
+    """Saves the checked proxies. Given the key of a staged payload (claim-check mode), the payload is deleted once
+    saved and None is returned, so the results do not end up in the result backend.
+
+    With the write buffer enabled (PROXY_WRITE_BUFFER_SIZE), the results are buffered instead and saved by a flush
+    once the buffer holds PROXY_WRITE_BUFFER_SIZE results or results older than PROXY_WRITE_BUFFER_AGE seconds.
+    """
+    # if the crawl task failed, result will be None
+    if results is None:
+        return None
+
+    key = None
+    if isinstance(results, str):  # claim-check mode
+        key, results = results, ProxyPayload.objects.load(results)
+
+    if settings.PROXY_WRITE_BUFFER_SIZE:
+        # buffered by task id, a retried task does not buffer its results twice
+        ProxyBuffer.objects.add(save_proxies_task.request.id or uuid.uuid4().hex, results, do_create=do_create)
+        if ProxyBuffer.objects.is_due(settings.PROXY_WRITE_BUFFER_SIZE, settings.PROXY_WRITE_BUFFER_AGE):
+            flush_proxies()
+    else:
+        results = save_proxies(results, do_create=do_create)
+
+    if key is not None:
+        ProxyPayload.objects.filter(key=key).delete()
+        return None
     return results
 
 
+@shared_task
+def flush_proxies_task() -> FlushTypedDict | None:
+    """Flushes the buffered check results older than PROXY_WRITE_BUFFER_AGE seconds, see flush_proxies()."""
+    if not ProxyBuffer.objects.is_due(settings.PROXY_WRITE_BUFFER_SIZE or 1, settings.PROXY_WRITE_BUFFER_AGE):
+        return None
+    return flush_proxies()
+
+
 @shared_task
 def dead_proxies_cleanup_task() -> None:
     """Deletes dead proxies, where proxies that have not been working after 3 checks."""
-    Proxy.objects.filter(check_fail_count__gte=3).delete()
+    with transaction.atomic():  # the version changes along with the committed deletions
+        ProxyVersion.objects.bump(deleted=True)
+        Proxy.objects.filter(check_fail_count__gte=3).delete()
+
+
+@shared_task
+def staged_payloads_cleanup_task() -> None:
+    """Deletes staged payloads older than the ttl, left over by failed tasks in claim-check mode."""
+    ProxyPayload.objects.filter(
+        created_at__lt=timezone.now() - timedelta(seconds=settings.CHECKER_PAYLOAD_TTL)
+    ).delete()
 
 
 @shared_task(ignore_result=True)
-def recheck_workflow(slicing: int = 10) -> None:
+def recheck_workflow(batch_size: int = settings.CHECKER_BATCH_SIZE) -> None:
     """Workflow for rechecking proxies that was checked more than an hour ago.
-    chord:
-    1. Get all proxies, for each, check_proxies_task(proxy) -> proxy (dict)
-    2. Update the proxies, update_proxies_task(list[proxy]) -> results (list[proxy])
+    chain:
+    1. Get all proxies, for each batch, check_proxies_batch_task(list[proxy]) -> results (list[proxy])
+    2. Update the proxies, save_proxies_task(list[proxy]) -> results (list[proxy])
     """
     one_hour_ago = timezone.now() - timedelta(hours=1)
 
-    qs: QuerySet[Proxy] = Proxy.objects.filter(last_checked_at__isnull=True)
-    qs = qs | Proxy.objects.filter(last_checked_at__lte=one_hour_ago)
-    proxies = qs.values("ip", "port", "protocol", "check_fail_count", "last_checked_at", "last_worked_at", "is_active")
+    fields = ["ip", "port", "protocol", "check_fail_count", "last_checked_at", "last_worked_at", "is_active"]
+    fields.extend(["latency", "latency_history"])
 
-    if not proxies.exists():
-        return None
+    # batches are streamed with keyset pagination and dispatched as they are read
+    for batch in Proxy.objects.recheck_batches(one_hour_ago, fields=fields, batch_size=batch_size):
+        chain(check_proxies_batch_task.s(stage_proxies(batch)), save_proxies_task.s(do_create=False))()
 
-    for i in range(0, proxies.count(), slicing):
-        chord([check_proxies_task.s(p) for p in proxies[i : i + slicing]])(save_proxies_task.s(do_create=False))
 
+def dispatch_proxies(
+    proxies: Iterable[ProxyTypedDict | None],
+    batch_size: int = settings.CHECKER_BATCH_SIZE,
+    crawl_id: str | None = None,
+) -> int:
+    """Dispatches the proxies for checking and saving in batches, consuming them one batch at a time.
+    Returns the number of proxies dispatched.
 
-@shared_task(ignore_result=True)
-def proxy_workflow(results: list[ProxyTypedDict] | None, slicing: int = 10) -> None:
-    """Workflow for checking and saving proxies. This is continuation from crawl_workflow().
+    Proxies already checked within the ttl (e.g. by recheck_workflow) are not checked again, and proxies are
+    deduplicated across the spiders of the same crawl (crawl_id), see ProxyClaimQuerySet.claim().
+    """
+    checked_after = timezone.now() - timedelta(seconds=settings.CHECKER_RESULT_TTL)
+
+    dispatched = 0
+    pending: list[ProxyTypedDict] = []
+    for batch in batched(proxies, batch_size):
+        valid = [p for p in batch if p is not None and is_valid_proxy(p)]
+        if crawl_id:  # proxies claimed by another spider of the crawl are checked there, all sources are recorded
+            valid = ProxyClaim.objects.claim(crawl_id, valid)
+        recent = Proxy.objects.recently_checked(valid, checked_after) if settings.CHECKER_RESULT_TTL else set()
+        valid = [p for p in valid if (p["ip"], get_port(p)) not in recent]
+        pending.extend(valid)
+
+        while len(pending) >= batch_size:
+            chain(
+                check_proxies_batch_task.s(stage_proxies(pending[:batch_size])), save_proxies_task.s(do_create=True)
+            )()
+            dispatched += batch_size
+            pending = pending[batch_size:]
+
+    if pending:
+        chain(check_proxies_batch_task.s(stage_proxies(pending)), save_proxies_task.s(do_create=True))()
+        dispatched += len(pending)
+    return dispatched
 
-    chain: check crawl_workflow() for more details
-    1. ...
-    2. ...
 
-    chord: this is continuation from crawl_workflow()
-    3. Check the proxies, for each, check_proxies_task(proxy) -> proxy (dict)
-    4. Save the proxies, save_proxies_task(list[proxy]) -> results (list[proxy])
+@shared_task(ignore_result=True)
+def proxy_workflow(
+    results: list[ProxyTypedDict] | None,
+    batch_size: int = settings.CHECKER_BATCH_SIZE,
+    crawl_id: str | None = None,
+) -> None:
+    """Workflow for checking and saving a list of proxies, see dispatch_proxies().
+
+    chain: for each batch of proxies
+    1. Check the proxies, check_proxies_batch_task(list[proxy]) -> results (list[proxy])
+    2. Save the proxies, save_proxies_task(list[proxy]) -> results (list[proxy])
     """
     if results is None:
         return None
 
-    for i in range(0, len(results), slicing):
-        chord([check_proxies_task.s(r) for r in results[i : i + slicing]])(save_proxies_task.s(do_create=True))
+    dispatch_proxies(results, batch_size=batch_size, crawl_id=crawl_id)
 
 
 @shared_task(ignore_result=True)
 def crawl_workflow() -> None:
     """Workflow for crawling proxies.
 
-    group: run the spiders in parallel, and for each spider, run the following:
+    1. Crawl and scrape proxies within scrapyd, scheduled for each spider, crawl_task() -> job_id
+    2. Poll scrapyd for the jobs, poll_crawl_jobs_task(list[job_id]) -> jobs (finished, waiting and timed out)
 
-    chain:
-    1. Crawl and scrape proxies within scrapyd, crawl_task() -> job_id
-    2. Get the crawl result from scrapyd, get_crawl_result_task(job_id) -> results (jsonlist -> list[proxy])
+    for each finished job:
+    3. Stream the crawl result from scrapyd, get_crawl_result_task(job_id) -> count (jsonlist -> batches of proxies)
 
-    chord: continued in proxy_workflow()
-    3. ...
-    4. ...
+    chain: for each batch of proxies, deduplicated across the spiders by the crawl id, see dispatch_proxies()
+    4. Check the proxies, check_proxies_batch_task(list[proxy]) -> results (list[proxy])
+    5. Save the proxies, save_proxies_task(list[proxy]) -> results (list[proxy])
     """
+    # claims of previous crawls are no longer needed
+    ProxyClaim.objects.filter(created_at__lt=timezone.now() - timedelta(days=1)).delete()
+
+    crawl_id = uuid.uuid4().hex
     spiders = client.spiders(settings.SCRAPY_PROJECT)
 
-    group([chain(crawl_task.s(s), get_crawl_result_task.s(), proxy_workflow.s()) for s in spiders])()
+    job_ids = []
+    for spider in spiders:
+        try:
+            job_ids.append(crawl_task(spider))
+        except Exception:  # a spider failing to be scheduled does not hold back the others
+            logger.exception("Unable to schedule spider %s", spider)
+
+    # the jobs are polled together, with a single jobs list per poll
+    if job_ids:
+        poll_crawl_jobs_task.delay(job_ids, crawl_id=crawl_id)
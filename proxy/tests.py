@@ -0,0 +1,1178 @@
+import asyncio
+import collections
+import errno
+import io
+import json
+import random
+import socket
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+from typing import Any
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.conf import LazySettings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from config.celery import app
+from config.inspector import AsyncInspector, InspectorHeadersResponse
+from config.pagination import IdCursorPagination
+from config.tunnel import resolved_hosts
+from core.models import User
+from proxy import managers, tasks, utils
+from proxy.models import Proxy, ProxyBuffer, ProxyClaim, ProxyPayload, ProxyVersion
+from proxy.pool import AliasTable, ProxyPool, proxy_pool
+from proxy.types import CheckProxyResultTypedDict
+from proxy.views import ProxyViewSet
+
+Handler = Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]]
+
+HEADERS_RESPONSE = {"ip": "127.0.0.1", "host": "judge.test", "protocol": "http", "country": "SG"}
+
+
+@pytest.fixture(autouse=True)
+def _judge_resolved(monkeypatch: pytest.MonkeyPatch) -> None:
+    """The judges of the tests are served by the proxies, their hosts are not resolved (no network)."""
+    for host in ["judge.test", utils.async_inspector.host]:
+        monkeypatch.setitem(resolved_hosts, host, "127.0.0.1")
+
+
+def http_response(body: dict[str, Any], status: str = "200 OK") -> bytes:
+    content = json.dumps(body).encode()
+    return f"HTTP/1.1 {status}\r\nContent-Length: {len(content)}\r\n\r\n".encode() + content
+
+
+async def serve(handler: Handler, coro: Callable[[int], Awaitable[Any]]) -> Any:
+    """Runs a local tcp server with the given handler and awaits coro(port) against it."""
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        return await coro(port)
+
+
+async def http_proxy_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """A http proxy that answers forwarded requests by itself, acting as the inspector."""
+    request = await reader.readuntil(b"\r\n\r\n")
+    if request.startswith(b"GET http://judge.test/headers "):
+        writer.write(http_response(HEADERS_RESPONSE))
+    else:
+        writer.write(http_response({}, status="404 Not Found"))
+    await writer.drain()
+    writer.close()
+
+
+async def socks5_proxy_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """A socks5 proxy that answers tunnelled requests by itself, acting as the inspector."""
+    assert await reader.readexactly(3) == b"\x05\x01\x00"
+    writer.write(b"\x05\x00")
+    header = await reader.readexactly(5)  # version, command, reserved, address type, domain length
+    host = await reader.readexactly(header[4])
+    await reader.readexactly(2)  # port
+    assert host == b"judge.test"
+    writer.write(b"\x05\x00\x00\x01\x7f\x00\x00\x01\x00\x50")
+
+    request = await reader.readuntil(b"\r\n\r\n")
+    assert request.startswith(b"GET /headers HTTP/1.0")
+    writer.write(http_response(HEADERS_RESPONSE))
+    await writer.drain()
+    writer.close()
+
+
+class TestAsyncInspector:
+    def test_get_headers_through_http_proxy(self) -> None:
+        async_inspector = AsyncInspector("http://judge.test", timeout=5)
+        response = asyncio.run(
+            serve(http_proxy_handler, lambda port: async_inspector.get_headers(f"http://127.0.0.1:{port}"))
+        )
+        assert response == HEADERS_RESPONSE
+
+    def test_get_headers_through_socks5_proxy(self) -> None:
+        async_inspector = AsyncInspector("http://judge.test", timeout=5)
+        response = asyncio.run(
+            serve(socks5_proxy_handler, lambda port: async_inspector.get_headers(f"socks5://127.0.0.1:{port}"))
+        )
+        assert response == HEADERS_RESPONSE
+
+    def test_get_headers_failure(self) -> None:
+        async_inspector = AsyncInspector("http://judge.test", timeout=5)
+        # the socks5 proxy does not speak http, the http proxy does not speak socks4
+        assert not asyncio.run(
+            serve(socks5_proxy_handler, lambda p: async_inspector.get_headers(f"http://127.0.0.1:{p}"))
+        )
+        assert not asyncio.run(
+            serve(http_proxy_handler, lambda p: async_inspector.get_headers(f"socks4://127.0.0.1:{p}"))
+        )
+
+    def test_get_headers_timeout(self) -> None:
+        async def silent_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            await asyncio.sleep(1)
+            writer.close()
+
+        async_inspector = AsyncInspector("http://judge.test", timeout=0.1)
+        response = asyncio.run(serve(silent_handler, lambda p: async_inspector.get_headers(f"http://127.0.0.1:{p}")))
+        assert response == {}
+
+    def test_get_headers_local_error(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        raised = OSError(errno.ECONNREFUSED, "Connection refused")
+
+        async def open_connection(host: str, port: int) -> Any:
+            raise raised
+
+        monkeypatch.setattr(asyncio, "open_connection", open_connection)
+        async_inspector = AsyncInspector("http://judge.test", timeout=5)
+        assert not asyncio.run(async_inspector.get_headers("http://127.0.0.1:8080"))  # a failure of the proxy
+
+        raised = OSError(errno.EMFILE, "Too many open files")
+        with pytest.raises(OSError, match="Too many open files"):  # not a failure of the proxy
+            asyncio.run(async_inspector.get_headers("http://127.0.0.1:8080"))
+
+
+class TestCheckProxies:
+    def test_check_proxies(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        active = 0
+        max_active = 0
+
+        async def get_headers(
+            proxy: str, timeout: float | None = None, tunnel: Any = None
+        ) -> InspectorHeadersResponse | dict[str, Any]:
+            nonlocal active, max_active
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            # only socks5 proxies on even ports are working
+            if proxy.startswith("socks5") and int(proxy.rsplit(":", 1)[1]) % 2 == 0:
+                return InspectorHeadersResponse(**{**HEADERS_RESPONSE, "ip": proxy[9:].split(":")[0]})  # type: ignore
+            return {}
+
+        monkeypatch.setattr(utils.async_inspector, "get_headers", get_headers)
+
+        proxies = [{"ip": f"10.0.0.{i}", "port": 8000 + i} for i in range(20)]
+        results = utils.check_proxies(proxies, concurrency=5, prefilter=False)  # type: ignore[arg-type]
+
+        assert max_active == 5
+        assert [(r["ip"], r["port"]) for r in results] == [(p["ip"], p["port"]) for p in proxies]
+        for result in results:
+            if result["port"] % 2 == 0:
+                assert result["is_working"] is True
+                assert result["protocol"] == "socks5"
+                assert result["country"] == "SG"
+                assert result["anonymity"] == "elite"
+            else:
+                assert result["is_working"] is False
+                assert result["protocol"] == ""
+
+    def test_check_limiter(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        lock, active, max_active = threading.Lock(), 0, 0
+
+        async def get_headers(proxy: str, timeout: float | None = None, tunnel: Any = None) -> dict[str, Any]:
+            nonlocal active, max_active
+            with lock:
+                active += 1
+                max_active = max(max_active, active)
+            await asyncio.sleep(0.01)
+            with lock:
+                active -= 1
+            return {}
+
+        monkeypatch.setattr(utils.async_inspector, "get_headers", get_headers)
+        monkeypatch.setattr(utils, "check_limiter", utils.CheckLimiter(4))
+
+        # the tasks of the threads pool of a worker run their own event loops, the limit is shared by all of them
+        proxies = [{"ip": f"10.0.0.{i}", "port": 8000 + i} for i in range(10)]
+        threads = [threading.Thread(target=utils.check_proxies, args=(proxies, None, False)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert max_active == 4
+        assert utils.check_limiter.active == 0
+
+    def test_check_proxies_local_error(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        async def get_headers(proxy: str, timeout: float | None = None, tunnel: Any = None) -> dict[str, Any]:
+            raise OSError(errno.EMFILE, "Too many open files")
+
+        monkeypatch.setattr(utils.async_inspector, "get_headers", get_headers)
+
+        # raised instead of recording the proxies as failed checks, they would end up deleted as dead proxies
+        with pytest.raises(OSError, match="Too many open files"):
+            utils.check_proxies([{"ip": "10.0.0.1", "port": 8001}], prefilter=False)  # type: ignore[typeddict-item]
+        with pytest.raises(OSError, match="Too many open files"):
+            utils.check_proxy("10.0.0.1", 8001, race=True)
+
+    def test_check_proxy_race(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        cancelled = []
+
+        async def get_headers(
+            proxy: str, timeout: float | None = None, tunnel: Any = None
+        ) -> InspectorHeadersResponse | dict[str, Any]:
+            protocol = proxy.split("://")[0]
+            try:
+                # http hangs until it times out, socks4 fails fast and socks5 answers shortly after
+                await asyncio.sleep({"http": 5, "socks4": 0, "socks5": 0.01}[protocol])
+            except asyncio.CancelledError:
+                cancelled.append(protocol)
+                raise
+            return InspectorHeadersResponse(**HEADERS_RESPONSE) if protocol == "socks5" else {}  # type: ignore
+
+        monkeypatch.setattr(utils.async_inspector, "get_headers", get_headers)
+
+        result = utils.check_proxy("127.0.0.1", 1080, race=True)
+
+        assert result["is_working"] is True
+        assert result["protocol"] == "socks5"
+        assert result["protocols"] == ["socks5"]
+        assert result["speed"] < 5000
+        assert cancelled == ["http"]
+
+
+class TestPrefilterProxy:
+    @staticmethod
+    async def prefilter_protocols(port: int, timeout: float = 1) -> list[str]:
+        tunnels = await utils.prefilter_proxy("127.0.0.1", port, timeout)
+        for tunnel in tunnels:
+            tunnel.close()
+        return [tunnel.protocol for tunnel in tunnels]
+
+    def test_prefilter_proxy(self) -> None:
+        # the socks handshakes sent to the http proxy are left unanswered until the timeout
+        assert asyncio.run(serve(http_proxy_handler, lambda p: self.prefilter_protocols(p, 0.5))) == ["http"]
+        assert asyncio.run(serve(socks5_proxy_handler, self.prefilter_protocols)) == ["socks5"]
+
+    def test_prefilter_connection_reused(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        connections = 0
+
+        async def handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            nonlocal connections
+            connections += 1
+            await socks5_proxy_handler(reader, writer)
+
+        async_inspector = AsyncInspector("http://judge.test", timeout=5)
+        monkeypatch.setattr(utils, "async_inspector", async_inspector)
+
+        proxy = {"ip": "127.0.0.1", "port": 0}
+        [result] = asyncio.run(
+            serve(handler, lambda p: utils.acheck_proxies([{**proxy, "port": p}], prefilter=True))  # type: ignore
+        )
+
+        assert result["is_working"] is True
+        assert result["protocol"] == "socks5"
+        assert async_inspector.get_stats() == {"opened": 0, "reused": 1}
+        assert connections == len(utils.PROTOCOLS)  # one per handshake, the request is sent over the socks5 one
+
+    def test_prefilter_local_error(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        async def resolve(host: str) -> str:
+            raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+
+        monkeypatch.setattr("config.tunnel.resolve", resolve)  # of the inspector host, for the socks4 handshake
+
+        # not an answer of the proxy, the proxies would all be recorded as failed checks otherwise
+        with pytest.raises(socket.gaierror):
+            asyncio.run(serve(socks5_proxy_handler, lambda p: utils.prefilter_proxy("127.0.0.1", p)))
+
+    def test_prefilter_dead_proxy(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        with socket.socket() as sock:  # reserve a free port, nothing is listening on it once closed
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+
+        async def get_headers(proxy: str, timeout: float | None = None, tunnel: Any = None) -> dict[str, Any]:
+            raise AssertionError("dead proxies must not reach the inspector")
+
+        monkeypatch.setattr(utils.async_inspector, "get_headers", get_headers)
+
+        assert asyncio.run(utils.prefilter_proxy("127.0.0.1", port)) == []
+        [result] = utils.check_proxies([{"ip": "127.0.0.1", "port": port}], prefilter=True)  # type: ignore[typeddict-item]
+        assert result["is_working"] is False
+
+
+class TestTimeouts:
+    def test_percentile(self) -> None:
+        assert utils.percentile([], 95) == 0
+        assert utils.percentile([300, 100, 200], 50) == 200
+        assert utils.percentile(list(range(1, 101)), 95) == 95
+        assert utils.percentile([100], 0) == 100
+
+    def test_get_timeout(self, settings: LazySettings) -> None:
+        settings.CHECKER_TIMEOUT = 10
+        settings.CHECKER_TIMEOUT_UNSEEN = 5
+        settings.CHECKER_TIMEOUT_PERCENTILE = 95
+        settings.CHECKER_TIMEOUT_MARGIN = 1
+        settings.CHECKER_TIMEOUT_FLOOR = 2
+        settings.CHECKER_TIMEOUT_CEILING = 8
+
+        assert utils.get_timeout([], has_worked=False) == 5
+        assert utils.get_timeout([None, None], has_worked=True) == 10
+        assert utils.get_timeout([2000, None, 2500, 3000], has_worked=True) == 4  # 3s + 1s margin
+        assert utils.get_timeout([100, 200], has_worked=True) == 2  # floor
+        assert utils.get_timeout([9000], has_worked=True) == 8  # ceiling
+
+    def test_get_proxy_timeout(self, settings: LazySettings) -> None:
+        settings.CHECKER_ADAPTIVE_TIMEOUT = False
+        assert utils.get_proxy_timeout({"ip": "10.0.0.1", "port": 80}) is None
+
+        settings.CHECKER_ADAPTIVE_TIMEOUT = True
+        settings.CHECKER_TIMEOUT_UNSEEN = 5
+        assert utils.get_proxy_timeout({"ip": "10.0.0.1", "port": 80}) == 5
+
+
+@pytest.mark.django_db()
+class TestLatency:
+    def test_latency_percentiles(self) -> None:
+        proxy = Proxy(ip="10.0.0.1", port=80, latency_history=[None, 400, 100, 300, None, 200])
+        assert proxy.latency_p50 == 200
+        assert proxy.latency_p95 == 400
+
+        proxy.latency_history = [None]
+        assert proxy.latency_p50 is None
+        assert proxy.latency_p95 is None
+
+    def test_check_and_save_latency(self, monkeypatch: pytest.MonkeyPatch, settings: LazySettings) -> None:
+        settings.PROXY_LATENCY_HISTORY_SIZE = 3
+        Proxy.objects.create(ip="10.0.0.1", port=80, source="test", latency=100, latency_history=[100, None, 300])
+        working = True
+
+        def check_proxy(ip: str, port: int, timeout: float | None = None) -> CheckProxyResultTypedDict:
+            result = utils.get_check_proxy_result(ip, port)
+            if working:
+                result.update({"protocol": "http", "country": "SG", "speed": 250, "is_working": True})
+            return result
+
+        monkeypatch.setattr(tasks, "check_proxy", check_proxy)
+
+        fields = ["ip", "port", "protocol", "check_fail_count", "latency", "latency_history"]
+        checked = tasks.check_proxies_task(Proxy.objects.values(*fields).get())
+        assert checked is not None
+        assert checked["latency"] == 250
+        assert checked["latency_history"] == [None, 300, 250]
+
+        tasks.save_proxies_task([checked], do_create=False)
+        saved = Proxy.objects.get()
+        assert saved.latency == 250
+        assert saved.latency_history == [None, 300, 250]
+
+        working = False
+        checked = tasks.check_proxies_task(Proxy.objects.values(*fields).get())
+        assert checked is not None
+        tasks.save_proxies_task([checked], do_create=False)
+        saved = Proxy.objects.get()
+        assert saved.latency == 250  # the latency of the last working check is kept
+        assert saved.latency_history == [300, 250, None]
+
+    def test_crawl_check_keeps_latency(self) -> None:
+        Proxy.objects.create(ip="10.0.0.1", port=80, source="test", latency=150, latency_history=[150, 160])
+        crawled: list[Any] = [{"ip": "10.0.0.1", "port": 80, "source": "test", "is_active": False}]
+        tasks.save_proxies(crawled, do_create=True)  # failed crawl check, without a latency
+        assert Proxy.objects.values_list("latency", "latency_history", "is_active").get() == (150, [150, 160], False)
+
+        crawled = [{"ip": "10.0.0.1", "port": 80, "source": "test", "is_active": True, "latency": 90}]
+        tasks.save_proxies(crawled, do_create=True)
+        assert Proxy.objects.values_list("latency", "latency_history", "is_active").get() == (90, [150, 160], True)
+
+
+@pytest.mark.django_db()
+class TestUpsert:
+    def test_upsert(self, settings: LazySettings) -> None:
+        settings.PROXY_COPY_UPSERT_THRESHOLD = 1  # COPY on PostgreSQL, bulk_create() otherwise
+        checked_at = timezone.now() - timedelta(minutes=5)
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", country="SG", latency_history=[100])
+
+        proxies = [
+            {"ip": "10.0.0.1", "port": 8001, "source": "other", "country": "US", "latency_history": [100, None]},
+            {"ip": "10.0.0.2", "port": 8002, "source": "test", "protocol": "socks5", "latency_history": [200]},
+        ]
+        proxies[0]["last_checked_at"] = checked_at.isoformat()  # as in the task payloads
+        fields = ["last_checked_at", "latency_history"]
+        Proxy.objects.upsert(proxies, update_fields=fields, unique_fields=["ip", "port"])
+
+        updated, created = Proxy.objects.order_by("port")
+        assert (updated.source, updated.country, updated.last_checked_at) == ("test", "SG", checked_at)
+        assert updated.latency_history == [100, None]
+        assert (created.source, created.protocol, created.anonymity, created.is_active) == (
+            "test",
+            "socks5",
+            "unknown",
+            True,
+        )
+        assert created.latency_history == [200]
+        assert created.created_at is not None
+
+    @pytest.mark.postgresql()
+    def test_copy_upsert(self, settings: LazySettings) -> None:
+        settings.PROXY_COPY_UPSERT_THRESHOLD = 2
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", latency=100)
+
+        proxies = [
+            {"ip": "10.0.0.1", "port": 8001, "source": "first", "latency": 200},
+            {"ip": "10.0.0.2", "port": 8002, "source": "first"},
+            {"ip": "10.0.0.1", "port": 8001, "source": "last", "latency": 300},  # duplicate within the batch
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            Proxy.objects.upsert(proxies, update_fields=["source", "latency"], unique_fields=["ip", "port"])
+        assert any("CREATE TEMPORARY TABLE" in query["sql"] for query in queries)
+
+        updated, created = Proxy.objects.order_by("port")
+        assert (updated.source, updated.latency) == ("last", 300)
+        assert (created.source, created.latency, created.is_active, created.latency_history) == (
+            "first",
+            None,
+            True,
+            [],
+        )
+
+    @pytest.mark.postgresql()
+    def test_copy_upsert_twice_in_transaction(self, settings: LazySettings) -> None:
+        settings.PROXY_COPY_UPSERT_THRESHOLD = 1
+        with transaction.atomic():  # as flush_proxies() saving both modes
+            for port in [8001, 8002]:
+                Proxy.objects.upsert([{"ip": "10.0.0.1", "port": port, "source": "test"}], ["source"], ["ip", "port"])
+        assert Proxy.objects.count() == 2
+
+
+@pytest.mark.django_db()
+class TestBenchmarkIndexes:
+    def test_benchmark_indexes(self) -> None:
+        if connection.vendor != "postgresql":
+            with pytest.raises(CommandError):
+                call_command("benchmark_indexes")
+            return
+
+        out = io.StringIO()
+        call_command("benchmark_indexes", rows=100, repeat=1, stdout=out)
+        lines = out.getvalue().splitlines()
+        assert lines[2].startswith("random ")
+        # seeded into a temporary copy of the table, dropped with the indexes of the copy only
+        assert not Proxy.objects.exists()
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Proxy._meta.db_table)
+        assert {index.name for index in Proxy._meta.indexes} <= set(constraints)
+
+
+class TestReadProxies:
+    def test_normalize_proxy(self) -> None:
+        item = {"ip": " 10.0.0.1", "port": "8080 ", "protocol": "SOCKS5", "country": "", "source": "test", "x": 1}
+        assert utils.normalize_proxy(item) == {"ip": "10.0.0.1", "port": 8080, "protocol": "socks5", "source": "test"}
+
+        assert utils.normalize_proxy({"ip": "10.0.0.1", "port": 65536}) is None
+        assert utils.normalize_proxy({"ip": "10.0.0", "port": 80}) is None
+        assert utils.normalize_proxy(["10.0.0.1", 80]) is None
+
+    def test_read_proxies(self) -> None:
+        lines: list[bytes | str] = [
+            b'{"ip": "10.0.0.1", "port": 80}',
+            b"",
+            b"{",
+            '{"ip": "::1", "port": 1080}',
+            b"null",
+        ]
+        proxies = utils.read_proxies(iter(lines))
+
+        assert next(proxies) == {"ip": "10.0.0.1", "port": 80}  # lines are read lazily
+        assert list(proxies) == [{"ip": "::1", "port": 1080}]
+
+
+@pytest.mark.django_db()
+class TestRandomProxy:
+    def test_pick_random(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        for i, random_key in enumerate([0.2, 0.4, 0.6]):
+            Proxy.objects.create(ip=f"10.0.0.{i}", port=8000 + i, source="test", random_key=random_key)
+
+        monkeypatch.setattr(managers.random, "random", lambda: 0.3)
+        assert Proxy.objects.pick_random("port") == {"port": 8001}
+        monkeypatch.setattr(managers.random, "random", lambda: 0.9)
+        assert Proxy.objects.pick_random("port") == {"port": 8000}  # wraps around
+        assert Proxy.objects.filter(port=9000).pick_random("port") is None
+
+    @pytest.fixture(autouse=True)
+    def _pool(self, settings: LazySettings) -> None:
+        settings.PROXY_POOL_REFRESH_INTERVAL = 0
+        proxy_pool.clear()
+        cache.clear()  # throttle history
+
+    @pytest.mark.parametrize("pool", [True, False])
+    def test_random(self, api_client: APIClient, settings: LazySettings, pool: bool) -> None:
+        settings.PROXY_POOL_ENABLED = pool
+        url = reverse("proxy-random")
+        assert api_client.get(url).json() == {"message": "No active proxies found."}
+
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", country="SG", protocol="socks5")
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test", country="US", protocol="socks5")
+        Proxy.objects.create(ip="10.0.0.3", port=8003, source="test", country="SG", is_active=False)
+
+        for _ in range(5):
+            cache.clear()  # throttled to 1 request per second
+            res = api_client.get(url, {"country": "SG"})
+            assert res.status_code == status.HTTP_200_OK
+            assert res.json() == {
+                "ip": "10.0.0.1",
+                "port": 8001,
+                "protocol": "socks5",
+                "country": "SG",
+                "anonymity": "unknown",
+            }
+
+    def test_sample_random(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        for i, random_key in enumerate([0.2, 0.4, 0.6, 0.8]):
+            Proxy.objects.create(ip=f"10.0.0.{i}", port=8000 + i, source="test", random_key=random_key)
+
+        monkeypatch.setattr(managers.random, "random", lambda: 0.5)
+        assert Proxy.objects.sample_random(3, "port") == [{"port": 8002}, {"port": 8003}, {"port": 8000}]
+        assert Proxy.objects.sample_random(3, "port", exclude=[("10.0.0.3", 8003)]) == [
+            {"port": 8002},
+            {"port": 8000},
+            {"port": 8001},
+        ]
+        assert len(Proxy.objects.sample_random(10, "port")) == 4
+
+    @pytest.mark.parametrize("pool", [True, False])
+    def test_random_count(self, api_client: APIClient, settings: LazySettings, pool: bool) -> None:
+        settings.PROXY_POOL_ENABLED = pool
+        url = reverse("proxy-random")
+        assert api_client.get(url, {"count": 5}).json() == []
+
+        for i in range(10):
+            Proxy.objects.create(ip=f"10.0.0.{i}", port=8000 + i, source="test", country="SG" if i < 6 else "US")
+
+        cache.clear()
+        params: dict[str, Any] = {"count": 5, "country": "SG", "exclude": ["10.0.0.0:8000,10.0.0.1:8001"]}
+        res = api_client.get(url, params)
+        assert res.status_code == status.HTTP_200_OK
+        ports = [proxy["port"] for proxy in res.json()]
+        assert len(ports) == len(set(ports)) == 4
+        assert set(ports) == {8002, 8003, 8004, 8005}
+
+        cache.clear()
+        params = {"count": 3, "exclude": ["10.0.0.9:8009", "10.0.0.8:8008"]}
+        res = api_client.get(url, params)
+        assert len({proxy["port"] for proxy in res.json()} - {8008, 8009}) == 3
+
+    @pytest.mark.parametrize(
+        "params",
+        [{"count": 0}, {"count": 101}, {"count": "x"}, {"exclude": "10.0.0.1"}, {"exclude": "10.0.0.1:x"}],
+    )
+    def test_random_count_invalid(self, api_client: APIClient, params: dict[str, Any]) -> None:
+        res = api_client.get(reverse("proxy-random"), params)
+        assert res.status_code == status.HTTP_400_BAD_REQUEST
+        assert set(res.json()) == set(params)
+
+    def test_get_score(self, settings: LazySettings) -> None:
+        now = timezone.now()
+        reliable = {"latency_history": [200] * 24, "last_worked_at": now}
+        assert utils.get_score(reliable, now) == pytest.approx(25 / 26 * 1000 / 1200)
+        assert utils.get_score({**reliable, "latency_history": [200, None] * 12}, now) < utils.get_score(reliable, now)
+        assert utils.get_score({**reliable, "latency_history": [2000] * 24}, now) < utils.get_score(reliable, now)
+        stale = {**reliable, "last_worked_at": now - timedelta(seconds=settings.PROXY_SCORE_HALF_LIFE)}
+        assert utils.get_score(stale, now) == pytest.approx(utils.get_score(reliable, now) / 2)
+        assert 0 < utils.get_score({}, now) < utils.get_score(stale, now)
+
+    def test_alias_table(self) -> None:
+        random.seed(0)
+        table = AliasTable([1.0, 0.0, 3.0, 4.0])
+        draws = collections.Counter(table.draw() for _ in range(8000))
+        assert draws[1] == 0
+        assert draws[0] / 8000 == pytest.approx(1 / 8, abs=0.02)
+        assert draws[2] / 8000 == pytest.approx(3 / 8, abs=0.02)
+        assert draws[3] / 8000 == pytest.approx(4 / 8, abs=0.02)
+
+    @pytest.mark.parametrize("pool", [True, False])
+    def test_random_weighted(self, api_client: APIClient, settings: LazySettings, pool: bool) -> None:
+        settings.PROXY_POOL_ENABLED = pool
+        now = timezone.now()
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", latency_history=[100] * 24, last_worked_at=now)
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test", latency_history=[None] * 23 + [9000])
+
+        random.seed(0)
+        counts: collections.Counter[int] = collections.Counter()
+        for _ in range(50):
+            cache.clear()  # throttled to 1 request per second
+            res = api_client.get(reverse("proxy-random"), {"weighted": True})
+            counts[res.json()["port"]] += 1
+        assert counts[8001] > 45
+
+        cache.clear()
+        res = api_client.get(reverse("proxy-random"), {"weighted": True, "count": 5})
+        assert sorted(proxy["port"] for proxy in res.json()) == [8001, 8002]  # distinct, all of them
+
+    def test_pool_weighted_tables(self) -> None:
+        pool = ProxyPool()
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", country="SG")
+        assert pool.sample(1, weighted=True)[0]["ip"] == "10.0.0.1"
+        assert pool.buckets[(None, None, None)].table is not None
+
+        # changes reset the alias tables of the buckets, the score is computed on add
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test", country="SG")
+        pool.update()
+        assert pool.buckets[(None, None, None)].table is None
+        assert len(pool.scores) == 2
+        assert {proxy["ip"] for proxy in pool.sample(2, weighted=True)} == {"10.0.0.1", "10.0.0.2"}
+
+    def test_random_invalid_filter(self, api_client: APIClient) -> None:
+        res = api_client.get(reverse("proxy-random"), {"protocol": "ftp"})
+        assert res.status_code == status.HTTP_400_BAD_REQUEST
+        assert "protocol" in res.json()
+
+    def test_pool(self, settings: LazySettings) -> None:
+        pool = ProxyPool()
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", country="SG", protocol="socks5")
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test", country="US", protocol="http")
+        Proxy.objects.create(ip="10.0.0.3", port=8003, source="test", country="SG", is_active=False)
+
+        assert len(pool.proxies) == 0
+        assert pool.get_random(country="SG") == {
+            "ip": "10.0.0.1",
+            "port": 8001,
+            "protocol": "socks5",
+            "country": "SG",
+            "anonymity": "unknown",
+        }
+        assert len(pool.proxies) == 2
+        assert len(pool.buckets[(None, None, None)]) == 2
+        assert pool.get_random(protocol="http", country="US")["ip"] == "10.0.0.2"
+        assert pool.get_random(protocol="http", country="SG") is None
+        assert pool.get_random(country="FR") is None
+
+    def test_pool_update(self, settings: LazySettings) -> None:
+        pool = ProxyPool()
+        first = Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", country="SG")
+        assert pool.get_random()["ip"] == "10.0.0.1"
+        loaded_at = pool.loaded_at
+
+        # saved proxies are updated incrementally, from the revision watermark
+        results: list[Any] = [
+            {"ip": "10.0.0.1", "port": 8001, "source": "test", "is_active": False},
+            {"ip": "10.0.0.2", "port": 8002, "source": "test", "is_active": True, "country": "US"},
+        ]
+        tasks.save_proxies(results, do_create=True)
+        assert pool.get_random(country="SG") is None
+        assert pool.get_random()["ip"] == "10.0.0.2"
+        assert pool.loaded_at == loaded_at
+        assert first.pk not in pool.proxies
+        assert (None, "SG", None) not in pool.buckets
+
+        # deleted proxies are removed by a reload, on the version bumped by the cleanup
+        Proxy.objects.update(check_fail_count=3)
+        tasks.dead_proxies_cleanup_task()
+        assert pool.get_random() is None
+        assert pool.loaded_at != loaded_at
+
+    def test_pool_revisions(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        pool = ProxyPool()
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test")
+        pool.refresh()
+        assert pool.watermark == ProxyVersion.objects.get().revision
+
+        pool.checked_at = 0.0
+        with CaptureQueriesContext(connection) as queries:
+            pool.refresh()
+        assert len(queries) == 1  # the version only, nothing was saved since
+
+        # saved by a transaction stamped before the latest write, e.g. on another host, its revision is still newer
+        earlier = timezone.now() - timedelta(minutes=5)
+        with monkeypatch.context() as patch:
+            patch.setattr(timezone, "now", lambda: earlier)
+            tasks.save_proxies([{"ip": "10.0.0.2", "port": 8002, "source": "test"}])  # type: ignore[typeddict-item]
+        pool.checked_at = 0.0
+        with CaptureQueriesContext(connection) as queries:
+            pool.refresh()
+        assert len(queries) == 2  # the version, then the proxies saved in the revisions after the watermark
+        assert len(pool.proxies) == 2
+        assert pool.watermark == ProxyVersion.objects.get().revision
+
+    def test_pool_reads_unlocked(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        pool = ProxyPool()
+        get_values = ProxyPool.get_values
+        locked = []
+
+        def record_lock(values: list[Any], now: datetime) -> tuple[Any, float]:
+            locked.append(pool.lock.locked())
+            return get_values(values, now)
+
+        monkeypatch.setattr(pool, "get_values", record_lock)
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test")
+        pool.refresh()  # load
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test")
+        pool.checked_at = 0.0
+        pool.refresh()  # update
+        assert locked == [False, False]  # the proxies are read without blocking the requests
+        assert len(pool.proxies) == 2
+
+    def test_pool_refresh_interval(self, settings: LazySettings) -> None:
+        settings.PROXY_POOL_REFRESH_INTERVAL = 60
+        pool = ProxyPool()
+        assert pool.get_random() is None
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test")
+        assert pool.get_random() is None  # not refreshed yet
+        pool.clear()
+        assert pool.get_random()["ip"] == "10.0.0.1"
+
+    def test_saving_draws_random_key(self) -> None:
+        proxy = Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", random_key=2.0)
+        tasks.save_proxies([{"ip": "10.0.0.1", "port": 8001, "source": "test"}], do_create=False)  # type: ignore
+
+        proxy.refresh_from_db()
+        assert 0 <= proxy.random_key < 1
+
+
+@pytest.mark.django_db()
+class TestExport:
+    @pytest.fixture(autouse=True)
+    def _unthrottled(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(ProxyViewSet, "throttle_classes", [])
+
+    @pytest.fixture()
+    def _proxies(self) -> None:
+        worked_at = timezone.now()
+        Proxy.objects.create(ip="10.0.0.1", port=8001, source="test", country="SG", protocol="socks5", latency=120)
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test", country="US", last_worked_at=worked_at)
+        Proxy.objects.create(ip="10.0.0.3", port=8003, source="test", country="SG", is_active=False)
+
+    @staticmethod
+    def get_content(api_client: APIClient, params: dict[str, Any]) -> tuple[str, str]:
+        res = api_client.get(reverse("proxy-export"), params)
+        assert res.status_code == status.HTTP_200_OK
+        return res["Content-Type"], b"".join(res.streaming_content).decode()  # type: ignore[attr-defined]
+
+    @pytest.mark.usefixtures("_proxies")
+    def test_export(self, api_client: APIClient, user: User, settings: LazySettings) -> None:
+        settings.PROXY_EXPORT_CHUNK_SIZE = 1
+        api_client.force_login(user)
+
+        assert self.get_content(api_client, {}) == ("text/plain", "10.0.0.1:8001\n10.0.0.2:8002\n")
+        assert self.get_content(api_client, {"output": "url", "country": "SG"}) == (
+            "text/plain",
+            "socks5://10.0.0.1:8001\n",
+        )
+
+        content_type, content = self.get_content(api_client, {"output": "csv"})
+        assert content_type == "text/csv"
+        rows = content.splitlines()
+        assert rows[0] == "ip,port,protocol,country,anonymity,latency,last_checked_at,last_worked_at"
+        assert rows[1] == "10.0.0.1,8001,socks5,SG,unknown,120,,"
+        assert len(rows) == 3
+
+        content_type, content = self.get_content(api_client, {"output": "ndjson", "protocol": "http"})
+        assert content_type == "application/x-ndjson"
+        proxy = json.loads(content)
+        assert proxy["ip"] == "10.0.0.2"
+        assert proxy["last_worked_at"] is not None
+
+    def test_export_empty(self, api_client: APIClient, user: User) -> None:
+        api_client.force_login(user)
+        assert self.get_content(api_client, {}) == ("text/plain", "")
+        assert self.get_content(api_client, {"output": "csv"})[1].splitlines() == [
+            "ip,port,protocol,country,anonymity,latency,last_checked_at,last_worked_at"
+        ]
+
+    def test_export_invalid(self, api_client: APIClient, user: User) -> None:
+        url = reverse("proxy-export")
+        assert api_client.get(url).status_code == status.HTTP_403_FORBIDDEN
+
+        api_client.force_login(user)
+        assert api_client.get(url, {"output": "xml"}).status_code == status.HTTP_400_BAD_REQUEST
+        assert api_client.get(url, {"protocol": "ftp"}).status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.usefixtures("_proxies")
+    def test_export_asgi(self, user: User, settings: LazySettings, monkeypatch: pytest.MonkeyPatch) -> None:
+        settings.PROXY_EXPORT_CHUNK_SIZE = 1
+        batches = []
+        get_batch = managers.ProxyQuerySet.get_batch
+
+        def record_batch(qs: managers.ProxyQuerySet, *args: Any) -> list[dict[str, Any]]:
+            batch = get_batch(qs, *args)
+            batches.append(len(batch))
+            return batch
+
+        monkeypatch.setattr(managers.ProxyQuerySet, "get_batch", record_batch)
+        client = AsyncClient()
+        client.force_login(user)
+
+        async def export() -> list[bytes]:
+            res = await client.get(reverse("proxy-export"), {"output": "url"})
+            assert res.status_code == status.HTTP_200_OK
+            assert res.is_async  # type: ignore[attr-defined]
+            chunks: list[bytes] = []
+            async for chunk in res.streaming_content:  # type: ignore[attr-defined]
+                assert len(batches) == len(chunks) + 1  # read one batch at a time as the response is sent
+                chunks.append(chunk)
+            return chunks
+
+        assert async_to_sync(export)() == [b"socks5://10.0.0.1:8001\n", b"http://10.0.0.2:8002\n"]
+        assert batches == [1, 1, 0]
+
+
+@pytest.mark.django_db()
+class TestConditionalGet:
+    @pytest.fixture(autouse=True)
+    def _unthrottled(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(ProxyViewSet, "throttle_classes", [])
+
+    @pytest.mark.parametrize("name", ["proxy-list", "proxy-detail", "proxy-export"])
+    def test_conditional_get(self, api_client: APIClient, user: User, name: str) -> None:
+        proxy = Proxy.objects.create(ip="10.0.0.1", port=8001, source="test")
+        url = reverse(name, args=[proxy.pk] if name == "proxy-detail" else [])
+        api_client.force_login(user)
+
+        res = api_client.get(url)
+        assert res.status_code == status.HTTP_200_OK
+        etag, last_modified = res["ETag"], res["Last-Modified"]
+
+        for headers in [{"HTTP_IF_NONE_MATCH": etag}, {"HTTP_IF_MODIFIED_SINCE": last_modified}]:
+            assert api_client.get(url, **headers).status_code == status.HTTP_304_NOT_MODIFIED  # type: ignore[arg-type]
+
+        tasks.save_proxies([{"ip": "10.0.0.2", "port": 8002, "source": "test"}])  # type: ignore[typeddict-item]
+        res = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert res.status_code == status.HTTP_200_OK
+        assert res["ETag"] != etag
+
+    def test_modified_outside_requests(
+        self, api_client: APIClient, user: User, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        proxy = Proxy.objects.create(ip="10.0.0.1", port=8001, source="test")
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test")
+        url = reverse("proxy-list")
+        api_client.force_login(user)
+        res = api_client.get(url)
+        etag, last_modified = res["ETag"], res["Last-Modified"]
+        assert parse_http_date(last_modified) > ProxyVersion.objects.get().updated_at.timestamp()  # rounded up
+
+        # a write of another process committed after the proxies were read, stamped before the latest write
+        with monkeypatch.context() as patch:
+            patch.setattr(timezone, "now", lambda: proxy.updated_at - timedelta(minutes=1))
+            tasks.save_proxies([{"ip": "10.0.0.3", "port": 8003, "source": "test"}])  # type: ignore[typeddict-item]
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_200_OK
+
+        etag = api_client.get(url)["ETag"]
+        Proxy.objects.filter(ip="10.0.0.2").update(check_fail_count=3)
+        tasks.dead_proxies_cleanup_task()  # deletions bump the version
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == status.HTTP_200_OK
+        assert api_client.get(url, HTTP_IF_NONE_MATCH=etag).json()["count"] == 2
+
+    def test_proxy_version(self) -> None:
+        assert ProxyVersion.objects.current() is None
+        proxy = Proxy.objects.create(ip="10.0.0.1", port=8001, source="test")
+        version = ProxyVersion.objects.get()
+        assert version.revision == 1
+
+        tasks.save_proxies([{"ip": "10.0.0.2", "port": 8002, "source": "test"}])  # type: ignore[typeddict-item]
+        current = ProxyVersion.objects.get()
+        assert (current.version, current.revision) == (version.version, 2)
+        assert current.updated_at >= version.updated_at
+
+        proxy.delete()
+        current = ProxyVersion.objects.get()
+        assert current.version != version.version
+        assert current.revision == 3
+
+
+@pytest.mark.django_db()
+class TestPagination:
+    def test_cursor_pagination(self, api_client: APIClient, user: User, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(ProxyViewSet, "throttle_classes", [])
+        monkeypatch.setattr(IdCursorPagination, "page_size", 2)
+        ids = [Proxy.objects.create(ip=f"10.0.0.{i}", port=8000 + i, source="test").pk for i in range(5)]
+        api_client.force_login(user)
+
+        assert "count" in api_client.get(reverse("proxy-list")).json()  # page numbers by default
+
+        pages, url, params = [], reverse("proxy-list"), {"pagination": "cursor"}
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                res = api_client.get(url, params).json()
+            assert not any("COUNT(" in query["sql"] for query in queries)
+            assert "count" not in res
+            pages.append([proxy["id"] for proxy in res["results"]])
+            url, params = res["next"], {}  # the next link carries the cursor
+        assert pages == [ids[:2], ids[2:4], ids[4:]]
+
+
+class TestCountryResolver:
+    @pytest.mark.parametrize(
+        ("name", "code"),
+        [
+            ("United States", "US"),
+            ("usa", "US"),  # alias
+            ("Singapore", "SG"),
+            ("russian federation", "RU"),  # official name
+            ("Turkey", "TR"),  # old name
+            ("Côte d'Ivoire", "CI"),
+            ("COTE D IVOIRE", "CI"),  # folded
+            ("Korea, Republic of", "KR"),  # reordered
+            ("Republic of Korea", "KR"),
+            ("Bolivia", "BO"),  # without parenthesis
+            ("Bosnia & Herzegovina", "BA"),
+            ("DEU", "DE"),  # alpha-3 code
+            ("korea", ""),  # ambiguous
+            ("Atlantis", ""),
+            ("", ""),
+        ],
+    )
+    def test_get_country_code(self, name: str, code: str) -> None:
+        assert utils.get_country_code(name) == code
+
+    def test_resolve_miss(self) -> None:
+        resolver = utils.CountryResolver(aliases={"holland": "NL"})
+
+        assert resolver.resolve("Holland") == "NL"
+        assert resolver.resolve("england") == ""  # aliases replace the default ones
+        assert resolver.resolve("Kitts") == "KN"  # the only country named with all the words
+        assert resolver.resolve("Kitts") == "KN"
+        assert resolver.resolve_miss.cache_info().hits == 1
+
+
+@pytest.mark.django_db()
+class TestWorkflows:
+    @pytest.fixture(autouse=True)
+    def _eager(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        monkeypatch.setattr(app.conf, "CELERY_TASK_ALWAYS_EAGER", True)  # settings use the CELERY namespace
+        cache.clear()  # scrapyd jobs list
+
+    @pytest.fixture()
+    def checked(self, monkeypatch: pytest.MonkeyPatch) -> list[int]:
+        """Patches the checking engine, proxies on even ports are working. Returns the sizes of the checked batches."""
+        batches = []
+
+        def check_proxies(proxies: list[dict[str, Any]]) -> list[CheckProxyResultTypedDict]:
+            batches.append(len(proxies))
+            results = []
+            for proxy in proxies:
+                result = utils.get_check_proxy_result(proxy["ip"], proxy["port"])
+                if int(proxy["port"]) % 2 == 0:
+                    result.update({"protocol": "socks5", "country": "SG", "speed": 100, "is_working": True})
+                results.append(result)
+            return results
+
+        monkeypatch.setattr(tasks, "check_proxies", check_proxies)
+        return batches
+
+    def test_check_proxies_batch_task(self, checked: list[int]) -> None:
+        proxies = [{"ip": "10.0.0.1", "port": 80, "protocol": "http"}, None, {"ip": "", "port": 80}]
+        [result] = tasks.check_proxies_batch_task(proxies)  # type: ignore[arg-type, misc]
+
+        assert checked == [1]
+        assert result["protocol"] == "socks5"
+        assert result["is_active"] is True
+        assert result["check_fail_count"] == 0
+        assert result["latency_history"] == [100]
+
+    def test_proxy_workflow(self, checked: list[int]) -> None:
+        proxies = [{"ip": f"10.0.0.{i}", "port": 8000 + i, "source": "test"} for i in range(5)]
+        tasks.proxy_workflow(proxies, batch_size=2)  # type: ignore[arg-type]
+
+        assert checked == [2, 2, 1]
+        assert Proxy.objects.count() == 5
+        assert Proxy.objects.filter(is_active=True).count() == 3
+
+    def test_proxy_workflow_skips_recently_checked(self, checked: list[int], settings: LazySettings) -> None:
+        settings.CHECKER_RESULT_TTL = 3600
+        now = timezone.now()
+        recent = Proxy.objects.create(
+            ip="10.0.0.1", port=8001, source="test", last_checked_at=now - timedelta(minutes=5)
+        )
+        Proxy.objects.create(ip="10.0.0.2", port=8002, source="test", last_checked_at=now - timedelta(hours=2))
+        Proxy.objects.create(ip="10.0.0.3", port=9999, source="test", last_checked_at=now)  # another port
+
+        proxies = [{"ip": f"10.0.0.{i}", "port": str(8000 + i), "source": "test"} for i in range(4)]
+        tasks.proxy_workflow(proxies, batch_size=2)  # type: ignore[arg-type]
+
+        assert checked == [2, 1]  # 10.0.0.1:8001 is skipped, the remaining proxies are batched together
+        assert Proxy.objects.get(ip="10.0.0.1", port=8001).last_checked_at == recent.last_checked_at
+        assert Proxy.objects.filter(ip="10.0.0.2", port=8002, last_checked_at__gt=now).exists()
+
+    def test_proxy_workflow_deduplicates_crawl(self, checked: list[int]) -> None:
+        first = [{"ip": f"10.0.0.{i}", "port": 8000 + i, "source": "first"} for i in range(3)]
+        second = [{"ip": f"10.0.0.{i}", "port": 8000 + i, "source": "second"} for i in range(1, 5)]
+        invalid = [{"ip": "10.0.0.256", "port": 8000, "source": "second"}, {"ip": "10.0.0.9", "port": 0}]
+        tasks.proxy_workflow(first, crawl_id="crawl")  # type: ignore[arg-type]
+        tasks.proxy_workflow(second + invalid + second, crawl_id="crawl")  # type: ignore[arg-type]
+        another = [{"ip": f"10.0.1.{i}", "port": 8000 + i, "source": "second"} for i in range(1, 5)]
+        tasks.proxy_workflow(another, crawl_id="another")  # type: ignore[arg-type]
+
+        assert checked == [3, 2, 4]  # only 10.0.0.3 and 10.0.0.4 are new to the second spider of the crawl
+        assert ProxyClaim.objects.filter(crawl_id="crawl", is_checked=True).count() == 5
+        assert ProxyClaim.objects.get(crawl_id="crawl", ip="10.0.0.1", is_checked=True).source == "first"
+        sources = ProxyClaim.objects.filter(crawl_id="crawl", ip="10.0.0.1").values_list("source", flat=True)
+        assert sorted(sources) == ["first", "second"]  # every source of the proxy is recorded
+        assert ProxyClaim.objects.filter(crawl_id="crawl").count() == 7
+        assert Proxy.objects.get(ip="10.0.0.4", port=8004).source == "second"
+
+    def test_get_crawl_result_task(self, checked: list[int], monkeypatch: pytest.MonkeyPatch) -> None:
+        job = {"id": "job", "items_url": "/items/job.jl"}
+        jobs = {"pending": [], "running": [], "finished": [job]}
+        monkeypatch.setattr(tasks.client, "jobs", lambda project: jobs)
+
+        lines = [json.dumps({"ip": f" 10.0.0.{i} ", "port": str(8000 + i), "protocol": "HTTP"}) for i in range(5)]
+        lines += ["", "not json", json.dumps({"ip": "localhost", "port": 80})]
+
+        class Response:
+            ok = True
+
+            def __enter__(self) -> "Response":
+                return self
+
+            def __exit__(self, *args: Any) -> None:
+                pass
+
+            def iter_lines(self) -> Any:
+                return iter(lines)
+
+        monkeypatch.setattr(tasks.requests, "get", lambda *args, **kwargs: Response())
+
+        assert tasks.get_crawl_result_task("job", crawl_id="crawl", batch_size=2) == 5
+        assert checked == [2, 2, 1]
+        assert Proxy.objects.filter(ip="10.0.0.4", port=8004, protocol="socks5").exists()
+
+    def test_claim_check(self, checked: list[int], settings: LazySettings) -> None:
+        settings.CHECKER_CLAIM_CHECK = True
+        proxies = [{"ip": f"10.0.0.{i}", "port": 8000 + i, "source": "test"} for i in range(3)]
+        tasks.proxy_workflow(proxies, batch_size=2)  # type: ignore[arg-type]
+        Proxy.objects.update(last_checked_at=timezone.now() - timedelta(hours=2))
+        tasks.recheck_workflow(batch_size=2)
+
+        assert checked == [2, 1, 2, 1]
+        assert Proxy.objects.filter(is_active=True).count() == 2
+        assert Proxy.objects.get(ip="10.0.0.0").latency_history == [100, 100]
+        assert not ProxyPayload.objects.exists()  # payloads are deleted once saved
+
+    def test_staged_payload(self) -> None:
+        now = timezone.now()
+        key = ProxyPayload.objects.stage([{"ip": "10.0.0.1", "last_checked_at": now}])
+
+        assert ProxyPayload.objects.load(key) == [{"ip": "10.0.0.1", "last_checked_at": now.isoformat()[:23] + "Z"}]
+
+        ProxyPayload.objects.update(created_at=now - timedelta(days=2))
+        tasks.staged_payloads_cleanup_task()
+        with pytest.raises(ProxyPayload.DoesNotExist):
+            ProxyPayload.objects.load(key)
+
+    @pytest.fixture()
+    def crawl_results(self, monkeypatch: pytest.MonkeyPatch) -> list[tuple[str, str | None]]:
+        """Patches the dispatch of get_crawl_result_task(). Returns the (job_id, crawl_id) of the dispatched tasks."""
+        dispatched = []
+
+        def delay(job_id: str, crawl_id: str | None = None, **kwargs: Any) -> None:
+            dispatched.append((job_id, crawl_id))
+
+        monkeypatch.setattr(tasks.get_crawl_result_task, "delay", delay)
+        return dispatched
+
+    @staticmethod
+    def patch_jobs(monkeypatch: pytest.MonkeyPatch, *finished: list[str]) -> list[int]:
+        """Patches the scrapyd jobs list, finished with the given job ids on each call. Returns the number of calls."""
+        calls = [0]
+
+        def jobs(project: str) -> dict[str, list[dict[str, str]]]:
+            job_ids = finished[min(calls[0], len(finished) - 1)]
+            calls[0] += 1
+            return {"pending": [], "running": [], "finished": [{"id": job_id} for job_id in job_ids]}
+
+        monkeypatch.setattr(tasks.client, "jobs", jobs)
+        return calls
+
+    def test_crawl_workflow(self, crawl_results: list[tuple[str, str | None]], monkeypatch: pytest.MonkeyPatch) -> None:
+        def schedule(project: str, spider: str, args: dict[str, Any]) -> str:
+            if spider == "broken":
+                raise ConnectionError(spider)
+            return f"job-{spider}"
+
+        monkeypatch.setattr(tasks.client, "spiders", lambda project: ["first", "broken", "second"])
+        monkeypatch.setattr(tasks.client, "schedule", schedule)
+        self.patch_jobs(monkeypatch, ["job-first", "job-second"])
+        tasks.crawl_workflow()
+
+        assert [job_id for job_id, _ in crawl_results] == ["job-first", "job-second"]
+        assert len({crawl_id for _, crawl_id in crawl_results}) == 1  # spiders share the crawl id
+
+    def test_poll_crawl_jobs_task(
+        self, crawl_results: list[tuple[str, str | None]], monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        calls = self.patch_jobs(monkeypatch, ["a"], ["a", "c"], ["a", "b", "c"])
+        result = tasks.poll_crawl_jobs_task(["a", "b", "c"], crawl_id="crawl")
+
+        assert calls == [3]  # a single jobs list per poll for all the jobs
+        assert crawl_results == [("a", "crawl"), ("c", "crawl"), ("b", "crawl")]
+        assert result == {"finished": ["a"], "waiting": ["b", "c"], "timed_out": []}
+
+    def test_poll_crawl_jobs_task_backoff(self, monkeypatch: pytest.MonkeyPatch, settings: LazySettings) -> None:
+        settings.SCRAPYD_POLL_INTERVAL = 5
+        settings.SCRAPYD_POLL_MAX_INTERVAL = 60
+        countdowns = []
+        monkeypatch.setattr(
+            tasks.poll_crawl_jobs_task, "apply_async", lambda *a, **kw: countdowns.append(kw["countdown"])
+        )
+        self.patch_jobs(monkeypatch, [])
+        for attempt in range(6):
+            tasks.poll_crawl_jobs_task(["a"], attempt=attempt)
+
+        assert countdowns == [5, 10, 20, 40, 60, 60]
+
+    def test_poll_crawl_jobs_task_timeout(
+        self, crawl_results: list[tuple[str, str | None]], monkeypatch: pytest.MonkeyPatch, settings: LazySettings
+    ) -> None:
+        settings.SCRAPYD_POLL_TIMEOUT = 60
+        self.patch_jobs(monkeypatch, ["a"])
+        result = tasks.poll_crawl_jobs_task(["a", "b"], started_at=time.time() - 60)
+
+        assert crawl_results == [("a", None)]
+        assert result == {"finished": ["a"], "waiting": [], "timed_out": ["b"]}
+
+    def test_write_buffer(self, checked: list[int], settings: LazySettings) -> None:
+        settings.PROXY_WRITE_BUFFER_SIZE = 4
+        proxies = [{"ip": f"10.0.0.{i}", "port": 8000 + i, "source": "test"} for i in range(3)]
+        tasks.proxy_workflow(proxies, batch_size=2)  # type: ignore[arg-type]
+
+        assert checked == [2, 1]
+        assert ProxyBuffer.objects.count() == 2
+        assert not Proxy.objects.exists()
+        assert tasks.flush_proxies_task() is None  # neither full nor old enough
+
+        tasks.proxy_workflow([{"ip": "10.0.0.0", "port": 8000, "source": "test"}])  # type: ignore[typeddict-item]
+        assert not ProxyBuffer.objects.exists()  # full, flushed by the save
+        assert Proxy.objects.count() == 3
+
+        Proxy.objects.update(last_checked_at=timezone.now() - timedelta(hours=2))
+        tasks.recheck_workflow()
+        settings.PROXY_WRITE_BUFFER_AGE = 0
+        flushed = tasks.flush_proxies_task()
+        assert flushed is not None
+        assert (flushed["batches"], flushed["rows"]) == (1, 3)
+        assert Proxy.objects.get(ip="10.0.0.0").latency_history == [100, 100]
+
+    def test_write_buffer_retry(self, settings: LazySettings) -> None:
+        settings.PROXY_WRITE_BUFFER_SIZE = 10
+        results = [{"ip": "10.0.0.1", "port": 8001, "source": "test", "is_active": True}]
+        for _ in range(2):  # retried with the same task id
+            tasks.save_proxies_task.apply((results,), task_id="save")
+
+        assert ProxyBuffer.objects.get().size == 1
+
+    def test_recheck_workflow(self, checked: list[int]) -> None:
+        for i in range(3):
+            Proxy.objects.create(ip=f"10.0.0.{i}", port=8000 + i, source="test", is_active=False)
+        tasks.recheck_workflow(batch_size=2)
+
+        assert checked == [2, 1]
+        assert not Proxy.objects.filter(last_checked_at__isnull=True).exists()
+        assert Proxy.objects.filter(is_active=True).count() == 2
+
+    def test_recheck_batches(self) -> None:
+        now = timezone.now()
+        for i in range(5):
+            last_checked_at = None if i % 2 else now - timedelta(hours=2, minutes=i % 3)
+            Proxy.objects.create(ip=f"10.0.0.{i}", port=8000 + i, source="test", last_checked_at=last_checked_at)
+        Proxy.objects.create(ip="10.0.0.9", port=8009, source="test", last_checked_at=now)  # recently checked
+
+        batches = list(Proxy.objects.recheck_batches(now - timedelta(hours=1), fields=["port"], batch_size=2))
+
+        # never checked proxies by id, then the others by (last_checked_at, id)
+        assert batches == [[{"port": 8001}, {"port": 8003}], [{"port": 8002}, {"port": 8004}], [{"port": 8000}]]
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import TypedDict
+from typing import NotRequired, TypedDict
 
 
 class JobTypedDict(TypedDict):
@@ -20,6 +20,18 @@ class JobsTypedDict(TypedDict):
     finished: list[JobTypedDict]
 
 
+class CrawlJobsTypedDict(TypedDict):
+    finished: list[str]  # job ids dispatched to get_crawl_result_task()
+    waiting: list[str]  # job ids polled again
+    timed_out: list[str]  # job ids given up on after the poll timeout
+
+
+class FlushTypedDict(TypedDict):
+    batches: int  # number of buffered batches flushed
+    rows: int  # number of proxies saved
+    seconds: float  # duration of the flush
+
+
 class CheckProxyResultTypedDict(TypedDict):
     ip: str
     port: int
@@ -28,6 +40,7 @@ class CheckProxyResultTypedDict(TypedDict):
     anonymity: str
     speed: int
     is_working: bool
+    protocols: list[str]  # protocols the proxy was working with
 
 
 class ProxyTypedDict(TypedDict):
@@ -45,3 +58,7 @@ class CheckedProxyTypedDict(ProxyTypedDict):
     check_fail_count: int
     last_checked_at: datetime | None  # datetime (optional)
     last_worked_at: datetime | None  # datetime (optional)
+    latency: NotRequired[int | None]  # latency of the last working check in milliseconds (optional)
+    latency_history: NotRequired[list[int | None]]  # recent check latencies in milliseconds, None if failed
+    random_key: NotRequired[float]  # random number in [0, 1) to pick a random proxy with
+    revision: NotRequired[int]  # revision of the proxies the proxy is saved in, see ProxyVersion
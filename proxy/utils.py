@@ -1,21 +1,42 @@
+import asyncio
+import collections
+import contextlib
+import csv
+import functools
+import io
+import ipaddress
+import json
 import logging
+import math
+import random
+import re
+import threading
 import time
-from collections.abc import Sequence
+import unicodedata
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Iterator, Mapping, Sequence
+from datetime import datetime
 from typing import Any
 
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import translation
 from django_countries import countries
+from django_countries.data import COUNTRIES
 
-from config.inspector import inspector
+from config.inspector import InspectorHeadersResponse, async_inspector, inspector
+from config.tunnel import PendingTunnel, is_local_error, start_tunnel
 from proxy.types import CheckedProxyTypedDict, CheckProxyResultTypedDict, ProxyTypedDict
 
 logger = logging.getLogger(__name__)
 
 
-def check_proxy(ip: str, port: int | str) -> CheckProxyResultTypedDict:
-    """Returns True if the proxy is working, False otherwise."""
-    logger.debug(f"Checking proxy {ip}:{port} ...")
+ANONYMITY_HEADERS = ["via", "from", "x_real_ip", "client_ip", "x_proxy_id", "proxy_authorization", "proxy_connection"]
+PROTOCOLS = ["http", "socks4", "socks5"]
+
 
-    result = CheckProxyResultTypedDict(
+def get_check_proxy_result(ip: str, port: int | str) -> CheckProxyResultTypedDict:
+    """Returns the initial (not working) check result for the given proxy."""
+    return CheckProxyResultTypedDict(
         ip=ip,
         port=int(port),
         protocol="",
@@ -23,8 +44,110 @@ def check_proxy(ip: str, port: int | str) -> CheckProxyResultTypedDict:
         anonymity="transparent",
         speed=0,
         is_working=False,
+        protocols=[],
     )
-    protocols = ["http", "socks4", "socks5"]
+
+
+def set_check_proxy_result(
+    result: CheckProxyResultTypedDict,
+    protocol: str,
+    response: InspectorHeadersResponse,
+    elapsed_time: int,
+) -> CheckProxyResultTypedDict:
+    """Sets the values of a working proxy from the inspector response on the check result."""
+    result["protocol"] = protocol
+    result["protocols"] = [protocol]
+    result["country"] = response["country"]
+    result["speed"] = elapsed_time
+
+    if response["ip"] == result["ip"]:
+        if any(header in response for header in ANONYMITY_HEADERS):
+            result["anonymity"] = "anonymous"
+        else:
+            result["anonymity"] = "elite"
+
+    result["is_working"] = True
+    return result
+
+
+def percentile(values: Sequence[int], percent: float) -> int:
+    """Returns the nearest-rank percentile of the given values, 0 if there are none."""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def get_timeout(latencies: Sequence[int | None], has_worked: bool) -> float:
+    """Returns the check timeout in seconds from the observed latencies (in milliseconds) of a proxy.
+
+    The timeout is the CHECKER_TIMEOUT_PERCENTILE of the latencies plus a margin, within the floor and ceiling.
+    Proxies that never worked get the fast-fail timeout, those that worked without any latency the default timeout.
+    """
+    samples = [latency for latency in latencies if latency]
+    if not samples:
+        return settings.CHECKER_TIMEOUT if has_worked else settings.CHECKER_TIMEOUT_UNSEEN
+
+    timeout = percentile(samples, settings.CHECKER_TIMEOUT_PERCENTILE) / 1000 + settings.CHECKER_TIMEOUT_MARGIN
+    return min(max(timeout, settings.CHECKER_TIMEOUT_FLOOR), settings.CHECKER_TIMEOUT_CEILING)
+
+
+def get_proxy_timeout(proxy: Mapping[str, Any]) -> float | None:
+    """Returns the check timeout for the given proxy dict, None (the inspector default) when not adaptive."""
+    if not settings.CHECKER_ADAPTIVE_TIMEOUT:
+        return None
+    return get_timeout(proxy.get("latency_history") or [], has_worked=bool(proxy.get("last_worked_at")))
+
+
+def get_score(proxy: Mapping[str, Any], now: datetime) -> float:
+    """Returns the selection weight of the given proxy dict, in (0, 1], see ProxyPool.sample().
+
+    The weight is the product of the success rate of the recent checks (smoothed, so that a single check does not
+    weigh 0 or 1), a latency factor halving at PROXY_SCORE_LATENCY milliseconds of median latency, and a recency
+    factor halving every PROXY_SCORE_HALF_LIFE seconds since the proxy last worked.
+    """
+    history = proxy.get("latency_history") or []
+    latencies = [latency for latency in history if latency]
+    success = (len(latencies) + 1) / (len(history) + 2)
+
+    latency: int | None = percentile(latencies, 50) if latencies else proxy.get("latency")
+    speed: float = settings.PROXY_SCORE_LATENCY / (settings.PROXY_SCORE_LATENCY + latency) if latency else 0.5
+
+    last_worked_at: datetime | None = proxy.get("last_worked_at")
+    age = (now - last_worked_at).total_seconds() if last_worked_at else math.inf
+    recency: float = max(0.5 ** (max(age, 0) / settings.PROXY_SCORE_HALF_LIFE), 0.01)
+    return success * speed * recency
+
+
+def weighted_sample(items: Sequence[Any], weights: Sequence[float], k: int) -> list[Any]:
+    """Returns up to k distinct items drawn without replacement, each in proportion to its weight.
+
+    Items are ordered by a random key u ** (1 / weight) (Efraimidis-Spirakis), the k highest are drawn.
+    """
+    keys = [random.random() ** (1 / weight) if weight > 0 else 0.0 for weight in weights]
+    ordered = sorted(range(len(items)), key=keys.__getitem__, reverse=True)
+    return [items[i] for i in ordered[:k]]
+
+
+def check_proxy(
+    ip: str,
+    port: int | str,
+    race: bool = settings.CHECKER_RACE_PROTOCOLS,
+    protocols: Sequence[str] = PROTOCOLS,
+    timeout: float | None = None,
+) -> CheckProxyResultTypedDict:
+    """Returns True if the proxy is working, False otherwise.
+
+    The `protocols` are tried in the given order, each with the given `timeout` (the inspector default if None).
+    When `race` is set, they are probed at the same time with acheck_proxy() instead of one after another.
+    """
+    if race:
+        return asyncio.run(acheck_proxy(ip, port, race=True, protocols=protocols, timeout=timeout))
+
+    logger.debug(f"Checking proxy {ip}:{port} ...")
+
+    result = get_check_proxy_result(ip, port)
 
     for protocol in protocols:
         proxy = f"{protocol}://{ip}:{port}"
@@ -32,30 +155,376 @@ def check_proxy(ip: str, port: int | str) -> CheckProxyResultTypedDict:
         proxies = {"http": proxy, "https": proxy}
 
         start_time = time.perf_counter_ns()
-        response = inspector.get_headers(proxies=proxies)
+        response = inspector.get_headers(proxies=proxies, timeout=timeout or inspector.timeout)
         elapsed_time = int((time.perf_counter_ns() - start_time) / 1000000)  # in milliseconds
 
         if not response:
             continue
 
         # at this point, the proxy is working, set the values and break
-        result["protocol"] = protocol
-        result["country"] = response["country"]
-        result["speed"] = elapsed_time
-
-        if response["ip"] == ip:
-            headers = ["via", "from", "x_real_ip", "client_ip", "x_proxy_id", "proxy_authorization", "proxy_connection"]
-            if any(header in response for header in headers):
-                result["anonymity"] = "anonymous"
-            else:
-                result["anonymity"] = "elite"
-
-        result["is_working"] = True
+        set_check_proxy_result(result, protocol, response, elapsed_time)
         break
 
     return result
 
 
+async def probe_proxy(
+    ip: str,
+    port: int | str,
+    protocol: str,
+    timeout: float | None = None,
+    tunnel: PendingTunnel | None = None,
+) -> tuple[str, InspectorHeadersResponse, int]:
+    """Sends a request to the inspector via the proxy with the given protocol, returns the response and its speed.
+    The pending `tunnel` of the prefilter handshake is used for the request, if given."""
+    proxy = f"{protocol}://{ip}:{port}"
+    logger.debug(f"Sending request to inspector via {proxy=} ...")
+
+    start_time = time.perf_counter_ns()
+    response = await async_inspector.get_headers(proxy=proxy, timeout=timeout, tunnel=tunnel)
+    elapsed_time = int((time.perf_counter_ns() - start_time) / 1000000)  # in milliseconds
+
+    return protocol, response, elapsed_time
+
+
+async def prefilter_proxy(
+    ip: str,
+    port: int | str,
+    timeout: float = settings.CHECKER_HANDSHAKE_TIMEOUT,
+) -> list[PendingTunnel]:
+    """Returns the pending tunnels of the protocols the proxy answered a handshake for, fastest first, empty list if it
+    answered none.
+
+    The handshakes are a lot cheaper than full inspector requests, dead and non-proxy hosts are rejected within
+    `timeout` seconds, and the full check only needs to try the protocols returned here, over the connections of their
+    handshakes. The caller closes the tunnels it does not use.
+
+    Only the errors of the proxy (refused or dropped connections, timeouts, truncated replies) count as no answer, the
+    errors of the local host are raised (see is_local_error()), the proxy would be recorded as a failed check otherwise.
+    """
+
+    async def timed_handshake(protocol: str) -> tuple[int, PendingTunnel | None]:
+        start_time = time.perf_counter_ns()
+        try:
+            async with asyncio.timeout(timeout):
+                tunnel = await start_tunnel(protocol, ip, int(port), async_inspector.host, async_inspector.port)
+                return time.perf_counter_ns() - start_time, tunnel
+        except (OSError, EOFError) as error:  # TimeoutError and the connection errors are OSErrors
+            if is_local_error(error):
+                raise
+            return -1, None
+
+    answers = await asyncio.gather(*(timed_handshake(protocol) for protocol in PROTOCOLS), return_exceptions=True)
+    errors = [answer for answer in answers if isinstance(answer, BaseException)]
+    tunnels = [answer for answer in answers if not isinstance(answer, BaseException)]
+    if errors:
+        for _, tunnel in tunnels:
+            if tunnel is not None:
+                tunnel.close()
+        raise errors[0]
+    return [tunnel for _, tunnel in sorted(tunnels, key=lambda answer: answer[0]) if tunnel is not None]
+
+
+async def acheck_proxy(
+    ip: str,
+    port: int | str,
+    race: bool = settings.CHECKER_RACE_PROTOCOLS,
+    protocols: Sequence[str] = PROTOCOLS,
+    timeout: float | None = None,
+    tunnels: Mapping[str, PendingTunnel] | None = None,
+) -> CheckProxyResultTypedDict:
+    """Asyncio version of check_proxy(), the inspector requests are sent without blocking the event loop.
+    The pending `tunnels` of the prefilter handshakes, by protocol, are used for the requests of their protocol.
+
+    When `race` is set, all protocols are probed at once: the first working response wins and the remaining probes
+    are cancelled. Protocols that had already answered successfully by then are recorded in `protocols`.
+    """
+    logger.debug(f"Checking proxy {ip}:{port} ...")
+
+    result = get_check_proxy_result(ip, port)
+    tunnels = tunnels or {}
+
+    if not race:
+        for protocol in protocols:
+            protocol, response, elapsed_time = await probe_proxy(ip, port, protocol, timeout, tunnels.get(protocol))
+            if not response:
+                continue
+
+            set_check_proxy_result(result, protocol, response, elapsed_time)
+            break
+
+        return result
+
+    probes = [
+        asyncio.create_task(probe_proxy(ip, port, protocol, timeout, tunnels.get(protocol))) for protocol in protocols
+    ]
+    try:
+        for probe in asyncio.as_completed(probes):
+            protocol, response, elapsed_time = await probe
+            if not response:
+                continue
+
+            set_check_proxy_result(result, protocol, response, elapsed_time)
+            break
+    finally:
+        working = [
+            p.result()[0] for p in probes if p.done() and not p.cancelled() and not p.exception() and p.result()[1]
+        ]
+        for probe in probes:
+            probe.cancel()
+        await asyncio.gather(*probes, return_exceptions=True)
+
+    if result["is_working"]:
+        result["protocols"] = [protocol for protocol in protocols if protocol in working]
+
+    return result
+
+
+class CheckLimiter:
+    """Semaphore limiting the number of proxies checked at the same time across the event loops of the process.
+
+    Each task checking proxies runs its own event loop, in its own thread with the threads pool of the workers, so an
+    asyncio.Semaphore would only limit the checks of a single task. The slots are handed over to the waiters in order,
+    waking them up on their own event loop.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.active = 0
+        self.lock = threading.Lock()
+        self.waiters: collections.deque[tuple[asyncio.AbstractEventLoop, asyncio.Future[None]]] = collections.deque()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if self.active < self.limit and not self.waiters:
+                self.active += 1
+                return
+            waiter = (loop, loop.create_future())
+            self.waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    raise
+            self.release()  # cancelled once the slot was handed over, handed over to the next waiter instead
+            raise
+
+    def release(self) -> None:
+        with self.lock:
+            while self.waiters:
+                loop, future = self.waiters.popleft()
+                with contextlib.suppress(RuntimeError):  # the event loop of the waiter is closed
+                    loop.call_soon_threadsafe(self.wake, future)
+                    return
+            self.active -= 1
+
+    @staticmethod
+    def wake(future: asyncio.Future[None]) -> None:
+        if not future.done():  # cancelled meanwhile, see acquire()
+            future.set_result(None)
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+check_limiter = CheckLimiter(settings.CHECKER_CONCURRENCY)
+
+
+async def acheck_proxies(
+    proxies: Iterable[ProxyTypedDict | CheckedProxyTypedDict],
+    concurrency: int | None = None,
+    prefilter: bool = settings.CHECKER_PREFILTER,
+) -> list[CheckProxyResultTypedDict]:
+    """Checks the given proxies concurrently, with at most CHECKER_CONCURRENCY proxies being checked at the same time
+    in the process (see CheckLimiter), or at most `concurrency` proxies by this call if given.
+
+    With `prefilter`, only the proxies answering a handshake are checked, starting with the fastest protocol.
+    Each proxy is checked with its own timeout, see get_proxy_timeout().
+    """
+    limiter = CheckLimiter(concurrency) if concurrency else check_limiter
+
+    async def bounded_check_proxy(ip: str, port: int | str, timeout: float | None) -> CheckProxyResultTypedDict:
+        async with limiter.slot():
+            if not prefilter:
+                return await acheck_proxy(ip, port, timeout=timeout)
+
+            tunnels = await prefilter_proxy(ip, port)
+            if not tunnels:
+                logger.debug(f"Proxy {ip}:{port} did not answer any handshake")
+                return get_check_proxy_result(ip, port)
+            try:
+                protocols = [tunnel.protocol for tunnel in tunnels]
+                by_protocol = {tunnel.protocol: tunnel for tunnel in tunnels}
+                return await acheck_proxy(ip, port, protocols=protocols, timeout=timeout, tunnels=by_protocol)
+            finally:
+                for tunnel in tunnels:  # the protocols not tried, once a faster one worked
+                    tunnel.close()
+
+    return await asyncio.gather(
+        *(bounded_check_proxy(proxy["ip"], proxy["port"], get_proxy_timeout(proxy)) for proxy in proxies)
+    )
+
+
+def check_proxies(
+    proxies: Iterable[ProxyTypedDict | CheckedProxyTypedDict],
+    concurrency: int | None = None,
+    prefilter: bool = settings.CHECKER_PREFILTER,
+) -> list[CheckProxyResultTypedDict]:
+    """Checks the given proxies concurrently in a new event loop, results are returned in the same order."""
+    return asyncio.run(acheck_proxies(proxies, concurrency=concurrency, prefilter=prefilter))
+
+
+def get_checked_proxy(
+    proxy: ProxyTypedDict | CheckedProxyTypedDict,
+    checked_proxy: CheckProxyResultTypedDict,
+    timestamp: datetime,
+) -> CheckedProxyTypedDict:
+    """Returns the proxy updated with the check result, ready to be saved."""
+    result = CheckedProxyTypedDict(**proxy)  # type: ignore[typeddict-item]
+    result.setdefault("check_fail_count", 0)
+    result.setdefault("last_checked_at", None)
+    result.setdefault("last_worked_at", None)
+    result["is_active"] = False
+
+    if checked_proxy["is_working"]:
+        if not result.get("protocol"):
+            result["protocol"] = checked_proxy["protocol"]
+        elif "http" in result["protocol"] and "socks" in checked_proxy["protocol"]:  # type: ignore[operator]
+            result["protocol"] = checked_proxy["protocol"]
+        elif "socks" in result["protocol"] and "http" in checked_proxy["protocol"]:  # type: ignore[operator]
+            result["protocol"] = checked_proxy["protocol"]
+
+        if not result.get("country") and checked_proxy["country"]:
+            result["country"] = checked_proxy["country"]
+        elif result["country"] != checked_proxy["country"] and checked_proxy["country"]:
+            result["country"] = checked_proxy["country"]
+
+        result["anonymity"] = checked_proxy["anonymity"]
+        result.update({"is_active": True, "last_worked_at": timestamp, "check_fail_count": 0})
+        result["latency"] = checked_proxy["speed"]
+
+    else:  # increment the fail count
+        result["check_fail_count"] += 1
+
+    # keep a rolling history of the recent check latencies, failed checks are recorded as None
+    latency = checked_proxy["speed"] if checked_proxy["is_working"] else None
+    result["latency_history"] = [*result.get("latency_history", []), latency][-settings.PROXY_LATENCY_HISTORY_SIZE :]
+    result["last_checked_at"] = timestamp
+    return result
+
+
+def get_port(proxy: Mapping[str, Any]) -> int | None:
+    """Returns the port of the given proxy dict as int, None if it is missing or invalid."""
+    try:
+        return int(proxy["port"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+EXPORT_FIELDS = ("ip", "port", "protocol", "country", "anonymity", "latency", "last_checked_at", "last_worked_at")
+
+
+def format_proxies(proxies: Iterable[Mapping[str, Any]], output: str) -> str:
+    """Returns the given proxy dicts formatted as `output`, one proxy per line.
+
+    Outputs are `txt` (ip:port), `url` (protocol://ip:port), `csv` (the EXPORT_FIELDS, see get_export_header()) or
+    `ndjson`.
+    """
+    if output == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([proxy[field] for field in EXPORT_FIELDS] for proxy in proxies)
+        return buffer.getvalue()
+    if output == "url":
+        return "".join(f"{proxy['protocol']}://{proxy['ip']}:{proxy['port']}\n" for proxy in proxies)
+    if output == "ndjson":
+        return "".join(
+            json.dumps({field: proxy[field] for field in EXPORT_FIELDS}, cls=DjangoJSONEncoder) + "\n"
+            for proxy in proxies
+        )
+    return "".join(f"{proxy['ip']}:{proxy['port']}\n" for proxy in proxies)
+
+
+def get_export_header(output: str) -> str:
+    """Returns the header line of the `output` format, the EXPORT_FIELDS for csv, empty for the others."""
+    if output != "csv":
+        return ""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(EXPORT_FIELDS)
+    return buffer.getvalue()
+
+
+def export_proxies(batches: Iterable[Iterable[Mapping[str, Any]]], output: str) -> Iterator[str]:
+    """Yields the header of the `output` format, then each batch of proxy dicts formatted as `output`."""
+    if header := get_export_header(output):
+        yield header
+    for batch in batches:
+        yield format_proxies(batch, output)
+
+
+async def aexport_proxies(batches: AsyncIterable[Iterable[Mapping[str, Any]]], output: str) -> AsyncIterator[str]:
+    """Asynchronous version of export_proxies(), for the batches read asynchronously."""
+    if header := get_export_header(output):
+        yield header
+    async for batch in batches:
+        yield format_proxies(batch, output)
+
+
+def get_random_key() -> float:
+    """Returns a random number in [0, 1), the random key of a proxy."""
+    return random.random()
+
+
+def is_valid_proxy(proxy: Mapping[str, Any] | None) -> bool:
+    """Returns True if the given proxy dict has a valid ip address and port (1-65535), False otherwise."""
+    if not proxy:
+        return False
+    try:
+        ipaddress.ip_address(proxy.get("ip") or "")
+    except ValueError:
+        return False
+    port = get_port(proxy)
+    return port is not None and 0 < port < 65536
+
+
+def normalize_proxy(item: Any) -> ProxyTypedDict | None:
+    """Returns the scraped item as a proxy dict, None if it is not a valid proxy.
+
+    The ip is stripped, the port is an int, and the optional fields are stripped (protocol and anonymity lowercased),
+    empty optional fields are left out so the model defaults apply. Unknown fields are dropped.
+    """
+    if not isinstance(item, dict):
+        return None
+
+    proxy: dict[str, Any] = {"ip": str(item.get("ip") or "").strip(), "port": get_port(item)}
+    for field in ["protocol", "country", "anonymity", "source"]:
+        value = str(item.get(field) or "").strip()
+        if value:
+            proxy[field] = value.lower() if field in ["protocol", "anonymity"] else value
+    return proxy if is_valid_proxy(proxy) else None  # type: ignore[return-value]
+
+
+def read_proxies(lines: Iterable[bytes | str]) -> Iterator[ProxyTypedDict]:
+    """Yields the valid proxies from the given jsonlist lines as they are read, see normalize_proxy()."""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            logger.warning("Skipping invalid json on line %s", number)
+            continue
+        if (proxy := normalize_proxy(item)) is not None:
+            yield proxy
+
+
 def remove_duplicates(
     items: Sequence[dict[str, Any] | ProxyTypedDict | CheckedProxyTypedDict],
     unique_keys: Sequence[str],
@@ -73,27 +542,99 @@ def remove_duplicates(
     return unique_items
 
 
-def get_country_code(name: str, regex: bool = False) -> str:
-    """Returns the country code for the given country name if found, empty string otherwise.
+class CountryResolver:
+    """Resolves country names to country codes (ISO 3166-1 alpha-2) with a lookup index, built once on first use.
 
-    WARNING: This function is not reliable, it returns the first country code matched.
+    The index holds the aliases (COUNTRY_ALIASES), the names, official names, old names and alpha-3 codes of the
+    countries, all normalized (case, diacritics and punctuation folded). Names are also indexed reordered around their
+    comma or parenthesis ("Korea (the Republic of)" as "Republic of Korea" and "Korea, Republic of") and without their
+    parenthesis ("Bolivia"), when the variant is unambiguous.
+    Names not in the index resolve to the single country whose indexed names contain all of their words, if any,
+    and these misses are kept in a LRU cache.
+
+    A name resolving to several countries resolves to the first of them by priority (aliases, names, official names,
+    old names, alpha-3 codes, then variants) and code, so the results are deterministic.
     """
-    if not name:
-        return ""
 
-    # sites where they have partial names and `countries` can't lookup properly below
-    if name.lower() in ["america", "united states", "usa"]:
-        return "US"
+    def __init__(self, aliases: Mapping[str, str] | None = None, cache_size: int = 1024) -> None:
+        self.aliases = aliases
+        self._index: dict[str, str] | None = None
+        self.resolve_miss = functools.lru_cache(maxsize=cache_size)(self._resolve_miss)
 
-    c = countries.by_name(name, regex=regex)  # type: ignore[call-overload]
+    @staticmethod
+    def normalize(name: str) -> str:
+        """Returns the name casefolded, without diacritics, punctuation and "the", words separated by single spaces."""
+        name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+        words = re.sub(r"[\W_]+", " ", name.casefold().replace("&", " and ")).split()
+        return " ".join(word for word in words if word != "the")
 
-    if not c:
-        return ""
+    @staticmethod
+    def get_variants(name: str) -> list[str]:
+        """Returns the variants of the name, reordered around its comma or parenthesis and without its parenthesis."""
+        variants = []
+        if match := re.fullmatch(r"(.+?)\s*\((.+)\)", name):
+            base, inner = match.groups()
+            variants.extend([base, f"{inner} {base}", f"{base} {inner}"])
+        if ", " in name:
+            head, tail = name.split(", ", 1)
+            variants.append(f"{tail} {head}")
+        return variants
+
+    def build_index(self) -> dict[str, str]:
+        """Returns the normalized names of the countries mapped to their codes, see CountryResolver."""
+        aliases = settings.COUNTRY_ALIASES if self.aliases is None else self.aliases
+        with translation.override("en"):  # names are indexed in english, whatever the active language
+            names = {code: str(name) for code, name in countries.countries.items()}
+            official = {code: str(name) for code, name in COUNTRIES.items()}
+            old = [(str(name), code) for code, old_names in countries.OLD_NAMES.items() for name in old_names]
+        codes = sorted(names)
+
+        groups = [
+            [(name, code) for name, code in aliases.items()],
+            [(names[code], code) for code in codes],
+            [(official[code], code) for code in codes if code in official],
+            sorted(old, key=lambda item: item[1]),
+            [(countries.alpha3(code), code) for code in codes],
+        ]
+        index: dict[str, str] = {}
+        for group in groups:
+            for name, code in group:
+                index.setdefault(self.normalize(name), code.upper())
+
+        variants: dict[str, set[str]] = {}
+        for group in groups[1:4]:
+            for name, code in group:
+                for variant in self.get_variants(name):
+                    variants.setdefault(self.normalize(variant), set()).add(code)
+        for key, variant_codes in variants.items():
+            if len(variant_codes) == 1:  # e.g. "korea" is left out, it is the variant of two countries
+                index.setdefault(key, variant_codes.pop())
+
+        index.pop("", None)
+        return index
+
+    @property
+    def index(self) -> dict[str, str]:
+        if self._index is None:
+            self._index = self.build_index()
+        return self._index
+
+    def _resolve_miss(self, key: str) -> str:
+        words = set(key.split())
+        codes = {code for name, code in self.index.items() if words <= set(name.split())}
+        return codes.pop() if len(codes) == 1 else ""
+
+    def resolve(self, name: str) -> str:
+        """Returns the country code for the given country name if found, empty string otherwise."""
+        key = self.normalize(name)
+        if not key:
+            return ""
+        return self.index.get(key) or self.resolve_miss(key)
+
+
+country_resolver = CountryResolver()
 
-    if isinstance(c, str):  # when regex=False, c is a str
-        return c
-    elif isinstance(c, list | tuple | set):
-        # WARNING: highly unreliable - returns the first country code matched
-        return c[0]  # type: ignore
 
-    return ""
+def get_country_code(name: str) -> str:
+    """Returns the country code for the given country name if found, empty string otherwise, see CountryResolver."""
+    return country_resolver.resolve(name) if name else ""
@@ -1,6 +1,14 @@
-import random
-from collections.abc import Sequence
+from collections.abc import AsyncIterator, Iterator, Sequence
+from datetime import datetime, timedelta
+from typing import Any
 
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django_filters.rest_framework import DjangoFilterBackend
+from django_filters.utils import translate_validation
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, extend_schema
 from rest_framework import viewsets
@@ -12,8 +20,50 @@ from rest_framework.serializers import BaseSerializer
 from rest_framework.throttling import BaseThrottle, ScopedRateThrottle
 
 from config.enums import AnonymityEnums, ProtocolEnums
-from proxy.models import Proxy
-from proxy.serializers import ProxyRandomSerializer, ProxySerializer
+from config.pagination import PageNumberOrCursorPagination
+from proxy.models import Proxy, ProxyVersion
+from proxy.pool import FILTERS, proxy_pool
+from proxy.serializers import (
+    ProxyExportQuerySerializer,
+    ProxyRandomQuerySerializer,
+    ProxyRandomSerializer,
+    ProxySerializer,
+)
+from proxy.utils import EXPORT_FIELDS, aexport_proxies, export_proxies
+
+
+def get_version(request: Request) -> ProxyVersion | None:
+    """Returns the version of the proxies, read from the database once per request.
+
+    Every write of the proxies bumps it within its transaction, so it changes with each committed write, whichever
+    process makes it and in whatever order the writes commit.
+    """
+    if not hasattr(request, "proxies_version"):
+        request.proxies_version = ProxyVersion.objects.current()  # type: ignore[attr-defined]
+    return request.proxies_version  # type: ignore[no-any-return]
+
+
+def get_etag(request: Request, *args: Any, **kwargs: Any) -> str:
+    """Returns the ETag of the proxy read requests, the version and revision of the proxies."""
+    version = get_version(request)
+    return f"{version.version.hex}-{version.revision}" if version else "0"
+
+
+def get_last_modified(request: Request, *args: Any, **kwargs: Any) -> datetime | None:
+    """Returns the Last-Modified of the proxy read requests, the time the proxies were last modified.
+
+    Rounded up to the next second, the precision of the header, so that it is never earlier than the last write. Writes
+    within the same second are told apart by the ETag, checked first when the client sends both.
+    """
+    version = get_version(request)
+    modified_at = version.updated_at if version else None
+    if modified_at is None or not modified_at.microsecond:
+        return modified_at
+    return modified_at.replace(microsecond=0) + timedelta(seconds=1)
+
+
+# answer with 304 Not Modified when the proxies were not modified since the client read them, before querying them
+conditional = method_decorator(condition(etag_func=get_etag, last_modified_func=get_last_modified))
 
 
 class ProxyViewSet(viewsets.ModelViewSet):  # type: ignore
@@ -21,6 +71,7 @@ class ProxyViewSet(viewsets.ModelViewSet):  # type: ignore
     serializer_class = ProxySerializer
     permission_classes = [IsAuthenticated]
     filterset_fields = ["protocol", "country", "anonymity"]
+    pagination_class = PageNumberOrCursorPagination  # ?pagination=cursor for deep pages without a count query
     throttle_scope = "proxies_random"  # for use with ScopedRateThrottle for /proxies/random/ endpoint
 
     def get_permissions(self) -> Sequence[IsAuthenticated | AllowAny | BasePermission]:
@@ -35,6 +86,14 @@ class ProxyViewSet(viewsets.ModelViewSet):  # type: ignore
             return [ScopedRateThrottle()]
         return super().get_throttles()
 
+    @conditional
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        return super().list(request, *args, **kwargs)
+
+    @conditional
+    def retrieve(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        return super().retrieve(request, *args, **kwargs)
+
     def get_serializer_class(self) -> type[ProxySerializer | ProxyRandomSerializer | BaseSerializer]:  # type: ignore
         """Return serializer class based on action"""
         if self.action in ["random"]:
@@ -46,18 +105,88 @@ class ProxyViewSet(viewsets.ModelViewSet):  # type: ignore
             OpenApiParameter("protocol", OpenApiTypes.STR, OpenApiParameter.QUERY, enum=ProtocolEnums.values),
             OpenApiParameter("country", OpenApiTypes.STR, OpenApiParameter.QUERY, pattern=r"^[A-Z]{2}$"),
             OpenApiParameter("anonymity", OpenApiTypes.STR, OpenApiParameter.QUERY, enum=AnonymityEnums.values),
+            OpenApiParameter(
+                "count",
+                OpenApiTypes.INT,
+                OpenApiParameter.QUERY,
+                description="Number of distinct proxies to return as a list, up to PROXY_RANDOM_MAX_COUNT",
+            ),
+            OpenApiParameter(
+                "exclude",
+                OpenApiTypes.STR,
+                OpenApiParameter.QUERY,
+                many=True,
+                description="Proxies not to return, as ip:port, repeated or comma separated",
+            ),
+            OpenApiParameter(
+                "weighted",
+                OpenApiTypes.BOOL,
+                OpenApiParameter.QUERY,
+                description="Draw the proxies in proportion to their success rate, latency and recency",
+            ),
         ]
     )
     @action(detail=False, methods=["get"])
     def random(self, request: Request) -> Response:
-        """/proxies/random/"""
-        qs = self.filter_queryset(self.get_queryset().filter(is_active=True))
-        if not qs.exists():
-            return Response({"message": "No active proxies found."})
+        """/proxies/random/
+
+        With `count`, a list of up to `count` distinct proxies is returned instead of a single proxy.
+        """
+        query = ProxyRandomQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        count, exclude = query.validated_data.get("count"), query.validated_data.get("exclude", set())
+        weighted = query.validated_data["weighted"]
 
-        pk_list = qs.values_list("pk", flat=True)
-        pk_random = random.choice(pk_list)
-        proxy = qs.values("ip", "port", "protocol", "country", "anonymity").get(pk=pk_random)
+        if settings.PROXY_POOL_ENABLED:  # served from memory, the filters are validated as the filterset would
+            filterset = DjangoFilterBackend().get_filterset(request, self.get_queryset(), self)
+            if not filterset.is_valid():
+                raise translate_validation(filterset.errors)
+            filters = {name: filterset.form.cleaned_data.get(name) for name in FILTERS}
+            proxies = proxy_pool.sample(count or 1, exclude=exclude, weighted=weighted, **filters)
+        else:
+            qs = self.filter_queryset(self.get_queryset().filter(is_active=True))
+            fields = ("ip", "port", "protocol", "country", "anonymity")
+            proxies = qs.sample_random(  # type: ignore[attr-defined]
+                count or 1, *fields, exclude=exclude, weighted=weighted
+            )
+
+        if count is not None:
+            return Response(self.get_serializer(proxies, many=True).data)
+        if not proxies:
+            return Response({"message": "No active proxies found."})
 
-        serializer = self.get_serializer(proxy)
+        serializer = self.get_serializer(proxies[0])
         return Response(serializer.data)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter("output", OpenApiTypes.STR, OpenApiParameter.QUERY, enum=["txt", "url", "csv", "ndjson"]),
+        ],
+        responses={(200, "text/plain"): OpenApiTypes.STR},
+    )
+    @action(detail=False, methods=["get"])
+    @conditional
+    def export(self, request: Request) -> StreamingHttpResponse:
+        """/proxies/export/
+
+        Streams all the active proxies matching the filters, as `ip:port` (txt), `protocol://ip:port` (url), csv or
+        ndjson lines, read in batches of PROXY_EXPORT_CHUNK_SIZE proxies as the response is sent.
+        """
+        query = ProxyExportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        output = query.validated_data["output"]
+
+        chunk_size = settings.PROXY_EXPORT_CHUNK_SIZE
+        qs = self.filter_queryset(self.get_queryset().filter(is_active=True))
+        # served by ASGI, a synchronous iterator would be consumed into a list, loading all the proxies in memory
+        content: Iterator[str] | AsyncIterator[str]
+        if isinstance(request._request, ASGIRequest):
+            content = aexport_proxies(qs.abatches(EXPORT_FIELDS, chunk_size), output)  # type: ignore[attr-defined]
+        else:
+            content = export_proxies(qs.batches(EXPORT_FIELDS, chunk_size), output)  # type: ignore[attr-defined]
+
+        content_types = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+        response = StreamingHttpResponse(content, content_type=content_types.get(output, "text/plain"))
+        extension = output if output in content_types else "txt"
+        response["Content-Disposition"] = f'attachment; filename="proxies.{extension}"'
+        return response